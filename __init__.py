@@ -65,36 +65,77 @@ bl_info = {
     "tracker_url": "https://github.com/COTILab/BlenderPhotonics/issues",
     "category": "User Interface",
 }
-import bpy
-from .ui import BlenderPhotonics_UI
-from .blender2mesh import scene2mesh
-from .mesh2blender import mesh2scene
-from .obj2surf import object2surf
-from .runmmc import runmmc
-from .niifile import niifile
-from .nii2mesh import nii2mesh
-from bpy.props import PointerProperty
+try:
+    import bpy
+except ImportError:
+    # imported outside of Blender, e.g. "python -m BlenderPhotonics.batch"
+    bpy = None
+
+if bpy is not None:
+    from .ui import BlenderPhotonics_UI
+    from .blender2mesh import scene2mesh, BLENDER2MESH_OT_invoke_saveas
+    from .mesh2blender import mesh2scene
+    from .obj2surf import (
+        object2surf,
+        OBJECT2SURF_OT_invoke_export,
+        OBJECT2SURF_OT_invoke_import,
+    )
+    from .runmmc import runmmc, loadmmcresult, UpdateFluxFrame, CloseFluxFrames
+    from .niifile import niifile
+    from .nii2mesh import nii2mesh
+    from .jobqueue import jobmonitor, canceljob
+    from .meshlod import lodfulldetail, RegisterLODHandlers, UnregisterLODHandlers
+    from .utils import (
+        PrewarmBackendTimer,
+        CloseBackendEngines,
+        RegisterGeometryWatch,
+        UnregisterGeometryWatch,
+    )
+    from bpy.props import PointerProperty
 
 
 def register():
     print("Registering BlenderPhotonics")
     bpy.utils.register_class(scene2mesh)
+    bpy.utils.register_class(BLENDER2MESH_OT_invoke_saveas)
     bpy.utils.register_class(object2surf)
+    bpy.utils.register_class(OBJECT2SURF_OT_invoke_export)
+    bpy.utils.register_class(OBJECT2SURF_OT_invoke_import)
     bpy.utils.register_class(niifile)
     bpy.utils.register_class(nii2mesh)
     bpy.utils.register_class(mesh2scene)
     bpy.utils.register_class(runmmc)
+    bpy.utils.register_class(loadmmcresult)
+    bpy.utils.register_class(jobmonitor)
+    bpy.utils.register_class(canceljob)
+    bpy.utils.register_class(lodfulldetail)
     bpy.utils.register_class(BlenderPhotonics_UI)
     bpy.types.Scene.blender_photonics = PointerProperty(type=niifile)
+    bpy.app.timers.register(PrewarmBackendTimer, first_interval=1.0)
+    RegisterLODHandlers()
+    RegisterGeometryWatch()
 
 
 def unregister():
     print("Unregistering BlenderPhotonics")
     bpy.utils.unregister_class(scene2mesh)
+    bpy.utils.unregister_class(BLENDER2MESH_OT_invoke_saveas)
     bpy.utils.unregister_class(object2surf)
+    bpy.utils.unregister_class(OBJECT2SURF_OT_invoke_export)
+    bpy.utils.unregister_class(OBJECT2SURF_OT_invoke_import)
     bpy.utils.unregister_class(niifile)
     bpy.utils.unregister_class(nii2mesh)
     bpy.utils.unregister_class(mesh2scene)
     bpy.utils.unregister_class(runmmc)
+    bpy.utils.unregister_class(loadmmcresult)
+    bpy.utils.unregister_class(jobmonitor)
+    bpy.utils.unregister_class(canceljob)
+    bpy.utils.unregister_class(lodfulldetail)
     bpy.utils.unregister_class(BlenderPhotonics_UI)
     del bpy.types.Scene.blender_photonics
+    if UpdateFluxFrame in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(UpdateFluxFrame)
+    CloseFluxFrames()
+    UnregisterLODHandlers()
+    UnregisterGeometryWatch()
+    CloseBackendEngines()
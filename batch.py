@@ -0,0 +1,441 @@
+"""Batch - headless driver running the meshing and MMC pipeline over a manifest
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+Usage:
+
+    blender -b --python batch.py -- manifest.json [-n workers] [-o outputdir]
+    python -m BlenderPhotonics.batch manifest.json [-n workers] [-o outputdir]
+
+The manifest is a JSON file of the below form; "defaults" is merged into
+every job, and each entry of an optional "sweep" list is merged into a copy
+of its job to create one sub-job per entry:
+
+    {
+      "backend": "octave", "workers": 4, "output": "results",
+      "exchange": "bmsh", "compression": "", "cachesize": 2048,
+      "defaults": {"mesh": {"maxvol": 100}, "prop": [[0.01, 1, 0.9, 1.37]],
+                   "cfg": {"nphoton": 1e6, "srcpos": [30, 30, 60]}},
+      "jobs": [
+        {"name": "head", "volume": "head.nii.gz",
+         "sweep": [{"cfg": {"srcpos": [20, 30, 60]}}, {"cfg": {"srcpos": [40, 30, 60]}}]},
+        {"name": "phantom", "scene": "phantom.blend", "mesh": {"maxvol": 1.0}},
+        {"name": "meshonly", "volume": "brain.jnii", "mmc": false}
+      ]
+    }
+
+"prop" holds the [mua, mus, g, n] rows of regions 1, 2, ...; regions
+beyond the end of the list use its last row.
+
+A job reads either a 3-D volume ("volume", same formats as the Volume2Mesh
+panel) or a Blender scene ("scene", exported by a separate Blender process).
+Each worker thread drives its own backend session, so N workers run N
+Octave/MATLAB processes in parallel; every job writes to its own folder under
+the output folder, and a summary.json records the status and timings of all
+jobs.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import shutil
+import argparse
+import importlib
+import subprocess
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__" and not __package__:
+    # run as a script, e.g. "blender -b --python batch.py", import as part of the package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    importlib.import_module(__package__)
+
+import jdata as jd
+from .utils import (
+    GetBackendEngine,
+    MarkBackendFailed,
+    SetBackendWorkFolder,
+    CloseBackendEngines,
+    FindExchangeFile,
+    GetMeshOutputFiles,
+    GetExchangeFile,
+)
+from .resultcache import GetResultCache, HashData, HashFile, MAT_HEADER_SIZE
+from .tetindex import FindSourceElem
+from .niireader import PrepareVolume
+from .meshface import LoadTetMeshData
+
+# same defaults as the Blender2Mesh, Volume2Mesh and RunMMC dialogs
+g_scenemesh = {
+    "maxvol": 1.0,
+    "keepratio": 1.0,
+    "mergetol": 0,
+    "dorepair": False,
+    "convtri": True,
+    "tetgenopt": "",
+}
+g_volumemesh = {
+    "maxvol": 100,
+    "radbound": 10,
+    "distbound": 1.0,
+    "isovalue": 0.5,
+    "imagetype": "multi-label",
+    "method": "auto",
+    "crop": True,
+    "downsample": 1,
+}
+g_mmccfg = {
+    "srctype": "pencil",
+    "srcpos": [0, 0, 0],
+    "srcdir": [1, 0, 0, 0],
+    "srcparam1": [0, 0, 0, 0],
+    "srcparam2": [0, 0, 0, 0],
+    "nphoton": 10000,
+    "unitinmm": 1.0,
+    "tend": 5e-9,
+    "tstep": 5e-9,
+    "isreflect": True,
+    "isnormalized": True,
+    "method": "elem",
+    "outputtype": "flux",
+    "basisorder": 1,
+    "debuglevel": "TP",
+    "gpuid": "1",
+}
+g_prop = [[0.005, 1.0, 0.01, 1.37]]  # mua, mus, g, n
+g_workers = 1
+g_output = "bpbatch"
+
+# the scene is exported through Step 5 of the Blender2Mesh operator
+g_sceneexport = """
+import sys, bpy
+sys.path.insert(0, {parentdir!r})
+import importlib
+bp = importlib.import_module({package!r})
+try:
+    bp.register()
+except ValueError:
+    pass  # the add-on is already enabled in this Blender installation
+bpy.ops.blenderphotonics.create3dmesh(endstep="5", background=False, **{param!r})
+"""
+
+
+def PadProp(prop, nregion):
+    # one row per mesh region, the last row is repeated for the remaining ones
+    prop = [list(row) for row in prop]
+    return prop + [prop[-1]] * (nregion - len(prop))
+
+
+def MergeParam(base, update):
+    # recursively merge dictionaries, other values in update replace those in base
+    merged = copy.deepcopy(base)
+    for key, val in update.items():
+        if isinstance(val, dict) and isinstance(merged.get(key), dict):
+            merged[key] = MergeParam(merged[key], val)
+        else:
+            merged[key] = copy.deepcopy(val)
+    return merged
+
+
+def ExpandJobs(manifest, rootdir):
+    """Return the list of jobs in a manifest after applying defaults and sweeps"""
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for i, entry in enumerate(manifest.get("jobs", [])):
+        job = MergeParam(defaults, entry)
+        job.setdefault("name", "job%d" % (i + 1))
+        for key in ("volume", "scene"):
+            if key in job and not job[key].startswith("http"):
+                job[key] = os.path.join(rootdir, job[key])
+        if "volume" not in job and "scene" not in job:
+            raise ValueError(
+                "job '%s' must define either 'volume' or 'scene'" % job["name"]
+            )
+
+        sweep = job.pop("sweep", None)
+        if not sweep:
+            jobs.append(job)
+            continue
+        for k, variant in enumerate(sweep):
+            subjob = MergeParam(job, variant)
+            subjob["name"] = "%s_%d" % (job["name"], k + 1)
+            jobs.append(subjob)
+
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("job names in the manifest must be unique")
+    return jobs
+
+
+class BatchRunner:
+    def __init__(self, manifest, rootdir, workers=None, outputdir=None):
+        self.manifest = manifest
+        self.backend = manifest.get("backend", "octave")
+        self.workers = max(int(workers or manifest.get("workers", g_workers)), 1)
+        self.outputdir = os.path.abspath(
+            os.path.join(rootdir, outputdir or manifest.get("output", g_output))
+        )
+        self.exchange = {
+            "exchange": manifest.get("exchange", "jmsh"),
+            "compression": manifest.get("compression", ""),
+        }
+        self.blender = manifest.get("blender")
+        cachesize = manifest.get("cachesize", 2048)
+        self.meshcache = GetResultCache("mesh", cachesize)
+        self.mmccache = GetResultCache("mmc", cachesize)
+        self.jobs = ExpandJobs(manifest, rootdir)
+        self.slots = queue.Queue()
+        for slot in range(self.workers):
+            self.slots.put(slot)
+
+    def feval(self, oc, logfile, func, *args):
+        if hasattr(oc, "exit"):
+            with open(logfile, "a") as fp:
+                return oc.feval(
+                    func,
+                    *args,
+                    nargout=0,
+                    stream_handler=lambda line: fp.write(line + "\n")
+                )
+        return oc.feval(func, *args, nargout=0)
+
+    def blenderpath(self):
+        if self.blender:
+            return self.blender
+        try:
+            import bpy
+
+            return bpy.app.binary_path
+        except ImportError:
+            pass
+        blender = shutil.which("blender")
+        if blender is None:
+            raise FileNotFoundError(
+                "can not find the blender executable, please set 'blender' in the manifest"
+            )
+        return blender
+
+    def exportscene(self, job, jobdir):
+        # Blender operators need the scene loaded in the main thread, use a separate process
+        pkgdir = os.path.dirname(os.path.abspath(__file__))
+        param = {key: job["mesh"][key] for key in g_scenemesh}
+        script = g_sceneexport.format(
+            parentdir=os.path.dirname(pkgdir),
+            package=os.path.basename(pkgdir),
+            param=param,
+        )
+        env = dict(os.environ, BLENDERPHOTONICS_WORKDIR=jobdir)
+        with open(os.path.join(jobdir, "blender.log"), "w") as fp:
+            subprocess.run(
+                [self.blenderpath(), "-b", job["scene"], "--python-expr", script],
+                env=env,
+                stdout=fp,
+                stderr=subprocess.STDOUT,
+                check=True,
+            )
+        return FindExchangeFile("blendermesh", "mesh", jobdir)
+
+    def mesh(self, oc, job, jobdir, logfile):
+        if "scene" in job:
+            job["mesh"] = MergeParam(g_scenemesh, job.get("mesh", {}))
+            meshfile = self.exportscene(job, jobdir)
+            # the exported geometry already holds the meshing parameters
+            cachekey = HashData(HashFile(meshfile).hexdigest())
+            if self.meshcache.restore(cachekey, jobdir) is not None:
+                return "cached"
+            self.feval(oc, logfile, "blender2mesh", meshfile)
+        else:
+            volparam = MergeParam(g_volumemesh, job.get("mesh", {}))
+            paramfile = os.path.join(jobdir, "niipath.json")
+            cachekey = None
+            if os.path.isfile(job["volume"]):
+                cachekey = HashData(HashFile(job["volume"]).hexdigest(), volparam)
+                if self.meshcache.restore(cachekey, jobdir) is not None:
+                    return "cached"
+            volinfo = PrepareVolume(job["volume"], volparam, jobdir)
+            jd.save({**volparam, **volinfo, **self.exchange}, paramfile)
+            self.feval(oc, logfile, "nii2mesh", paramfile)
+        if cachekey is not None:
+            self.meshcache.store(cachekey, GetMeshOutputFiles(jobdir))
+        return "finished"
+
+    def mmc(self, oc, job, jobdir, logfile):
+        cfg = MergeParam(g_mmccfg, job.get("cfg", {}))
+        paramfile = os.path.join(jobdir, "mmcinfo.json")
+        meshfile = os.path.join(jobdir, "meshdata.mat")
+        _, elem = LoadTetMeshData(jobdir)
+        prop = PadProp(job.get("prop", g_prop), int(elem[:, 4].max()))
+        jd.save({"prop": prop, "cfg": cfg, **self.exchange}, paramfile)
+
+        meshkey = HashFile(meshfile, offset=MAT_HEADER_SIZE).hexdigest()
+        cachekey = HashData(meshkey, prop, cfg)
+        if self.mmccache.restore(cachekey, jobdir) is not None:
+            return "cached"
+        if cfg["srctype"] in ("pencil", "isotropic", "cone"):
+            # locate the source element with the spatial index instead of tsearchn
+            try:
+                e0 = int(FindSourceElem(meshkey, [cfg["srcpos"]], jobdir)[0])
+                jd.save(
+                    {"prop": prop, "cfg": {**cfg, "e0": e0}, **self.exchange}, paramfile
+                )
+            except FileNotFoundError:
+                pass
+        self.feval(oc, logfile, "blendermmc", paramfile, meshfile)
+        files = GetMeshOutputFiles(jobdir) + [
+            paramfile,
+            os.path.join(jobdir, "mmcflux.bin"),
+        ]
+        for fmt in ("jmsh", "bmsh"):
+            files.append(GetExchangeFile("mmcoutput", "data", fmt, jobdir))
+        self.mmccache.store(
+            cachekey,
+            files,
+            {
+                "nphoton": cfg["nphoton"],
+                "srctype": cfg["srctype"],
+                "srcpos": cfg["srcpos"],
+                "nregion": len(prop),
+            },
+        )
+        return "finished"
+
+    def runjob(self, job):
+        slot = self.slots.get()
+        jobdir = os.path.join(self.outputdir, job["name"])
+        logfile = os.path.join(jobdir, "backend.log")
+        report = {
+            "name": job["name"],
+            "input": job.get("volume", job.get("scene")),
+            "outputdir": jobdir,
+            "slot": slot,
+            "status": "failed",
+            "error": None,
+            "time": {},
+        }
+        t0 = time.perf_counter()
+        try:
+            os.makedirs(jobdir, exist_ok=True)
+            with open(os.path.join(jobdir, "job.json"), "w") as fp:
+                json.dump(job, fp, indent=2, default=str)
+
+            oc = GetBackendEngine(self.backend, slot)
+            report["time"]["engine"] = time.perf_counter() - t0
+            SetBackendWorkFolder(oc, jobdir)
+
+            t1 = time.perf_counter()
+            report["mesh"] = self.mesh(oc, job, jobdir, logfile)
+            report["time"]["mesh"] = time.perf_counter() - t1
+
+            if job.get("mmc", True):
+                t1 = time.perf_counter()
+                report["mmc"] = self.mmc(oc, job, jobdir, logfile)
+                report["time"]["mmc"] = time.perf_counter() - t1
+            report["status"] = "finished"
+        except Exception as e:
+            MarkBackendFailed(self.backend, slot)
+            report["error"] = "%s: %s" % (type(e).__name__, e)
+            with open(os.path.join(jobdir, "error.log"), "w") as fp:
+                fp.write(traceback.format_exc())
+        finally:
+            self.slots.put(slot)
+        report["time"]["total"] = time.perf_counter() - t0
+        print(
+            "BlenderPhotonics: [%s] %s in %.2f s%s"
+            % (
+                report["name"],
+                report["status"],
+                report["time"]["total"],
+                "" if report["error"] is None else " (" + report["error"] + ")",
+            )
+        )
+        return report
+
+    def run(self):
+        os.makedirs(self.outputdir, exist_ok=True)
+        print(
+            "BlenderPhotonics: running %d jobs with %d %s workers, output in %s"
+            % (len(self.jobs), self.workers, self.backend, self.outputdir)
+        )
+        t0 = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                reports = list(pool.map(self.runjob, self.jobs))
+        finally:
+            CloseBackendEngines()
+        summary = {
+            "backend": self.backend,
+            "workers": self.workers,
+            "elapsed": time.perf_counter() - t0,
+            "finished": sum(r["status"] == "finished" for r in reports),
+            "failed": sum(r["status"] == "failed" for r in reports),
+            "jobs": reports,
+        }
+        with open(os.path.join(self.outputdir, "summary.json"), "w") as fp:
+            json.dump(summary, fp, indent=2)
+        print(
+            "BlenderPhotonics: %d finished, %d failed in %.2f s, see %s"
+            % (
+                summary["finished"],
+                summary["failed"],
+                summary["elapsed"],
+                os.path.join(self.outputdir, "summary.json"),
+            )
+        )
+        return summary
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # blender passes the script arguments after "--"
+        if "--" in sys.argv:
+            argv = sys.argv[sys.argv.index("--") + 1 :]
+    parser = argparse.ArgumentParser(
+        prog="BlenderPhotonics.batch",
+        description="Run BlenderPhotonics meshing and MMC simulations listed in a JSON manifest",
+    )
+    parser.add_argument(
+        "manifest", help="JSON manifest listing the volumes/scenes and parameters"
+    )
+    parser.add_argument(
+        "-n",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of parallel backend sessions",
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="output folder, one subfolder per job"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.manifest, "r") as fp:
+        manifest = json.load(fp)
+    rootdir = os.path.dirname(os.path.abspath(args.manifest))
+    summary = BatchRunner(manifest, rootdir, args.workers, args.output).run()
+    return 1 if summary["failed"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""Benchmark - measuring the overhead of the add-on without Octave/MATLAB or a GPU
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+fakebackend.py  FakeBackend, a stand-in for the Octave/MATLAB session
+synthetic.py    generators of sphere scenes, labeled volumes and tetrahedral meshes
+runner.py       times the stages in utils.py and the operators against baselines
+"""
@@ -0,0 +1,289 @@
+"""FakeBackend - a stand-in for the Octave/MATLAB session with synthetic outputs
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+FakeBackend answers the same feval() calls as an oct2py session running the
+scripts under script/, and writes the same files to the same work folder,
+but replaces iso2mesh and mmclab by deterministic generators whose output
+size is set by g_fakeparam:
+
+    meshres: cells per axis of the tetrahedral mesh (6*meshres^3 elements
+             before the elements outside the object are removed)
+    nlabels: number of regions of meshes created from Blender scenes
+    latency: seconds added to every call, to mimic a slow backend
+
+Call UseFakeBackend() to let GetBackendEngine() create FakeBackend sessions
+for both the Octave and the MATLAB backend.
+
+Note: meshdata.mat is written with a MAT-file-like 128-byte header followed
+by the raw node/element arrays; it is only used as the input of the mesh
+hash and by this fake blendermmc, not a loadable .mat file.
+"""
+
+import os
+import time
+import numpy as np
+import jdata as jd
+from ..utils import (
+    GetBPWorkFolder,
+    GetExchangeFile,
+    RemoveExchangeFile,
+    CloseBackendEngines,
+    JMeshFallback,
+    g_enginefactory,
+)
+from ..meshface import ExtractMeshFaces, LoadTetMeshData, SelectFaces
+from ..niireader import OpenVolume, FirstFrame
+from ..profiler import g_active
+from .synthetic import MakeSphere, MakeTetMesh, ShellLabel
+
+g_fakeparam = {"meshres": 16, "nlabels": 3, "latency": 0.0}
+
+
+class FakeBackend:
+    def __init__(self, meshres=16, nlabels=3, latency=0.0):
+        self.meshres = meshres
+        self.nlabels = nlabels
+        self.latency = latency
+        self.env = {}
+        self.stream = print
+        self.ncalls = 0
+
+    def exit(self):
+        pass
+
+    def addpath(self, *args):
+        pass
+
+    def genpath(self, path):
+        return path
+
+    def feval(self, func, *args, nargout=0, stream_handler=None, background=False):
+        handler = getattr(self, "fake_" + func, None)
+        if handler is None:
+            raise ValueError("FakeBackend: unknown function " + func)
+        self.ncalls += 1
+        self.stream = stream_handler if stream_handler is not None else print
+
+        # the backend runs in another process, keep its work out of the caller's profile
+        profile = getattr(g_active, "profile", None)
+        g_active.profile = None
+        try:
+            if self.latency > 0:
+                time.sleep(self.latency)
+            return handler(*args)
+        finally:
+            g_active.profile = profile
+
+    def workdir(self):
+        return self.env.get("BLENDERPHOTONICS_WORKDIR") or GetBPWorkFolder()
+
+    def savejd(self, data, basename, kind, param):
+        # same as bpsavejd.m
+        fmt = param.get("exchange", "jmsh")
+        compression = param.get("compression", "")
+        workdir = self.workdir()
+        os.makedirs(workdir, exist_ok=True)
+        RemoveExchangeFile(basename, kind, workdir)
+        fname = GetExchangeFile(basename, kind, fmt, workdir)
+        opt = {} if compression in ("", "none") else {"compression": compression}
+        t0 = time.perf_counter()
+        jd.save(data, fname, opt)
+        self.stream(
+            "saved %s (%.2f MB) in %.3f s"
+            % (fname, os.path.getsize(fname) / 1048576, time.perf_counter() - t0)
+        )
+        return fname
+
+    def savemeshdata(self, node, elem):
+        header = b"MATLAB 5.0 MAT-file, BlenderPhotonics FakeBackend".ljust(128)
+        with open(os.path.join(self.workdir(), "meshdata.mat"), "wb") as fp:
+            fp.write(header)
+            fp.write(np.ascontiguousarray(node, dtype=np.float64).tobytes())
+            fp.write(np.ascontiguousarray(elem, dtype=np.float64).tobytes())
+
+    def savemesh(self, node, elem, param):
+        # same files as blendersavemesh.m, elem is 0-based (Ne,5)
+        tetmesh = {
+            "MeshVertex3": node,
+            "MeshElem": np.hstack((elem[:, 0:4] + 1, elem[:, 4:5])).astype(np.uint32),
+        }
+        self.savejd(tetmesh, "tetmesh", "mesh", param)
+        if not param.get("savesurf", 1):
+            self.stream("saving complete.")
+            return
+        faces = ExtractMeshFaces(node, elem)
+        regionmesh = {"MeshVertex3": node}
+        maxtag = int(elem[:, 4].max()) if len(elem) > 0 else 0
+        for n in range(1, maxtag + 1):
+            face = faces["regions"].get(n, np.zeros((0, 3), dtype=np.uint32))
+            regionmesh["MeshTri3(%d)" % n] = face + 1
+        if maxtag == 1:
+            regionmesh["MeshTri3"] = regionmesh.pop("MeshTri3(1)")
+        self.stream("begin to save whole volumic mesh.")
+        self.savejd(regionmesh, "regionmesh", "mesh", param)
+        volface = SelectFaces(faces, param.get("faceset", "all"))
+        self.savejd(
+            {"MeshVertex3": node, "MeshTri3": volface + 1}, "volumemesh", "mesh", param
+        )
+        self.stream("saving complete.")
+
+    def fake_setenv(self, name, value):
+        self.env[name] = value
+
+    def fake_bpmwpath(self, fname=""):
+        return os.path.join(self.workdir(), fname)
+
+    def fake_blender2mesh(self, filename, paramfile=None):
+        blender = jd.load(filename)
+        node = np.asarray(blender["MeshVertex3"], dtype=np.float64)
+        param = jd.load(paramfile)["param"] if paramfile else blender.get("param", {})
+        lo, hi = node.min(axis=0), node.max(axis=0)
+        for line in ("Delaunizing", "Recovering", "Refining"):
+            self.stream(line + " ...")
+        node, elem = MakeTetMesh(
+            lo,
+            hi,
+            self.meshres,
+            ShellLabel((lo + hi) / 2, np.maximum((hi - lo) / 2, 1e-9), self.nlabels),
+        )
+        self.savemeshdata(node, elem)
+        self.stream("begin to save region mesh")
+        self.savemesh(node, elem, param)
+
+    def fake_nii2mesh(self, paramfile):
+        param = jd.load(paramfile)
+        data, header = OpenVolume(param["niipath"])
+        if data is None:
+            raise ValueError("FakeBackend: can not read " + param["niipath"])
+        vol = FirstFrame(data)
+        dim = np.array(vol.shape[0:3])
+        isbinary = param.get("imagetype") in ("binary", "grayscale")
+        isovalue = param.get("isovalue", 0.5)
+
+        def label(points):
+            # the voxel value at each element centroid, voxel centers at 1..dim
+            ijk = np.clip(np.floor(points - 0.5).astype(np.int64), 0, dim - 1)
+            value = np.asarray(vol[ijk[:, 0], ijk[:, 1], ijk[:, 2]])
+            return (
+                (value > isovalue).astype(np.int64)
+                if isbinary
+                else value.astype(np.int64)
+            )
+
+        res = np.maximum(np.round(dim * self.meshres / dim.max()), 1)
+        node, elem = MakeTetMesh(np.full(3, 0.5), dim + 0.5, res, label)
+        factor = param.get("factor", 1)
+        offset = np.asarray(param.get("offset", [0, 0, 0]), dtype=np.float64)
+        node = (node - 0.5) * factor + 0.5 + offset
+        self.savemeshdata(node, elem)
+        self.savemesh(node, elem, param)
+
+    def fake_blender2surf(self, filename):
+        blender = jd.load(filename)
+        objs = blender["MeshGroup"]
+        if isinstance(objs, dict):
+            objs = [objs]
+        if "boolean" in blender["param"].get("action", "") and len(objs) == 2:
+            objs = objs[0:1]
+        blender["MeshGroup"] = objs
+        self.stream("begin to save surface mesh")
+        self.savejd(blender, "surfacemesh", "mesh", blender["param"])
+
+    def fake_bpboolean(self, node1, face1, op, node2, face2):
+        # the union keeps both surfaces side by side, other operations return the first
+        self.stream("boolean " + op + " done")
+        if op != "or":
+            return np.asarray(node1), np.asarray(face1)
+        node1 = np.asarray(node1)
+        face2 = np.asarray(face2) + len(node1)
+        return np.vstack((node1, node2)), np.vstack((face1, face2))
+
+    def fake_surf2jmesh(self, filename):
+        if filename.lower().endswith((".jmsh", ".bmsh", ".json")):
+            return JMeshFallback(jd.load(filename))
+        node, face = MakeSphere(642)
+        return {"MeshVertex3": node, "MeshTri3": face + 1}
+
+    def fakeflux(self, node, cfg, srcpos, ngates):
+        # smooth decay from the source with reproducible noise; (ngates, Nn) float32
+        r = np.linalg.norm(node - np.asarray(srcpos, dtype=np.float64), axis=1)
+        r *= float(cfg.get("unitinmm", 1.0))
+        gate = np.arange(1, ngates + 1)[:, None]
+        rng = np.random.default_rng(int(cfg.get("seed", 1648335518)))
+        flux = np.exp(-r[None, :] / (2.0 * gate)) / gate
+        flux *= 1 + 0.01 * rng.standard_normal(flux.shape)
+        return flux.astype(np.float32)
+
+    def fake_blendermmc(self, paramfile, meshfile, posefile=None):
+        param = jd.load(paramfile)
+        cfg = param["cfg"]
+        node, elem = LoadTetMeshData(os.path.dirname(meshfile))
+        ngates = max(int(round(cfg["tend"] / cfg["tstep"])), 1)
+        self.stream("initializing")
+        self.stream("launching MMC")
+
+        if posefile is None:
+            flux = self.fakeflux(node, cfg, cfg["srcpos"], ngates)
+            self.stream("simulated %d photons" % cfg["nphoton"])
+            flux.tofile(os.path.join(self.workdir(), "mmcflux.bin"))
+            logall = np.log10(flux[flux > 0])
+            self.savejd(
+                {
+                    "logflux": LogFlux(flux[0]),
+                    "ngates": ngates,
+                    "logrange": [float(logall.min()), float(logall.max())],
+                },
+                "mmcoutput",
+                "data",
+                param,
+            )
+            return
+
+        pose = jd.load(posefile)
+        srcpos = np.asarray(pose["srcpos"], dtype=np.float64).reshape(-1, 3)
+        logflux = np.zeros((len(srcpos), len(node)), dtype=np.float32)
+        for i, pos in enumerate(srcpos):
+            logflux[i] = LogFlux(self.fakeflux(node, cfg, pos, 1)[0])
+            self.stream("scanned source position %d of %d" % (i + 1, len(srcpos)))
+        self.savejd(
+            {"logflux": logflux, "index": np.ravel(pose["index"]).tolist()},
+            pose["output"],
+            "data",
+            param,
+        )
+
+
+def LogFlux(flux):
+    # same as mmclogflux() in blendermmc.m
+    with np.errstate(divide="ignore"):
+        logflux = np.log10(np.abs(flux))
+    finite = np.isfinite(logflux)
+    if finite.any():
+        logflux[~finite] = logflux[finite].min()
+    return logflux.astype(np.float32)
+
+
+def UseFakeBackend(**param):
+    """Serve all following Octave/MATLAB sessions by FakeBackend, with the given output sizes"""
+    g_fakeparam.update(param)
+    CloseBackendEngines()
+    for backend in ("octave", "matlab"):
+        g_enginefactory[backend] = lambda: FakeBackend(**g_fakeparam)
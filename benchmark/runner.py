@@ -0,0 +1,607 @@
+"""Runner - time the add-on's own stages and operators against stored baselines
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+Usage:
+
+    blender -b --factory-startup --python benchmark/runner.py -- [options]
+    python -m BlenderPhotonics.benchmark.runner [options]
+
+    -c/--cases name ...     run only the cases whose names start with these
+    -r/--repeat N           repetitions of each case, the median is reported (3)
+    -b/--baseline file      baseline file (benchmark/baselines.json)
+    -u/--update-baseline    store the results of this run as the new baseline
+    -t/--threshold F        allowed relative slowdown before a case fails (0.25)
+    -o/--output file        save the results of all cases as JSON
+
+All backend calls are served by FakeBackend, so only the time spent in the
+add-on itself is measured. Cases that need Blender are skipped when run
+outside of Blender. Each case is timed as a whole and broken down into the
+stages recorded by profiler.py. A case fails if its median time exceeds the
+baseline by more than the threshold (a case may set its own) plus
+g_minslack seconds; the exit code is 1 if any case failed. Baselines are
+only comparable on the machine where they were recorded. The save/load
+cases run once per exchange format and also report the file size; the
+binary cases are skipped if the bjdata module is not installed.
+
+The committed benchmark/baselines.json is a reference for the cases that
+run without Blender, recorded on the machine described in its header
+("machine", "processor", "cpus", "platform"). Cases without a baseline,
+which includes all Blender cases until one is recorded, are reported but
+never fail. Record your own baseline with -u, inside Blender for the
+Blender cases, before relying on the regression check.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import importlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+if __name__ == "__main__" and not __package__:
+    # run as a script, e.g. "blender -b --python benchmark/runner.py", import as part of the package
+    addondir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(addondir))
+    __package__ = os.path.basename(addondir) + ".benchmark"
+    importlib.import_module(__package__)
+
+import numpy as np
+from .. import utils
+from ..utils import (
+    bpy,
+    GetMeshArrays,
+    AddMeshFromNodeFace,
+    SetVertexScalars,
+    SaveExchangeFile,
+    LoadExchangeFile,
+    ClearGeometryCache,
+)
+from ..profiler import RunProfile, GetPeakRSS, GetAddonVersion, g_lastrun
+from ..meshface import ExtractMeshFaces
+from ..tetindex import TetIndex
+from ..niireader import PrepareVolume
+from .fakebackend import UseFakeBackend
+from .synthetic import (
+    MakeSphere,
+    MakeTetMesh,
+    MakeLabelVolume,
+    SaveNifti,
+    ShellLabel,
+    AddSphereScene,
+)
+
+g_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+g_repeat = 3
+g_threshold = 0.25
+g_minslack = 0.005
+
+# run in a new Blender process: time importing and registering the add-on
+g_startupscript = """
+import sys, time, json, importlib
+sys.path.insert(0, {parentdir!r})
+before = set(sys.modules)
+t0 = time.perf_counter()
+bp = importlib.import_module({package!r})
+t1 = time.perf_counter()
+bp.register()
+t2 = time.perf_counter()
+loaded = set(sys.modules) - before
+print("BPSTARTUP " + json.dumps({{
+    "import": t1 - t0,
+    "register": t2 - t1,
+    "modules": len(loaded),
+    "heavy": sorted(m for m in loaded if m.split(".")[0] in ("numpy", "jdata", "bjdata", "oct2py", "matlab", "scipy")),
+}}))
+"""
+
+# name, case function, parameters; "blender" cases need bpy, "threshold" overrides g_threshold,
+# "exchange" selects the intermediate file format of the save/load cases
+g_cases = [
+    ("startup", "BenchStartup", {"blender": True, "threshold": 0.5}),
+    ("save-mesh-40-jmsh", "BenchSaveMesh", {"meshres": 40, "exchange": "jmsh"}),
+    ("save-mesh-40-bmsh", "BenchSaveMesh", {"meshres": 40, "exchange": "bmsh"}),
+    ("load-mesh-40-jmsh", "BenchLoadMesh", {"meshres": 40, "exchange": "jmsh"}),
+    ("load-mesh-40-bmsh", "BenchLoadMesh", {"meshres": 40, "exchange": "bmsh"}),
+    ("mesh-faces-40", "BenchMeshFaces", {"meshres": 40}),
+    ("tet-index-40", "BenchTetIndex", {"meshres": 40, "npoints": 100000}),
+    (
+        "prepare-volume-256-8",
+        "BenchPrepareVolume",
+        {"dim": 256, "nlabels": 8, "downsample": 1},
+    ),
+    (
+        "prepare-volume-256-8-ds2",
+        "BenchPrepareVolume",
+        {"dim": 256, "nlabels": 8, "downsample": 2},
+    ),
+    ("mesh-arrays-100k", "BenchMeshArrays", {"nvert": 100000, "blender": True}),
+    (
+        "mesh-arrays-100k-cached",
+        "BenchMeshArrays",
+        {"nvert": 100000, "cached": True, "blender": True},
+    ),
+    ("mesh-create-100k", "BenchMeshCreate", {"nvert": 100000, "blender": True}),
+    ("vertex-scalars-100k", "BenchVertexScalars", {"nvert": 100000, "blender": True}),
+    (
+        "scene2mesh-1x2k",
+        "BenchScene2Mesh",
+        {"nspheres": 1, "nvert": 2000, "meshres": 24, "blender": True},
+    ),
+    (
+        "scene2mesh-8x2k",
+        "BenchScene2Mesh",
+        {"nspheres": 8, "nvert": 2000, "meshres": 24, "blender": True},
+    ),
+    (
+        "scene2mesh-8x2k-from6",
+        "BenchScene2Mesh",
+        {
+            "nspheres": 8,
+            "nvert": 2000,
+            "meshres": 24,
+            "startstep": "6",
+            "blender": True,
+        },
+    ),
+    (
+        "scene2mesh-3x50k-nested",
+        "BenchScene2Mesh",
+        {"nspheres": 3, "nvert": 50000, "nested": True, "meshres": 40, "blender": True},
+    ),
+    (
+        "object2surf-2x20k",
+        "BenchObject2Surf",
+        {"nvert": 20000, "action": "boolean-and", "blender": True},
+    ),
+    (
+        "object2surf-16x5k-smooth",
+        "BenchObject2Surf",
+        {
+            "nobjs": 16,
+            "nvert": 5000,
+            "action": "smooth",
+            "nworkers": 4,
+            "blender": True,
+        },
+    ),
+    (
+        "nii2mesh-128-2",
+        "BenchNii2Mesh",
+        {"dim": 128, "nlabels": 2, "meshres": 32, "blender": True},
+    ),
+    (
+        "nii2mesh-128-16",
+        "BenchNii2Mesh",
+        {"dim": 128, "nlabels": 16, "meshres": 32, "blender": True},
+    ),
+    (
+        "mesh2scene-3x40",
+        "BenchMesh2Scene",
+        {"nspheres": 3, "meshres": 40, "blender": True},
+    ),
+    (
+        "runmmc-3x40",
+        "BenchRunMMC",
+        {"nspheres": 3, "meshres": 40, "ngates": 1, "blender": True},
+    ),
+    (
+        "runmmc-3x40-10gates",
+        "BenchRunMMC",
+        {"nspheres": 3, "meshres": 40, "ngates": 10, "blender": True},
+    ),
+]
+
+
+class CaseTimer:
+    def __init__(self, name, workdir):
+        self.name = name
+        self.workdir = workdir
+        self.wall = None
+        self.stages = []
+        self.peakrss = None
+        self.filesize = None
+
+    @contextmanager
+    def measure(self):
+        """Time the body; operators record their own profile, other code records into this one"""
+        g_lastrun.clear()
+        profile = RunProfile(self.name)
+        t0 = time.perf_counter()
+        with profile.activate():
+            yield
+        self.wall = time.perf_counter() - t0
+        self.peakrss = GetPeakRSS()
+        self.stages = g_lastrun.get("stages") or sorted(
+            profile.stages, key=lambda s: s["start"]
+        )
+
+
+def ResetScene():
+    ClearGeometryCache()
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+    if bpy.context.scene.collection.children.get("Collection") is None:
+        bpy.context.scene.collection.children.link(
+            bpy.data.collections.new("Collection")
+        )
+
+
+def SelectAll():
+    for obj in bpy.context.scene.objects:
+        obj.select_set(True)
+    bpy.context.view_layer.objects.active = bpy.context.scene.objects[0]
+
+
+def BenchStartup(timer, param):
+    addondir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = g_startupscript.format(
+        parentdir=os.path.dirname(addondir), package=os.path.basename(addondir)
+    )
+    output = subprocess.run(
+        [bpy.app.binary_path, "-b", "--factory-startup", "--python-expr", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+    startup = json.loads(output.split("BPSTARTUP ", 1)[1].splitlines()[0])
+    timer.wall = startup["import"] + startup["register"]
+    timer.stages = [
+        {"name": "import", "wall": startup["import"], "depth": 0},
+        {"name": "register", "wall": startup["register"], "depth": 0},
+    ]
+    print(
+        "add-on startup: %.3f s, %d modules loaded, heavy modules: %s"
+        % (timer.wall, startup["modules"], ", ".join(startup["heavy"]) or "none")
+    )
+
+
+@contextmanager
+def ExchangeFormat(fmt):
+    # write the intermediate files in fmt regardless of the scene setting
+    getformat = utils.GetExchangeFormat
+    utils.GetExchangeFormat = lambda: (fmt, "none")
+    try:
+        yield
+    finally:
+        utils.GetExchangeFormat = getformat
+
+
+def BenchSaveMesh(timer, param):
+    node, elem = MakeTetMesh([0, 0, 0], [1, 1, 1], param["meshres"])
+    data = {"MeshVertex3": node, "MeshElem": (elem + 1).astype(np.uint32)}
+    with ExchangeFormat(param["exchange"]):
+        with timer.measure():
+            fname = SaveExchangeFile(data, "benchmesh", "mesh", timer.workdir)
+    timer.filesize = os.path.getsize(fname) / 1048576
+
+
+def BenchLoadMesh(timer, param):
+    node, elem = MakeTetMesh([0, 0, 0], [1, 1, 1], param["meshres"])
+    with ExchangeFormat(param["exchange"]):
+        fname = SaveExchangeFile(
+            {"MeshVertex3": node, "MeshElem": (elem + 1).astype(np.uint32)},
+            "benchmesh",
+            "mesh",
+            timer.workdir,
+        )
+    timer.filesize = os.path.getsize(fname) / 1048576
+    with timer.measure():
+        LoadExchangeFile("benchmesh", "mesh", timer.workdir)
+
+
+def BenchMeshFaces(timer, param):
+    node, elem = MakeTetMesh(
+        [0, 0, 0], [1, 1, 1], param["meshres"], ShellLabel([0.5] * 3, 0.5, 4)
+    )
+    with timer.measure():
+        ExtractMeshFaces(node, elem)
+
+
+def BenchTetIndex(timer, param):
+    node, elem = MakeTetMesh([0, 0, 0], [1, 1, 1], param["meshres"])
+    points = np.random.default_rng(0).random((param["npoints"], 3))
+    with timer.measure():
+        TetIndex(node, elem).locate(points)
+
+
+def BenchPrepareVolume(timer, param):
+    niifile = os.path.join(timer.workdir, "benchvol%d.nii" % param["dim"])
+    SaveNifti(niifile, MakeLabelVolume(param["dim"], param["nlabels"]))
+    volparam = {
+        "imagetype": "multi-label",
+        "crop": True,
+        "downsample": param["downsample"],
+    }
+    with timer.measure():
+        PrepareVolume(niifile, volparam, timer.workdir)
+
+
+def BenchMeshArrays(timer, param):
+    ResetScene()
+    obj = AddSphereScene(1, param["nvert"])[0]
+    if param.get("cached", False):
+        GetMeshArrays(obj)
+    with timer.measure():
+        GetMeshArrays(obj)
+
+
+def BenchMeshCreate(timer, param):
+    ResetScene()
+    node, face = MakeSphere(param["nvert"])
+    with timer.measure():
+        AddMeshFromNodeFace(node, face, "benchsphere")
+
+
+def BenchVertexScalars(timer, param):
+    ResetScene()
+    obj = AddSphereScene(1, param["nvert"])[0]
+    values = np.linspace(-3, 0, len(obj.data.vertices))
+    with timer.measure():
+        SetVertexScalars(obj, values)
+
+
+def CreateMesh(param):
+    # a meshed scene in the work folder, the starting point of the simulation cases
+    ResetScene()
+    AddSphereScene(
+        param.get("nspheres", 1), param.get("nvert", 2000), param.get("nested", False)
+    )
+    SelectAll()
+    bpy.ops.blenderphotonics.create3dmesh(endstep="9", background=False)
+
+
+def BenchScene2Mesh(timer, param):
+    ResetScene()
+    AddSphereScene(param["nspheres"], param["nvert"], param.get("nested", False))
+    SelectAll()
+    startstep = param.get("startstep", "1")
+    if startstep != "1":
+        # export the scene once, then time meshing it again with another maximum volume
+        bpy.ops.blenderphotonics.create3dmesh(endstep="9", background=False)
+    with timer.measure():
+        bpy.ops.blenderphotonics.create3dmesh(
+            startstep=startstep, endstep="9", maxvol=0.5, background=False
+        )
+
+
+def BenchObject2Surf(timer, param):
+    ResetScene()
+    AddSphereScene(param.get("nobjs", 2), param["nvert"])
+    SelectAll()
+    with timer.measure():
+        bpy.ops.blenderphotonics.blender2surf(
+            action=param["action"], nworkers=param.get("nworkers", 1), background=False
+        )
+
+
+def BenchNii2Mesh(timer, param):
+    ResetScene()
+    niifile = os.path.join(
+        timer.workdir, "benchvol%d_%d.nii" % (param["dim"], param["nlabels"])
+    )
+    SaveNifti(niifile, MakeLabelVolume(param["dim"], param["nlabels"]))
+    bpy.context.scene.blender_photonics.path = niifile
+    with timer.measure():
+        bpy.ops.blenderphotonics.nii2mesh(background=False)
+
+
+def BenchMesh2Scene(timer, param):
+    CreateMesh(param)
+    with timer.measure():
+        bpy.ops.blenderphotonics.meshtoscene()
+
+
+def BenchRunMMC(timer, param):
+    CreateMesh(param)
+    bpy.ops.blenderphotonics.meshtoscene()
+    with timer.measure():
+        bpy.ops.blenderphotonics.runmmc(
+            tend=5e-9 * param["ngates"], tstep=5e-9, nsplit=1, background=False
+        )
+
+
+def SummarizeStages(stages):
+    # total wall time of the top-level stages with the same name
+    total = {}
+    for s in stages:
+        if s["depth"] == 0:
+            total[s["name"]] = total.get(s["name"], 0.0) + s["wall"]
+    return total
+
+
+def RunCase(name, func, param, repeat, workdir):
+    walls, stages, peakrss, filesize = [], [], None, None
+    for _ in range(repeat):
+        timer = CaseTimer(name, workdir)
+        UseFakeBackend(**{k: param[k] for k in ("meshres", "nlabels") if k in param})
+        globals()[func](timer, param)
+        walls.append(timer.wall)
+        stages.append(SummarizeStages(timer.stages))
+        peakrss = timer.peakrss
+        filesize = timer.filesize
+    names = sorted(set(k for s in stages for k in s))
+    return {
+        "wall": float(np.median(walls)),
+        "min": float(np.min(walls)),
+        "peakrss": peakrss,
+        "filesize": filesize,
+        "stages": {k: float(np.median([s.get(k, 0.0) for s in stages])) for k in names},
+        "param": param,
+    }
+
+
+def HasBJData():
+    try:
+        import bjdata
+    except ImportError:
+        return False
+    return True
+
+
+def GetProcessorName():
+    # platform.processor() is empty or only the architecture on Linux
+    try:
+        with open("/proc/cpuinfo", "r") as fp:
+            for line in fp:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def CompareBaseline(results, baseline, threshold):
+    """Return the names of the cases slower than their baseline by more than the threshold"""
+    failed = []
+    for name, result in results.items():
+        base = baseline.get("cases", {}).get(name)
+        size = (
+            "   %.2f MB" % result["filesize"]
+            if result.get("filesize") is not None
+            else ""
+        )
+        if base is None:
+            print("%-28s %8.3f s   (no baseline)%s" % (name, result["wall"], size))
+            continue
+        limit = (
+            base["wall"] * (1 + result["param"].get("threshold", threshold))
+            + g_minslack
+        )
+        status = "ok" if result["wall"] <= limit else "SLOWER"
+        print(
+            "%-28s %8.3f s   baseline %8.3f s   %+6.1f%%   %s%s"
+            % (
+                name,
+                result["wall"],
+                base["wall"],
+                (result["wall"] / max(base["wall"], 1e-9) - 1) * 100,
+                status,
+                size,
+            )
+        )
+        if status != "ok":
+            failed.append(name)
+            for stage, wall in sorted(result["stages"].items(), key=lambda s: -s[1])[
+                0:5
+            ]:
+                print(
+                    "    %-40s %8.3f s   baseline %8.3f s"
+                    % (stage, wall, base.get("stages", {}).get(stage, float("nan")))
+                )
+    return failed
+
+
+def main(argv=None):
+    if argv is None:
+        argv = (
+            sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else sys.argv[1:]
+        )
+    parser = argparse.ArgumentParser(description="BlenderPhotonics benchmark runner")
+    parser.add_argument("-c", "--cases", nargs="*", default=None)
+    parser.add_argument("-r", "--repeat", type=int, default=g_repeat)
+    parser.add_argument("-b", "--baseline", default=g_baseline)
+    parser.add_argument("-u", "--update-baseline", action="store_true")
+    parser.add_argument("-t", "--threshold", type=float, default=g_threshold)
+    parser.add_argument("-o", "--output", default=None)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bpbench-")
+    os.environ["BLENDERPHOTONICS_WORKDIR"] = workdir
+    if bpy is not None:
+        addon = importlib.import_module(__package__.rsplit(".", 1)[0])
+        try:
+            addon.register()
+        except ValueError:
+            pass  # the add-on is already enabled in this Blender installation
+        bp = bpy.context.scene.blender_photonics
+        bp.cachesize = 0
+        bp.reportfile = os.path.join(workdir, "bpreport.jsonl")
+
+    results = {}
+    try:
+        for name, func, param in g_cases:
+            if args.cases and not any(name.startswith(c) for c in args.cases):
+                continue
+            if param.get("blender") and bpy is None:
+                print("%-28s skipped, requires Blender" % name)
+                continue
+            if param.get("exchange") == "bmsh" and not HasBJData():
+                print("%-28s skipped, requires the bjdata module" % name)
+                continue
+            results[name] = RunCase(name, func, param, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+    failed = CompareBaseline(results, baseline, args.threshold)
+    missing = [name for name in results if name not in baseline.get("cases", {})]
+    if len(missing) > 0 and not args.update_baseline:
+        print(
+            "%d case(s) have no baseline and were not checked, record one with -u"
+            % len(missing)
+        )
+    if baseline.get("machine") not in (None, platform.node()):
+        print(
+            "note: the baseline was recorded on %s, timings may not be comparable"
+            % baseline["machine"]
+        )
+
+    info = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": GetAddonVersion(),
+        "blender": bpy.app.version_string if bpy is not None else None,
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "processor": GetProcessorName(),
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({**info, "cases": results}, fp, indent=2)
+    if args.update_baseline:
+        # keep the baselines of the cases that were not run this time
+        cases = {**baseline.get("cases", {}), **results}
+        with open(args.baseline, "w") as fp:
+            json.dump({**info, "cases": cases}, fp, indent=2)
+        print("baseline saved to " + args.baseline)
+        return 0
+    if len(failed) > 0:
+        print(
+            "%d case(s) slower than the baseline: %s" % (len(failed), ", ".join(failed))
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Synthetic - deterministic scenes, meshes and volumes for benchmarking
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+Every generator is a pure function of its size parameters, so that the same
+benchmark case handles exactly the same data on every machine and version.
+"""
+
+import struct
+import itertools
+import numpy as np
+from ..utils import AddMeshFromNodeFace
+from ..niireader import g_niftitype
+
+
+def MakeSphere(nvert, radius=1.0, center=(0, 0, 0)):
+    """Return the nodes (Nn,3) and 0-based triangles (Nf,3) of a closed UV sphere of about nvert nodes"""
+    nlat = max(int(round(np.sqrt(max(nvert - 2, 8) / 2.0))), 2)
+    nlon = 2 * nlat
+    theta = np.arange(1, nlat) * np.pi / nlat
+    phi = np.arange(nlon) * 2 * np.pi / nlon
+    t, p = np.meshgrid(theta, phi, indexing="ij")
+    ring = np.stack(
+        (np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), axis=-1
+    ).reshape(-1, 3)
+    node = np.vstack(([0, 0, 1], ring, [0, 0, -1])) * radius + np.asarray(center)
+
+    nring = nlat - 1
+    bottom = nring * nlon + 1
+    j = np.arange(nlon)
+    jn = (j + 1) % nlon
+    faces = [np.stack((np.zeros(nlon, dtype=np.int64), 1 + j, 1 + jn), axis=1)]
+    for i in range(nring - 1):
+        a, b = 1 + i * nlon, 1 + (i + 1) * nlon
+        faces.append(np.stack((a + j, b + j, b + jn), axis=1))
+        faces.append(np.stack((a + j, b + jn, a + jn), axis=1))
+    a = 1 + (nring - 1) * nlon
+    faces.append(np.stack((a + j, np.full(nlon, bottom), a + jn), axis=1))
+    return node, np.vstack(faces).astype(np.uint32)
+
+
+def ShellLabel(center, radius, nlabels):
+    # label elements by concentric shells, 1 in the middle, 0 (removed) outside radius
+    center = np.asarray(center, dtype=np.float64)
+
+    def label(points):
+        r = np.linalg.norm((points - center) / radius, axis=1)
+        return np.where(r < 1, np.minimum(np.floor(r * nlabels), nlabels - 1) + 1, 0)
+
+    return label
+
+
+def MakeTetMesh(lo, hi, res, label=None):
+    """Return a tetrahedral mesh of a box split into res^3 cubes of 6 tetrahedra each
+
+    lo, hi: corners of the box; res: cells per axis (scalar or 3 values)
+    label: maps (Ne,3) element centroids to integer labels, elements labeled
+           0 are removed; all elements are labeled 1 if None
+    returns node (Nn,3) and 0-based elem (Ne,5), the 5th column is the label
+    """
+    lo, hi = np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64)
+    res = np.maximum(np.broadcast_to(np.asarray(res, dtype=np.int64), (3,)), 1)
+    axes = [np.linspace(lo[d], hi[d], res[d] + 1) for d in range(3)]
+    grid = np.meshgrid(*axes, indexing="ij")
+    node = np.stack([g.ravel(order="F") for g in grid], axis=1)
+
+    sx, sy = res[0] + 1, res[1] + 1
+    i, j, k = np.meshgrid(*[np.arange(n) for n in res], indexing="ij")
+    c0 = (i + sx * (j + sy * k)).ravel(order="F")
+    step = (1, sx, sx * sy)
+    elem = np.vstack(
+        [
+            np.stack((c0, c0 + a, c0 + a + b, c0 + sum(step)), axis=1)
+            for a, b, _ in itertools.permutations(step)
+        ]
+    )
+
+    labels = np.ones(len(elem), dtype=np.int64)
+    if label is not None:
+        labels = np.asarray(label(node[elem].mean(axis=1)), dtype=np.int64)
+        elem, labels = elem[labels > 0], labels[labels > 0]
+
+    # positive orientation, as meshreorient does
+    tet = node[elem]
+    vol = np.einsum(
+        "ij,ij->i",
+        np.cross(tet[:, 1] - tet[:, 0], tet[:, 2] - tet[:, 0]),
+        tet[:, 3] - tet[:, 0],
+    )
+    elem[vol < 0, 2:4] = elem[vol < 0, 3:1:-1]
+
+    used, elem = np.unique(elem, return_inverse=True)
+    elem = elem.reshape(-1, 4)
+    return node[used], np.hstack((elem, labels[:, None]))
+
+
+def MakeLabelVolume(dim, nlabels, fill=0.6):
+    """Return a uint8 volume of concentric label shells filling the central part of the box"""
+    dim = np.broadcast_to(np.asarray(dim, dtype=np.int64), (3,))
+    center = (dim - 1) / 2.0
+    radius = fill * dim.min() / 2.0
+    ijk = np.meshgrid(*[np.arange(n) for n in dim], indexing="ij")
+    points = np.stack([g.ravel() for g in ijk], axis=1)
+    label = ShellLabel(center, radius, nlabels)(points)
+    return np.asfortranarray(label.reshape(tuple(dim)).astype(np.uint8))
+
+
+def SaveNifti(filename, vol, voxelsize=1.0):
+    """Write a single-file NIfTI-1 (.nii) volume with a minimal header"""
+    datatype = {np.dtype(v): k for k, v in g_niftitype.items()}[vol.dtype]
+    dim = [vol.ndim] + list(vol.shape) + [1] * (7 - vol.ndim)
+    pixdim = [1.0] + [float(voxelsize)] * vol.ndim + [1.0] * (7 - vol.ndim)
+    hdr = bytearray(352)
+    struct.pack_into("<i", hdr, 0, 348)
+    struct.pack_into("<8h", hdr, 40, *dim)
+    struct.pack_into("<2h", hdr, 70, datatype, vol.dtype.itemsize * 8)
+    struct.pack_into("<8f", hdr, 76, *pixdim)
+    struct.pack_into("<3f", hdr, 108, 352.0, 1.0, 0.0)
+    hdr[344:348] = b"n+1\0"
+    with open(filename, "wb") as fp:
+        fp.write(hdr)
+        fp.write(np.asarray(vol).astype(vol.dtype.newbyteorder("<")).tobytes(order="F"))
+    return filename
+
+
+def AddSphereScene(nspheres, nvert, nested=False):
+    """Add nspheres sphere objects of about nvert nodes each to the Blender scene
+
+    Nested spheres are concentric (nspheres regions after meshing), otherwise
+    they are placed side by side along the x-axis with a small overlap.
+    """
+    objs = []
+    for n in range(nspheres):
+        if nested:
+            radius, center = float(nspheres - n), (0, 0, 0)
+        else:
+            radius, center = 1.0, (1.9 * n, 0, 0)
+        node, face = MakeSphere(nvert, radius, center)
+        objs.append(AddMeshFromNodeFace(node, face, "sphere%d" % (n + 1)))
+    return objs
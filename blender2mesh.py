@@ -22,11 +22,13 @@ To cite this work, please use the below information
 """
 
 import bpy
-import numpy as np
-import jdata as jd
 import os
-from bpy.utils import register_class, unregister_class
-from .utils import *
+from .utils import *  # also the lazily imported np and jd
+from .jobqueue import SubmitBackendJob
+from .resultcache import GetResultCache, HashData
+from .meshface import GetRegionMesh, GetVolumeMesh
+from .meshlod import AddLODMesh, IsLODPreview
+from .profiler import ProfileOperator
 
 g_maxvol = 1.0
 g_keepratio = 1.0
@@ -35,7 +37,9 @@ g_dorepair = False
 g_onlysurf = False
 g_convtri = True
 g_endstep = "9"
+g_startstep = "1"
 g_tetgenopt = ""
+g_background = True
 enum_endstep = [
     ("1", "Step 1: Convert objects to mesh", "Convert objects to mesh"),
     ("2", "Step 2: Join all objects", "Join all objects"),
@@ -62,6 +66,131 @@ enum_endstep = [
     ),
 ]
 
+enum_startstep = [
+    ("1", "Step 1: Convert objects to mesh", "Run all steps on the current scene"),
+    ("2", "Step 2: Join all objects", "Continue a run that stopped after step 1"),
+    ("3", "Step 3: Intersect objects", "Continue a run that stopped after step 2"),
+    ("4", "Step 4: Convert to triangles", "Continue a run that stopped after step 3"),
+    ("5", "Step 5: Export to JMesh", "Continue a run that stopped after step 4"),
+    (
+        "6",
+        "Step 6: Run Iso2Mesh and load mesh",
+        "Mesh the geometry exported by the last run again, e.g. with other tetgen settings, skipping the intersection",
+    ),
+]
+# object types removed in step 1
+g_nonmeshtypes = ("CAMERA", "LIGHT", "EMPTY", "LAMP", "SPEAKER")
+
+g_meshstages = [
+    ("Delaunizing", "tetgen: Delaunay tetrahedralization", 0.3),
+    ("Recovering", "tetgen: recovering boundaries", 0.5),
+    ("Refining", "tetgen: refining mesh", 0.7),
+    ("begin to save region mesh", "saving region surfaces", 0.85),
+    ("saving complete", "mesh saved", 0.95),
+]
+
+
+def LoadMeshResult(onlysurf, endstep):
+    # import volum mesh to blender(just for user to check the result)
+    if bpy.context.object is not None:
+        bpy.ops.object.mode_set(mode="OBJECT")
+    bpy.ops.object.select_all(action="SELECT")
+    bpy.ops.object.delete()
+
+    if not onlysurf:
+        outputmesh = GetVolumeMesh(faceset=GetFaceSet())
+        face = np.asarray(outputmesh["MeshTri3"], dtype=np.uint32) - 1
+        AddLODMesh(
+            outputmesh["MeshVertex3"], face, "Iso2Mesh", nodeid=outputmesh.get("NodeId")
+        )
+        bpy.context.view_layer.objects.active = bpy.data.objects["Iso2Mesh"]
+    else:
+        regiondata = GetRegionMesh()
+        if len(regiondata.keys()) > 0:
+            LoadReginalMesh(regiondata, "region_")
+            bpy.context.view_layer.objects.active = bpy.data.objects["region_1"]
+
+    SetViewportShading("WIREFRAME")
+
+    # at this point, if successful, iso2mesh generated mesh objects are imported into blender
+    if endstep < 7:
+        return
+
+    ShowMessageBox(
+        "Mesh generation is complete. The combined tetrahedral mesh is imported for inspection. To set optical properties for each region, please click 'Load mesh and setup simulation'",
+        "BlenderPhotonics",
+    )
+
+
+def IsPlainMesh(ob):
+    # a mesh object whose evaluated geometry is its own mesh data
+    return ob.type == "MESH" and len(ob.modifiers) == 0 and not IsLODPreview(ob)
+
+
+def ObjectFingerprint(ob, depsgraph):
+    if IsPlainMesh(ob):
+        # the same arrays and hash as the export of step 5, read through the geometry cache
+        return HashData(*GetMeshArrays(ob))
+    evaluated = ob.evaluated_get(depsgraph)
+    try:
+        mesh = evaluated.to_mesh()
+    except RuntimeError:
+        mesh = None
+    if mesh is None:
+        return None
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    vertexindex = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", vertexindex)
+    looptotal = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", looptotal)
+    evaluated.to_mesh_clear()
+    return HashData(np.array(ob.matrix_world), co, vertexindex, looptotal)
+
+
+def SceneFingerprint(convtri, known=None):
+    """Hash the evaluated geometry and transforms of all objects scene2mesh would mesh
+
+    known maps object names to fingerprints computed before, e.g. the
+    geometry hash of the object exported in step 5
+    """
+    mode = bpy.context.object.mode if bpy.context.object is not None else "OBJECT"
+    if mode != "OBJECT":
+        bpy.ops.object.mode_set(mode="OBJECT")
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    known = known or {}
+    items = [convtri]
+    for ob in sorted(bpy.context.scene.objects, key=lambda ob: ob.name):
+        if ob.type in g_nonmeshtypes:
+            continue
+        items.append(ob.name + ":" + ob.type)
+        if ob.name in known:
+            items.append(known[ob.name])
+        else:
+            items.append(ObjectFingerprint(ob, depsgraph))
+    if mode != "OBJECT":
+        bpy.ops.object.mode_set(mode=mode)
+    return HashData(*items)
+
+
+def LoadSceneState():
+    """Return the fingerprints of the scenes from which a scene2mesh run may start at a later step
+
+    state["fingerprints"] maps a start step to the fingerprints the scene may
+    have to start there; state["geomkey"] hashes the exported blendermesh
+    geometry and state["source"] is the scene before the last step 1.
+    """
+    try:
+        state = LoadExchangeFile("scene2mesh", "data")
+    except FileNotFoundError:
+        state = {}
+    state.setdefault("fingerprints", {})
+    return state
+
+
+def SaveSceneState(state):
+    SaveExchangeFile(state, "scene2mesh", "data")
+
 
 class scene2mesh(bpy.types.Operator):
     bl_label = "Convert scene to tetra mesh"
@@ -88,12 +217,18 @@ class scene2mesh(bpy.types.Operator):
     convtri: bpy.props.BoolProperty(
         default=g_convtri, name="Convert to triangular mesh first)"
     )
+    startstep: bpy.props.EnumProperty(
+        default=g_startstep, name="Start from step", items=enum_startstep
+    )
     endstep: bpy.props.EnumProperty(
         default=g_endstep, name="Run through step", items=enum_endstep
     )
     tetgenopt: bpy.props.StringProperty(
         default=g_tetgenopt, name="Additional tetgen flags"
     )
+    background: bpy.props.BoolProperty(
+        default=g_background, name="Run in background (keep Blender responsive)"
+    )
 
     @classmethod
     def description(cls, context, properties):
@@ -107,28 +242,136 @@ class scene2mesh(bpy.types.Operator):
         if not os.path.isdir(outputdir):
             os.makedirs(outputdir)
 
-        if os.path.exists(os.path.join(outputdir, "regionmesh.jmsh")):
-            os.remove(os.path.join(outputdir, "regionmesh.jmsh"))
-        if os.path.exists(os.path.join(outputdir, "volumemesh.jmsh")):
-            os.remove(os.path.join(outputdir, "volumemesh.jmsh"))
+        startstep, endstep = int(self.startstep), int(self.endstep)
+        if startstep > endstep:
+            ShowMessageBox(
+                "The start step is after the last step to run", "BlenderPhotonics"
+            )
+            return
+
+        state = LoadSceneState()
+        allowed = state["fingerprints"].get(str(startstep), [])
+        if startstep > 1 and (
+            len(allowed) == 0 or SceneFingerprint(self.convtri) not in allowed
+        ):
+            ShowMessageBox(
+                "The scene has changed since step %d was last run (or it was never run), please start from step 1"
+                % (startstep - 1),
+                "BlenderPhotonics",
+            )
+            return
+
+        ResetGeometryStats()
+
+        if startstep == 1:
+            state = {"fingerprints": {}}
+            if endstep >= 5:
+                # the unmodified scene may later be meshed again from the exported file
+                state["source"] = SceneFingerprint(self.convtri)
+
+        steps = [
+            self.convertobjects,
+            self.joinobjects,
+            self.intersectobjects,
+            self.triangulate,
+        ]
+        for step in range(startstep, min(endstep, 4) + 1):
+            steps[step - 1](state)
+        meshdata = None
+        if startstep <= 5 <= endstep:
+            meshdata = self.exportmesh(state)
+
+        if startstep <= 5:
+            # a later run may continue from the next step if the scene is left as it is now
+            nextstep = str(min(endstep, 5) + 1)
+            known = {}
+            exported = bpy.context.view_layer.objects.active
+            if meshdata is not None and IsPlainMesh(exported):
+                # the exported geometry was hashed in step 5 already
+                known[exported.name] = state["geomkey"]
+            state["fingerprints"] = {nextstep: [SceneFingerprint(self.convtri, known)]}
+            if nextstep == "6" and "source" in state:
+                state["fingerprints"][nextstep].append(state["source"])
+            SaveSceneState(state)
+
+        def prepare():
+            # files are replaced when the job starts, not while earlier jobs still use them
+            RemoveExchangeFile("regionmesh")
+            RemoveExchangeFile("volumemesh")
+            RemoveExchangeFile("tetmesh")
+            if meshdata is None:
+                return FindExchangeFile("blendermesh")
+            return SaveExchangeFile(meshdata, "blendermesh")
+
+        if endstep == 5:
+
+            def saveas(job):
+                if not bpy.app.background:
+                    bpy.ops.blender2mesh.invoke_saveas("INVOKE_DEFAULT")
+
+            SubmitBackendJob(
+                "ExportMesh", lambda job: prepare(), saveas, self.background
+            )
+
+        # at this point, all mesh objects are saved to a jmesh file under work-dir as blendermesh.jmsh/.bmsh
+        if endstep < 6:
+            return
+
+        # operator properties are not accessible once execute() returns
+        onlysurf, convtri = self.onlysurf, self.convtri
+        meshparam = {**self.meshparam(), **GetExchangeParam()}
+        cachekey = HashData(state["geomkey"], self.meshparam())
+
+        def apply(job):
+            LoadMeshResult(onlysurf, endstep)
+            # the loaded result may be meshed again from step 6 as well
+            state["fingerprints"]["6"].append(SceneFingerprint(convtri))
+            SaveSceneState(state)
+
+        meshcache = GetResultCache(
+            "mesh", bpy.context.scene.blender_photonics.cachesize
+        )
+
+        def run(job):
+            args = [prepare()]
+            # skip tetgen if the same geometry was meshed with the same parameters
+            if meshcache.restore(cachekey, outputdir) is not None:
+                return
+            if startstep == 6:
+                # new meshing parameters for the geometry exported by an earlier run
+                args.append(
+                    SaveExchangeFile({"param": meshparam}, "blendermeshparam", "data")
+                )
+            job.feval("blender2mesh", *args, nargout=0)
+            meshcache.store(cachekey, GetMeshOutputFiles(outputdir))
+
+        SubmitBackendJob(
+            "Blender2Mesh",
+            run,
+            apply,
+            self.background,
+            g_meshstages,
+        )
+
+    def meshparam(self):
+        return {
+            "keepratio": self.keepratio,
+            "maxvol": self.maxvol,
+            "mergetol": self.mergetol,
+            "dorepair": self.dorepair,
+            "tetgenopt": self.tetgenopt,
+        }
 
+    def convertobjects(self, state):
         # remove camera and source
         for ob in bpy.context.scene.objects:
             ob.select_set(False)
             print(ob.type)
-            if (
-                ob.type == "CAMERA"
-                or ob.type == "LIGHT"
-                or ob.type == "EMPTY"
-                or ob.type == "LAMP"
-                or ob.type == "SPEAKER"
-            ):
+            if ob.type in g_nonmeshtypes:
                 ob.select_set(True)
 
         bpy.ops.object.delete()
 
-        obj = bpy.context.view_layer.objects.active
-
         if not self.convtri:
             bpy.ops.object.select_by_type(type="MESH")
             bpy.ops.object.select_all(action="INVERT")
@@ -137,18 +380,14 @@ class scene2mesh(bpy.types.Operator):
         if len(bpy.context.selected_objects) >= 1:
             bpy.ops.object.convert(target="MESH")
 
+    def joinobjects(self, state):
         # at this point, objects are converted to mesh if possible
-        if int(self.endstep) < 2:
-            return
-
         bpy.ops.object.select_all(action="SELECT")
         if len(bpy.context.selected_objects) >= 2:
             bpy.ops.object.join()
 
+    def intersectobjects(self, state):
         # at this point, objects are jointed
-        if int(self.endstep) < 3:
-            return
-
         bpy.ops.object.select_all(action="DESELECT")
         bpy.ops.object.mode_set(mode="EDIT")
         bpy.ops.mesh.select_all(action="SELECT")
@@ -159,39 +398,28 @@ class scene2mesh(bpy.types.Operator):
             bpy.ops.mesh.intersect(mode="SELECT", separate_mode="NONE")
             print("use fast intersection solver")
 
+    def triangulate(self, state):
         # at this point, overlapping objects are intersected
-        if int(self.endstep) < 4:
-            return
-
         if self.convtri:
+            bpy.ops.object.mode_set(mode="EDIT")
             bpy.ops.mesh.select_all(action="SELECT")
             bpy.ops.mesh.quads_convert_to_tris(
                 quad_method="BEAUTY", ngon_method="BEAUTY"
             )
 
+    def exportmesh(self, state):
         # at this point, if enabled, surfaces are converted to triangular meshes
-        if int(self.endstep) < 5:
-            return
-
         # output mesh data to Octave
         # this works only in object mode,
         bpy.ops.object.mode_set(mode="OBJECT")
         bpy.ops.object.select_all(action="SELECT")
         obj = bpy.context.view_layer.objects.active
-        verts = []
-        for n in range(len(obj.data.vertices)):
-            vert = obj.data.vertices[n].co
-            v_global = obj.matrix_world @ vert
-            verts.append(v_global)
-        edges = [edge.vertices[:] for edge in obj.data.edges]
-        faces = [
-            (np.array(face.vertices[:]) + 1).tolist() for face in obj.data.polygons
-        ]
-        v = np.array(verts)
-        if self.convtri:
-            f = np.array(faces)
+        v, f, polyoffset = GetMeshArrays(obj)
+        state["geomkey"] = HashData(v, f, polyoffset)
+        if polyoffset is None:
+            f = f + 1
         else:
-            f = faces
+            f = PolyToList(f, polyoffset, 1)
 
         # Save file
         meshdata = {
@@ -201,78 +429,14 @@ class scene2mesh(bpy.types.Operator):
             },
             "MeshVertex3": v,
             "MeshPoly": f,
-            "param": {
-                "keepratio": self.keepratio,
-                "maxvol": self.maxvol,
-                "mergetol": self.mergetol,
-                "dorepair": self.dorepair,
-                "tetgenopt": self.tetgenopt,
-            },
+            "param": {**self.meshparam(), **GetExchangeParam()},
         }
-        jd.save(meshdata, os.path.join(outputdir, "blendermesh.jmsh"))
-
-        if int(self.endstep) == 5:
-            bpy.ops.blender2mesh.invoke_saveas("INVOKE_DEFAULT")
-
-        # at this point, all mesh objects are saved to a jmesh file under work-dir as blendermesh.json
-        if int(self.endstep) < 6:
-            return
-
-        try:
-            if bpy.context.scene.blender_photonics.backend == "octave":
-                import oct2py as op
-
-                oc = op.Oct2Py()
-            else:
-                import matlab.engine as op
-
-                oc = op.start_matlab()
-        except ImportError:
-            raise ImportError(
-                "To run this feature, you must install the oct2py or matlab.engine Python modulem first, based on your choice of the backend"
-            )
-
-        oc.addpath(
-            oc.genpath(
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
-            )
-        )
-
-        oc.feval(
-            "blender2mesh",
-            os.path.join(outputdir, "blendermesh.jmsh"),
-            nargout=0,
-        )
-
-        # import volum mesh to blender(just for user to check the result)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete()
-
-        if not self.onlysurf:
-            outputmesh = jd.load(os.path.join(outputdir, "volumemesh.jmsh"))
-            LoadTetMesh(outputmesh, "Iso2Mesh")
-            bpy.context.view_layer.objects.active = bpy.data.objects["Iso2Mesh"]
-        else:
-            regiondata = jd.load(os.path.join(outputdir, "regionmesh.jmsh"))
-            if len(regiondata.keys()) > 0:
-                LoadReginalMesh(regiondata, "region_")
-                bpy.context.view_layer.objects.active = bpy.data.objects["region_1"]
-
-        bpy.context.space_data.shading.type = "WIREFRAME"
-
-        # at this point, if successful, iso2mesh generated mesh objects are imported into blender
-        if int(self.endstep) < 7:
-            return
-
-        ShowMessageBox(
-            "Mesh generation is complete. The combined tetrahedral mesh is imported for inspection. To set optical properties for each region, please click 'Load mesh and setup simulation'",
-            "BlenderPhotonics",
-        )
+        return meshdata
 
     def execute(self, context):
         print("begin to generate mesh")
-        self.func()
+        with ProfileOperator(self).run():
+            self.func()
         return {"FINISHED"}
 
     def invoke(self, context, event):
@@ -307,7 +471,7 @@ class BLENDER2MESH_OT_invoke_saveas(bpy.types.Operator):
             if os.name == "nt":
                 os.popen(
                     "copy '"
-                    + os.path.join(GetBPWorkFolder(), "blendermesh.jmsh")
+                    + FindExchangeFile("blendermesh")
                     + "' '"
                     + self.filepath
                     + "'"
@@ -315,7 +479,7 @@ class BLENDER2MESH_OT_invoke_saveas(bpy.types.Operator):
             else:
                 os.popen(
                     "cp '"
-                    + os.path.join(GetBPWorkFolder(), "blendermesh.jmsh")
+                    + FindExchangeFile("blendermesh")
                     + "' '"
                     + self.filepath
                     + "'"
@@ -325,6 +489,3 @@ class BLENDER2MESH_OT_invoke_saveas(bpy.types.Operator):
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {"RUNNING_MODAL"}
-
-
-register_class(BLENDER2MESH_OT_invoke_saveas)
@@ -0,0 +1,332 @@
+"""JobQueue - run backend (Octave/MATLAB) calls without blocking the Blender UI
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+A job is split into a run() part, executed in a worker thread and allowed to
+call the backend only, and an apply() part, executed on Blender's main thread
+by a modal operator once run() has finished. Jobs are executed one at a time
+in submission order because they share the same backend session; a job may
+spread its own work over several sessions by passing slot numbers to feval(),
+and hand partial results to the main thread with post() while it runs.
+"""
+
+import bpy
+import threading
+import time
+from .utils import *
+from .profiler import GetActiveProfile
+
+g_jobs = []
+g_lastjob = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class BackendJob:
+    def __init__(self, name, run, apply=None, stages=None):
+        self.name = name
+        self.run = run
+        self.apply = apply
+        self.stages = stages if stages else []
+        self.backend = GetBackendName()
+        self.stage = "queued"
+        self.progress = 0.0
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.engines = {}
+        self.nsteps = 0
+        self.stepsdone = 0
+        self.thread = None
+        self.starttime = None
+        self.pending = []
+        self.pendinglock = threading.Lock()
+        # the run profile of the operator that submitted the job, finished after apply()
+        self.profile = GetActiveProfile()
+        if self.profile is not None:
+            self.profile.adoptjob()
+
+    def setstage(self, stage, progress=None):
+        self.stage = stage
+        if progress is not None:
+            self.progress = progress
+
+    def log(self, line):
+        # parse backend output to update the stage shown in the panel
+        line = line.strip()
+        if len(line) == 0:
+            return
+        print(line)
+        for marker, stage, progress in self.stages:
+            if marker in line:
+                if progress is None:
+                    # a repeated step, progress is the fraction of nsteps completed
+                    self.stepsdone += 1
+                    progress = self.stepsdone / max(self.nsteps, 1)
+                    stage = "%s (%d/%d)" % (stage, self.stepsdone, self.nsteps)
+                self.setstage(stage, progress)
+                return
+
+    def post(self, apply):
+        """Queue apply(job) to run on the main thread while run() continues, e.g. to load partial results"""
+        with self.pendinglock:
+            self.pending.append(apply)
+
+    def feval(self, func, *args, nargout=0, slot=0):
+        if self.cancelled:
+            raise JobCancelled()
+        if self.profile is None:
+            return self.callbackend(func, args, nargout, slot)
+        with self.profile.stage("engine #%d" % slot):
+            oc = GetBackendEngine(self.backend, slot)
+        with self.profile.stage("backend %s #%d" % (func, slot)):
+            return self.callbackend(func, args, nargout, slot, oc)
+
+    def callbackend(self, func, args, nargout, slot, oc=None):
+        if oc is None:
+            oc = GetBackendEngine(self.backend, slot)
+        self.engines[slot] = oc
+        try:
+            if hasattr(oc, "exit"):
+                # oct2py: stream the Octave output line-by-line
+                return oc.feval(func, *args, nargout=nargout, stream_handler=self.log)
+            # matlab.engine: run asynchronously so that the call can be cancelled
+            future = oc.feval(func, *args, nargout=nargout, background=True)
+            while not future.done():
+                if self.cancelled:
+                    future.cancel()
+                    raise JobCancelled()
+                time.sleep(0.1)
+            return future.result()
+        except JobCancelled:
+            raise
+        except Exception:
+            if self.cancelled:
+                raise JobCancelled()
+            MarkBackendFailed(self.backend, slot)
+            raise
+        finally:
+            self.engines.pop(slot, None)
+
+    def parallel(self, worker, nworkers):
+        # run worker(slot) for slots 0..nworkers-1 in threads, each with its own session
+        errors = []
+
+        def task(slot):
+            try:
+                worker(slot)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=task, args=(slot,), daemon=True)
+            for slot in range(nworkers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self.cancelled:
+            raise JobCancelled()
+        if len(errors) > 0:
+            raise errors[0]
+
+    def worker(self):
+        try:
+            if self.profile is None:
+                self.result = self.run(self)
+            else:
+                with self.profile.activate():
+                    self.result = self.run(self)
+        except JobCancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        self.starttime = time.perf_counter()
+        self.setstage("running")
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def isdone(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def cancel(self):
+        self.cancelled = True
+        self.setstage("cancelling")
+        for slot, oc in list(self.engines.items()):
+            if hasattr(oc, "exit"):
+                # an Octave call can not be interrupted, stop the session instead;
+                # GetBackendEngine() will start a new one for the next job
+                DiscardBackendEngine(self.backend, slot)
+
+    def elapsed(self):
+        if self.starttime is None:
+            return 0.0
+        return time.perf_counter() - self.starttime
+
+
+def SubmitBackendJob(name, run, apply=None, background=True, stages=None):
+    """Queue a backend job; run it inline if background execution is disabled"""
+    job = BackendJob(name, run, apply, stages)
+    if not background or bpy.app.background:
+        # wait for queued jobs first, they use the same backend session
+        while len(g_jobs) > 0:
+            ProcessJobs(wait=True)
+        job.start()
+        job.thread.join()
+        FinishJob(job)
+        return job
+
+    g_jobs.append(job)
+    if len(g_jobs) == 1:
+        job.start()
+        bpy.ops.blenderphotonics.jobmonitor("INVOKE_DEFAULT")
+    return job
+
+
+def ApplyPending(job):
+    # load the partial results posted by a job so far, on the main thread
+    with job.pendinglock:
+        pending, job.pending = job.pending, []
+    for apply in pending:
+        try:
+            if job.profile is None:
+                apply(job)
+            else:
+                with job.profile.activate(), job.profile.stage(
+                    "apply partial " + job.name
+                ):
+                    apply(job)
+        except Exception as e:
+            if bpy.app.background:
+                raise
+            if job.error is None:
+                job.error = e
+
+
+def FinishJob(job):
+    try:
+        ApplyPending(job)
+        ApplyJob(job)
+    finally:
+        if job.profile is not None:
+            job.profile.finishjob(g_lastjob.get("status", "failed"))
+
+
+def ApplyJob(job):
+    g_lastjob.clear()
+    g_lastjob.update({"name": job.name, "elapsed": job.elapsed(), "status": "finished"})
+    if job.cancelled:
+        g_lastjob["status"] = "cancelled"
+        print("BlenderPhotonics: " + job.name + " was cancelled")
+        return
+    if job.error is not None:
+        g_lastjob["status"] = "failed"
+        ShowMessageBox(
+            job.name + " failed: " + str(job.error), "BlenderPhotonics", "ERROR"
+        )
+        if bpy.app.background:
+            raise job.error
+        return
+    if job.apply is not None:
+        job.setstage("loading results", 1.0)
+        try:
+            if job.profile is None:
+                job.apply(job)
+            else:
+                with job.profile.activate(), job.profile.stage("apply " + job.name):
+                    job.apply(job)
+        except Exception as e:
+            g_lastjob["status"] = "failed"
+            if bpy.app.background:
+                raise
+            ShowMessageBox(
+                job.name + " failed to load results: " + str(e),
+                "BlenderPhotonics",
+                "ERROR",
+            )
+            return
+        if not bpy.app.background:
+            bpy.ops.ed.undo_push(message=job.name)
+    print("BlenderPhotonics: %s completed in %.2f s" % (job.name, job.elapsed()))
+
+
+def ProcessJobs(wait=False):
+    # called on the main thread; returns True while there are pending jobs
+    if len(g_jobs) == 0:
+        return False
+    job = g_jobs[0]
+    if job.thread is None:
+        job.start()
+    if wait:
+        job.thread.join()
+    ApplyPending(job)
+    if not job.isdone():
+        return True
+    g_jobs.pop(0)
+    FinishJob(job)
+    if len(g_jobs) > 0:
+        g_jobs[0].start()
+    return len(g_jobs) > 0
+
+
+def TagPanelRedraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+
+
+class jobmonitor(bpy.types.Operator):
+    bl_label = "Monitor BlenderPhotonics jobs"
+    bl_description = "Poll running backend jobs and load their results when finished"
+    bl_idname = "blenderphotonics.jobmonitor"
+
+    _timer = None
+
+    def modal(self, context, event):
+        if event.type == "TIMER":
+            busy = ProcessJobs()
+            TagPanelRedraw()
+            if not busy:
+                context.window_manager.event_timer_remove(self._timer)
+                return {"FINISHED"}
+        return {"PASS_THROUGH"}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.25, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+
+class canceljob(bpy.types.Operator):
+    bl_label = "Cancel"
+    bl_description = "Cancel the running BlenderPhotonics job and all queued jobs"
+    bl_idname = "blenderphotonics.canceljob"
+
+    def execute(self, context):
+        for job in g_jobs:
+            job.cancel()
+        return {"FINISHED"}
@@ -22,10 +22,10 @@ To cite this work, please use the below information
 """
 
 import bpy
-import numpy as np
-import jdata as jd
 import os
-from .utils import *
+from .utils import *  # also the lazily imported np and jd
+from .meshface import GetRegionMesh
+from .profiler import ProfileOperator
 
 
 class mesh2scene(bpy.types.Operator):
@@ -39,10 +39,8 @@ class mesh2scene(bpy.types.Operator):
         bpy.ops.object.select_all(action="SELECT")
         bpy.ops.object.delete()
 
-        # folder path for importing .jmsh files
-        outputdir = GetBPWorkFolder()
-
-        regiondata = jd.load(os.path.join(outputdir, "regionmesh.jmsh"))
+        # region surfaces are extracted from the labeled tetrahedral mesh
+        regiondata = GetRegionMesh()
         bbx = LoadReginalMesh(regiondata, "region_")
 
         ## add properties
@@ -78,5 +76,6 @@ class mesh2scene(bpy.types.Operator):
 
     def execute(self, context):
         print("begin to import region mesh")
-        self.importmesh()
+        with ProfileOperator(self).run():
+            self.importmesh()
         return {"FINISHED"}
@@ -0,0 +1,217 @@
+"""MeshFace - extracting region and interface surfaces of a labeled tetrahedral mesh
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+This is a NumPy version of the volface/meshface loops in blendersavemesh.m.
+Each face of each tetrahedron is identified by a key made of its 3 sorted
+node indices; a single np.unique call over all keys finds which faces are
+shared by two elements, from which the surface of every label, the
+interfaces between labels and the exterior surface follow without a
+per-label pass over the mesh.
+"""
+
+import os
+from .utils import (
+    GetBPWorkFolder,
+    LoadExchangeFile,
+    JMeshFallback,
+    LazyModule,
+    CompactMesh,
+)
+
+np = LazyModule("numpy")
+
+# face sets of a tetrahedral mesh that can be imported for display
+g_facesets = ("exterior", "interfaces", "all")
+
+# the 4 faces of a tetrahedron, in the same node order as iso2mesh's volface
+g_tetfaces = [[0, 1, 2], [1, 3, 2], [0, 2, 3], [0, 3, 1]]
+
+
+def TetFaces(elem):
+    # all faces (4*Ne, 3) of the elements and the index of the element owning each face
+    elem = np.asarray(elem)[:, 0:4]
+    face = elem[:, g_tetfaces].reshape(-1, 3)
+    owner = np.repeat(np.arange(elem.shape[0]), 4)
+    return face, owner
+
+
+def MatchFaces(face, nn):
+    """Group identical faces regardless of node order
+
+    returns (first, inverse, counts) as np.unique does: the first occurrence
+    of each distinct face, the distinct face id of each input face and the
+    number of elements sharing each distinct face
+    """
+    face = np.sort(face, axis=1).astype(np.int64)
+    if nn**3 < 2**63:
+        keys = (face[:, 0] * nn + face[:, 1]) * nn + face[:, 2]
+        _, first, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+    else:
+        # too many nodes to pack 3 indices in one int64, compare rows instead
+        _, first, inverse, counts = np.unique(
+            face, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+    return first, inverse.ravel(), counts
+
+
+def ExtractMeshFaces(node, elem):
+    """Compute the faces of a labeled tetrahedral mesh
+
+    input:
+        node: (Nn,3) node coordinates
+        elem: (Ne,4) or (Ne,5) 0-based element node indices, the 5th column
+              is the region label (all elements are labeled 1 if absent)
+    output: a dict with 0-based (N,3) uint32 face arrays
+        'allface': every distinct face of the mesh (meshface)
+        'exterior': faces owned by a single element
+        'regions': {label: boundary faces of the elements of this label (volface)}
+        'interfaces': {(label1, label2): faces shared by the two labels, label1 < label2}
+    """
+    elem = np.asarray(elem)
+    if elem.shape[1] > 4:
+        label = elem[:, 4].astype(np.int64)
+    else:
+        label = np.ones(elem.shape[0], dtype=np.int64)
+
+    face, owner = TetFaces(elem)
+    if face.shape[0] == 0:
+        empty = np.zeros((0, 3), dtype=np.uint32)
+        return {"allface": empty, "exterior": empty, "regions": {}, "interfaces": {}}
+    facelabel = label[owner]
+    first, inverse, counts = MatchFaces(face, len(node))
+
+    # labels of the first and second element sharing each distinct face
+    order = np.argsort(inverse, kind="stable")
+    start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    label1 = facelabel[order[start]]
+    label2 = np.where(
+        counts > 1, facelabel[order[np.minimum(start + 1, len(order) - 1)]], 0
+    )
+
+    # a face bounds its own label if no other element of the same label shares it
+    isboundary = (counts[inverse] == 1) | (label1[inverse] != label2[inverse])
+    idx = np.nonzero(isboundary)[0]
+    idx = idx[np.argsort(facelabel[idx], kind="stable")]
+    labels, splits = np.unique(facelabel[idx], return_index=True)
+    regions = {
+        int(lab): face[part].astype(np.uint32)
+        for lab, part in zip(labels, np.split(idx, splits[1:]))
+    }
+
+    interfaces = {}
+    shared = np.nonzero((counts > 1) & (label1 != label2))[0]
+    if len(shared) > 0:
+        pairs = np.sort(np.stack((label1[shared], label2[shared]), axis=1), axis=1)
+        keys, pairid = np.unique(pairs, axis=0, return_inverse=True)
+        pairid = pairid.ravel()
+        for k, (lab1, lab2) in enumerate(keys):
+            interfaces[(int(lab1), int(lab2))] = face[
+                first[shared[pairid == k]]
+            ].astype(np.uint32)
+
+    return {
+        "allface": face[first].astype(np.uint32),
+        "exterior": face[first[counts == 1]].astype(np.uint32),
+        "regions": regions,
+        "interfaces": interfaces,
+    }
+
+
+def SelectFaces(faces, faceset="all"):
+    """Return a face set from the output of ExtractMeshFaces
+
+    faceset can be
+        'exterior': the exterior surface of the mesh
+        'interfaces': the exterior surface and the interfaces between labels
+        'all': every distinct face of the mesh
+    """
+    if faceset == "exterior":
+        return faces["exterior"]
+    if faceset == "interfaces":
+        return np.vstack([faces["exterior"]] + list(faces["interfaces"].values()))
+    return faces["allface"]
+
+
+def LoadTetMeshData(outputdir=None):
+    """Return the nodes (Nn,3) and 0-based labeled elements (Ne,5) of the last tetrahedral mesh
+
+    The mesh is read from the tetmesh.jmsh/.bmsh file written by
+    blendersavemesh.m, or from meshdata.mat if SciPy is installed.
+    """
+    try:
+        tetmesh = JMeshFallback(LoadExchangeFile("tetmesh", "mesh", outputdir))
+        node, elem = tetmesh["MeshVertex3"], tetmesh["MeshElem"]
+    except FileNotFoundError:
+        try:
+            import scipy.io
+        except ImportError:
+            raise FileNotFoundError(
+                "BlenderPhotonics: can not find tetmesh.jmsh/.bmsh, reading meshdata.mat requires SciPy"
+            )
+        if outputdir is None:
+            outputdir = GetBPWorkFolder()
+        meshdata = scipy.io.loadmat(os.path.join(outputdir, "meshdata.mat"))
+        node, elem = meshdata["node"], meshdata["elem"]
+
+    node = np.asarray(node, dtype=np.float64)[:, 0:3]
+    elem = np.array(elem, dtype=np.int64)
+    if elem.shape[1] < 5:
+        elem = np.hstack((elem, np.ones((elem.shape[0], 1), dtype=np.int64)))
+    elem[:, 0:4] -= 1
+    return node, elem[:, 0:5]
+
+
+def GetRegionMesh(outputdir=None):
+    """Return the surface of each label in the layout of regionmesh.jmsh (1-based faces)"""
+    try:
+        node, elem = LoadTetMeshData(outputdir)
+    except FileNotFoundError:
+        # meshes created before tetmesh files were saved
+        return JMeshFallback(LoadExchangeFile("regionmesh", "mesh", outputdir))
+
+    regions = ExtractMeshFaces(node, elem)["regions"]
+    maxtag = int(elem[:, 4].max()) if elem.shape[0] > 0 else 0
+    regionmesh = {"MeshVertex3": node}
+    for n in range(1, maxtag + 1):
+        face = regions.get(n, np.zeros((0, 3), dtype=np.uint32))
+        regionmesh["MeshTri3(" + str(n) + ")"] = face + 1
+    if maxtag == 1:
+        regionmesh["MeshTri3"] = regionmesh.pop("MeshTri3(1)")
+    return regionmesh
+
+
+def GetVolumeMesh(outputdir=None, faceset="all"):
+    """Return a face set of the tetrahedral mesh in the layout of volumemesh.jmsh (1-based faces)
+
+    For a face set other than 'all', only the nodes of the selected faces are
+    kept and "NodeId" holds their 0-based index in the full node list.
+    """
+    try:
+        node, elem = LoadTetMeshData(outputdir)
+    except FileNotFoundError:
+        return JMeshFallback(LoadExchangeFile("volumemesh", "mesh", outputdir))
+    face = SelectFaces(ExtractMeshFaces(node, elem), faceset)
+    if faceset == "all":
+        return {"MeshVertex3": node, "MeshTri3": face + 1}
+    node, face, nodeid = CompactMesh(node, face)
+    return {"MeshVertex3": node, "MeshTri3": face + 1, "NodeId": nodeid}
@@ -0,0 +1,313 @@
+"""MeshLOD - decimated previews of large meshes, with the full mesh kept on disk
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+A mesh with more faces than the "Preview face limit" of the panel is shown
+as a preview made by vertex clustering: the nodes are binned into a uniform
+grid, the nodes of each occupied cell merge into their mean position, and
+the faces that collapse or become duplicates are dropped. The cell size is
+enlarged until the preview is under the limit. The full node/face arrays and
+the node-to-preview-vertex map are saved as .npy files under lod/ in the
+work folder, and the object records the folder in its "bp_lodpath" property.
+
+Per-node values shown on a preview (fluence) are averaged over each cluster.
+The full mesh replaces the preview when the object enters edit or sculpt
+mode, or on request from the panel, and mesh exports read the full arrays
+from disk.
+"""
+
+import os
+import uuid
+import shutil
+import bpy
+from bpy.app.handlers import persistent
+from .utils import (
+    AddMeshFromNodeFace,
+    FillMeshFromNodeFace,
+    GetBPWorkFolder,
+    SetNodeIdAttribute,
+    SetVertexScalars,
+    ShowMessageBox,
+    np,
+)
+from .meshface import MatchFaces
+
+g_lodfaces = 1000000
+g_fulldetailmodes = ("EDIT", "SCULPT")
+g_maxiter = 12
+g_lodclusters = {}
+g_lodscalars = {}
+g_msgbusowner = object()
+
+
+def ClusterVertices(node, face, maxfaces):
+    """Decimate a triangle mesh by vertex clustering to at most maxfaces faces
+
+    returns (newnode, newface, cluster): cluster maps each input node to its
+    0-based vertex in newnode
+    """
+    node = np.asarray(node, dtype=np.float64)
+    face = np.asarray(face, dtype=np.int64)
+    lo = node.min(axis=0)
+    extent = max(float(np.max(node.max(axis=0) - lo)), 1e-12)
+
+    # on a surface the number of occupied cells scales with 1/cellsize^2
+    targetnodes = max(maxfaces // 2, 4)
+    cellsize = extent / np.sqrt(targetnodes)
+    for _ in range(g_maxiter):
+        cell = np.floor((node - lo) / cellsize).astype(np.int64)
+        dims = cell.max(axis=0) + 1
+        key = (cell[:, 0] * dims[1] + cell[:, 1]) * dims[2] + cell[:, 2]
+        _, cluster = np.unique(key, return_inverse=True)
+        cluster = cluster.ravel()
+        nclusters = int(cluster.max()) + 1
+
+        newface = cluster[face]
+        valid = (
+            (newface[:, 0] != newface[:, 1])
+            & (newface[:, 1] != newface[:, 2])
+            & (newface[:, 0] != newface[:, 2])
+        )
+        newface = newface[valid]
+        if newface.shape[0] > 0:
+            first, _, _ = MatchFaces(newface, nclusters)
+            newface = newface[np.sort(first)]
+        if newface.shape[0] <= maxfaces:
+            break
+        # growing the cells by the cube root does not overshoot volume-filling face sets
+        cellsize *= max((newface.shape[0] / maxfaces) ** (1.0 / 3), 1.05)
+
+    counts = np.bincount(cluster, minlength=nclusters)
+    newnode = (
+        np.stack(
+            [
+                np.bincount(cluster, weights=node[:, i], minlength=nclusters)
+                for i in range(3)
+            ],
+            axis=1,
+        )
+        / counts[:, None]
+    )
+    return newnode, newface.astype(np.uint32), cluster.astype(np.int32)
+
+
+def GetLODFaceLimit():
+    try:
+        return bpy.context.scene.blender_photonics.lodfaces
+    except AttributeError:
+        return g_lodfaces
+
+
+def GetLODRoot():
+    return os.path.join(GetBPWorkFolder(), "lod")
+
+
+def IsLODPreview(obj):
+    return obj is not None and obj.get("bp_lodlevel", 0) > 0
+
+
+def PruneLODFiles():
+    # remove the full meshes of objects that no longer exist
+    lodroot = GetLODRoot()
+    if not os.path.isdir(lodroot):
+        return
+    used = {
+        os.path.abspath(obj["bp_lodpath"])
+        for obj in bpy.data.objects
+        if "bp_lodpath" in obj
+    }
+    for entry in os.listdir(lodroot):
+        path = os.path.abspath(os.path.join(lodroot, entry))
+        if path not in used:
+            g_lodclusters.pop(path, None)
+            g_lodscalars.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def AddLODMesh(node, face, name, maxfaces=None, nodeid=None):
+    """Add a mesh object, as a decimated preview if it has more than maxfaces faces
+
+    face is an (Nf,3) 0-based triangle array; maxfaces of 0 disables previews
+    nodeid: index of each node in a larger node list whose per-node values
+            are shown on this mesh, see meshface.GetVolumeMesh
+    """
+    if maxfaces is None:
+        maxfaces = GetLODFaceLimit()
+    face = np.asarray(face)
+    if maxfaces <= 0 or face.shape[0] <= maxfaces:
+        obj = AddMeshFromNodeFace(node, face, name)
+        if nodeid is not None:
+            SetNodeIdAttribute(obj, nodeid)
+        return obj
+
+    PruneLODFiles()
+    node = np.asarray(node, dtype=np.float64)
+    newnode, newface, cluster = ClusterVertices(node, face, maxfaces)
+    lodpath = os.path.join(GetLODRoot(), uuid.uuid4().hex)
+    os.makedirs(lodpath)
+    np.save(os.path.join(lodpath, "node.npy"), node)
+    np.save(os.path.join(lodpath, "face.npy"), face.astype(np.uint32))
+    np.save(os.path.join(lodpath, "cluster.npy"), cluster)
+    if nodeid is not None:
+        np.save(os.path.join(lodpath, "nodeid.npy"), np.asarray(nodeid, dtype=np.int32))
+
+    obj = AddMeshFromNodeFace(newnode, newface, name)
+    obj["bp_lodpath"] = lodpath
+    obj["bp_lodlevel"] = 1
+    obj["bp_lodfaces"] = int(face.shape[0])
+    print(
+        "BlenderPhotonics: %s shown as a %d-face preview of %d faces"
+        % (name, newface.shape[0], face.shape[0])
+    )
+    return obj
+
+
+def LoadFullMesh(obj):
+    # the full-resolution node (Nn,3) and face (Nf,3) arrays of a preview, memory-mapped
+    lodpath = obj["bp_lodpath"]
+    return (
+        np.load(os.path.join(lodpath, "node.npy"), mmap_mode="r"),
+        np.load(os.path.join(lodpath, "face.npy"), mmap_mode="r"),
+    )
+
+
+def GetFullMeshArrays(obj, dtype="float64", worldspace=True):
+    """Same as GetMeshArrays, but returns the full mesh of a preview"""
+    node, face = LoadFullMesh(obj)
+    node = np.asarray(node, dtype=dtype)
+    if worldspace:
+        mat = np.array(obj.matrix_world, dtype=dtype)
+        node = node @ mat[:3, :3].T + mat[:3, 3]
+    return node, np.asarray(face, dtype=np.uint32), None
+
+
+def ReducePreviewValues(obj, values, args):
+    """Average per-node values over the clusters of a preview
+
+    The full-resolution values are kept with the SetVertexScalars arguments
+    args, and written again once the full mesh replaces the preview.
+    """
+    lodpath = os.path.abspath(obj["bp_lodpath"])
+    if lodpath not in g_lodclusters:
+        cluster = np.load(os.path.join(lodpath, "cluster.npy"))
+        nodeid = LoadNodeId(lodpath)
+        g_lodclusters[lodpath] = (cluster, np.maximum(np.bincount(cluster), 1), nodeid)
+    cluster, counts, nodeid = g_lodclusters[lodpath]
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if nodeid is not None and len(values) != len(cluster):
+        values = values[nodeid]
+    if len(values) != len(cluster):
+        return values
+    g_lodscalars.setdefault(lodpath, {})[args[0]] = (values, *args)
+    return np.bincount(cluster, weights=values, minlength=len(counts)) / counts
+
+
+def LoadNodeId(lodpath):
+    filename = os.path.join(lodpath, "nodeid.npy")
+    return np.load(filename) if os.path.isfile(filename) else None
+
+
+def RestoreFullDetail(obj):
+    """Replace the preview geometry of obj by its full mesh, in object mode"""
+    if not IsLODPreview(obj):
+        return False
+    try:
+        node, face = LoadFullMesh(obj)
+    except OSError:
+        ShowMessageBox(
+            "The full-resolution mesh of " + obj.name + " is no longer available",
+            "BlenderPhotonics",
+            "ERROR",
+        )
+        return False
+    mesh = obj.data
+    mesh.clear_geometry()
+    FillMeshFromNodeFace(mesh, node, face)
+    obj["bp_lodlevel"] = 0
+    lodpath = os.path.abspath(obj["bp_lodpath"])
+    nodeid = LoadNodeId(lodpath)
+    if nodeid is not None:
+        SetNodeIdAttribute(obj, nodeid)
+
+    # show the values displayed on the preview at full resolution
+    for values, name, mode, colorbits, vrange in g_lodscalars.pop(lodpath, {}).values():
+        SetVertexScalars(obj, values, name, mode, colorbits, vrange)
+    print(
+        "BlenderPhotonics: loaded the full mesh of %s (%d faces)"
+        % (obj.name, len(face))
+    )
+    return True
+
+
+def OnObjectModeChange():
+    obj = bpy.context.view_layer.objects.active
+    if not IsLODPreview(obj) or obj.mode not in g_fulldetailmodes:
+        return
+    mode = obj.mode
+    bpy.ops.object.mode_set(mode="OBJECT")
+    RestoreFullDetail(obj)
+    bpy.ops.object.mode_set(mode=mode)
+
+
+@persistent
+def SubscribeLODHandlers(*args):
+    # subscriptions are cleared when a file is loaded, so this also runs as a load_post handler
+    bpy.msgbus.clear_by_owner(g_msgbusowner)
+    bpy.msgbus.subscribe_rna(
+        key=(bpy.types.Object, "mode"),
+        owner=g_msgbusowner,
+        args=(),
+        notify=OnObjectModeChange,
+    )
+
+
+def RegisterLODHandlers():
+    SubscribeLODHandlers()
+    if SubscribeLODHandlers not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(SubscribeLODHandlers)
+
+
+def UnregisterLODHandlers():
+    bpy.msgbus.clear_by_owner(g_msgbusowner)
+    if SubscribeLODHandlers in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(SubscribeLODHandlers)
+
+
+class lodfulldetail(bpy.types.Operator):
+    bl_label = "Load full detail"
+    bl_description = (
+        "Replace the decimated preview of the active object by its full-resolution mesh"
+    )
+    bl_idname = "blenderphotonics.lodfulldetail"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        return IsLODPreview(context.active_object)
+
+    def execute(self, context):
+        obj = context.active_object
+        mode = obj.mode
+        if mode != "OBJECT":
+            bpy.ops.object.mode_set(mode="OBJECT")
+        RestoreFullDetail(obj)
+        if mode != "OBJECT":
+            bpy.ops.object.mode_set(mode=mode)
+        return {"FINISHED"}
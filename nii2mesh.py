@@ -23,10 +23,13 @@ To cite this work, please use the below information
 
 
 import bpy
-import numpy as np
-import jdata as jd
 import os
-from .utils import *
+from .utils import *  # also the lazily imported np and jd
+from .jobqueue import SubmitBackendJob
+from .resultcache import GetResultCache, HashData, HashFile
+from .meshface import GetRegionMesh
+from .niireader import PrepareVolume
+from .profiler import ProfileOperator, ProfileStage
 
 g_maxvol = 100
 g_radbound = 10
@@ -34,6 +37,31 @@ g_distbound = 1.0
 g_isovalue = 0.5
 g_imagetype = "multi-label"
 g_method = "auto"
+g_crop = True
+g_downsample = 1
+g_background = True
+g_volmeshstages = [
+    ("surface mesh", "extracting surfaces", 0.3),
+    ("volume mesh", "tetrahedral meshing", 0.6),
+    ("begin to save whole volumic mesh", "saving region surfaces", 0.85),
+    ("saving complete", "mesh saved", 0.95),
+]
+
+
+def LoadRegionResult():
+    # import volum mesh to blender(just for user to check the result)
+    bpy.ops.object.select_all(action="SELECT")
+    bpy.ops.object.delete()
+
+    regiondata = GetRegionMesh()
+    LoadReginalMesh(regiondata, "region_")
+
+    SetViewportShading("WIREFRAME")
+
+    ShowMessageBox(
+        "Mesh generation is complete. The combined tetrahedral mesh is imported for inspection. To set optical properties for each region, please click 'Load mesh and setup simulation'",
+        "BlenderPhotonics",
+    )
 
 
 class nii2mesh(bpy.types.Operator):
@@ -71,89 +99,78 @@ class nii2mesh(bpy.types.Operator):
             ("simplify", "simplify", "simplify"),
         ],
     )
+    crop: bpy.props.BoolProperty(
+        default=g_crop, name="Crop to the non-background voxels before meshing"
+    )
+    downsample: bpy.props.IntProperty(
+        default=g_downsample, min=1, max=16, name="Downsample by an integer factor"
+    )
+    background: bpy.props.BoolProperty(
+        default=g_background, name="Run in background (keep Blender responsive)"
+    )
 
     def vol2mesh(self):
-        # Remove last .jmsh file
         outputdir = GetBPWorkFolder()
         if not os.path.isdir(outputdir):
             os.makedirs(outputdir)
-        if os.path.exists(os.path.join(outputdir, "regionmesh.jmsh")):
-            os.remove(os.path.join(outputdir, "regionmesh.jmsh"))
-        if os.path.exists(os.path.join(outputdir, "volumemesh.jmsh")):
-            os.remove(os.path.join(outputdir, "volumemesh.jmsh"))
 
         # nii to mesh
         niipath = bpy.context.scene.blender_photonics.path
         print(niipath)
         if len(niipath) == 0:
             return
-        jd.save(
-            {
-                "niipath": niipath,
-                "maxvol": self.maxvol,
-                "radbound": self.radbound,
-                "distbound": self.distbound,
-                "isovalue": self.isovalue,
-                "imagetype": self.imagetype,
-                "method": self.method,
-            },
-            os.path.join(outputdir, "niipath.json"),
+        volparam = {
+            "maxvol": self.maxvol,
+            "radbound": self.radbound,
+            "distbound": self.distbound,
+            "isovalue": self.isovalue,
+            "imagetype": self.imagetype,
+            "method": self.method,
+            "crop": self.crop,
+            "downsample": self.downsample,
+        }
+
+        meshcache = GetResultCache(
+            "mesh", bpy.context.scene.blender_photonics.cachesize
         )
-
-        # run MMC
-        try:
-            if bpy.context.scene.blender_photonics.backend == "octave":
-                import oct2py as op
-
-                oc = op.Oct2Py()
-            else:
-                import matlab.engine as op
-
-                oc = op.start_matlab()
-        except ImportError:
-            raise ImportError(
-                "To run this feature, you must install the `oct2py` or `matlab.engine` Python module first, based on your choice of the backend"
-            )
-
-        oc.addpath(
-            oc.genpath(
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
-            )
-        )
-
-        oc.feval("nii2mesh", os.path.join(outputdir, "niipath.json"), nargout=0)
-
-        # import volum mesh to blender(just for user to check the result)
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete()
-
-        regiondata = jd.load(os.path.join(outputdir, "regionmesh.jmsh"))
-        regiondata = JMeshFallback(regiondata)
-        n = len(regiondata.keys()) - 1
-
-        # To import mesh.ply in batches
-        for i in range(0, n):
-            surfkey = "MeshTri3(" + str(i + 1) + ")"
-            if n == 1:
-                surfkey = "MeshTri3"
-            if not isinstance(regiondata[surfkey], np.ndarray):
-                regiondata[surfkey] = np.asarray(regiondata[surfkey], dtype=np.uint32)
-            regiondata[surfkey] -= 1
-            AddMeshFromNodeFace(
-                regiondata["MeshVertex3"],
-                regiondata[surfkey].tolist(),
-                "region_" + str(i + 1),
-            )
-
-        bpy.context.space_data.shading.type = "WIREFRAME"
-
-        ShowMessageBox(
-            "Mesh generation is complete. The combined tetrahedral mesh is imported for inspection. To set optical properties for each region, please click 'Load mesh and setup simulation'",
-            "BlenderPhotonics",
+        exchangeparam = GetExchangeParam()
+
+        # run nii2mesh in the backend, then load the region surfaces
+        paramfile = os.path.join(outputdir, "niipath.json")
+
+        def run(job):
+            # Remove last .jmsh/.bmsh file, once the jobs queued before have loaded theirs
+            RemoveExchangeFile("regionmesh")
+            RemoveExchangeFile("volumemesh")
+            RemoveExchangeFile("tetmesh")
+
+            # reuse a previous mesh of the same volume content and parameters
+            cachekey = None
+            if meshcache.enabled() and os.path.isfile(niipath):
+                cachekey = HashData(HashFile(niipath).hexdigest(), volparam)
+                if meshcache.restore(cachekey, outputdir) is not None:
+                    return
+
+            # hand only the cropped/downsampled region of the volume to the backend
+            job.setstage("reading volume", 0.05)
+            with ProfileStage("prepare volume"):
+                volinfo = PrepareVolume(niipath, volparam, outputdir)
+            jd.save({**volparam, **volinfo, **exchangeparam}, paramfile)
+            job.feval("nii2mesh", paramfile, nargout=0)
+            if cachekey is not None:
+                meshcache.store(cachekey, GetMeshOutputFiles(outputdir))
+
+        SubmitBackendJob(
+            "Volume2Mesh",
+            run,
+            lambda job: LoadRegionResult(),
+            self.background,
+            g_volmeshstages,
         )
 
     def execute(self, context):
-        self.vol2mesh()
+        with ProfileOperator(self).run():
+            self.vol2mesh()
         return {"FINISHED"}
 
     def invoke(self, context, event):
@@ -169,5 +186,5 @@ class setmeshingprop(bpy.types.Panel):
     bl_region_type = "UI"
 
     def draw(self, context):
-        global g_maxvol, g_radbound, g_distbound, g_imagetype, g_method
+        global g_maxvol, g_radbound, g_distbound, g_imagetype, g_method, g_crop, g_downsample
         self.layout.operator("object.dialog_operator")
@@ -22,8 +22,20 @@ To cite this work, please use the below information
 """
 
 import bpy
-from bpy.props import StringProperty, EnumProperty
+from bpy.props import (
+    StringProperty,
+    EnumProperty,
+    BoolProperty,
+    FloatProperty,
+    IntProperty,
+)
 from bpy.types import PropertyGroup
+from .utils import WarmBackendEngine
+
+
+def UpdatePrewarm(self, context):
+    if self.prewarm:
+        WarmBackendEngine(self.backend)
 
 
 class niifile(PropertyGroup):
@@ -58,3 +70,73 @@ class niifile(PropertyGroup):
             ),
         ),
     )
+    exchange: EnumProperty(
+        name="Exchange format",
+        description="File format of the intermediate mesh/data files passed between Blender and the backend",
+        default="jmsh",
+        items=(
+            (
+                "jmsh",
+                "Text",
+                "Human-readable JSON-based JData (.jmsh/.json/.jnii)",
+            ),
+            (
+                "bmsh",
+                "Binary",
+                "Binary JData (.bmsh/.bjd/.bnii) with typed arrays, smaller and faster to parse; requires the bjdata Python module and a JSONLab with savebj/loadbj in the backend",
+            ),
+        ),
+    )
+    compression: EnumProperty(
+        name="Compression",
+        description="Compress array data in the intermediate files (requires ZMat in the backend)",
+        default="none",
+        items=(
+            ("none", "None", "Store arrays uncompressed"),
+            ("zlib", "zlib", "Compress arrays with zlib"),
+            (
+                "lz4",
+                "lz4",
+                "Compress arrays with lz4 (fast, requires the lz4 Python module)",
+            ),
+        ),
+    )
+    cachesize: FloatProperty(
+        name="Cache size (MB)",
+        description="Disk space used to keep previously generated meshes and simulation results, least recently used entries are removed first; set to 0 to disable caching",
+        default=2048,
+        min=0,
+    )
+    faceset: EnumProperty(
+        name="Mesh faces",
+        description="Faces of the tetrahedral mesh imported to display meshes and simulation results",
+        default="all",
+        items=(
+            ("exterior", "Exterior", "Import the exterior surface only"),
+            (
+                "interfaces",
+                "Exterior + interfaces",
+                "Import the exterior surface and the interfaces between regions",
+            ),
+            ("all", "All faces", "Import every face of every tetrahedron"),
+        ),
+    )
+    lodfaces: IntProperty(
+        name="Preview face limit",
+        description="Meshes with more faces than this are shown as a decimated preview, the full mesh is loaded in edit mode and used for export; set to 0 to always load the full mesh",
+        default=1000000,
+        min=0,
+    )
+    reportfile: StringProperty(
+        name="Run report",
+        description="JSON-lines file to which the timing and memory use of each run is appended; bpreport.jsonl in the work folder if empty",
+        default="",
+        maxlen=2048,
+        subtype="FILE_PATH",
+    )
+    prewarm: BoolProperty(
+        name="Pre-start backend",
+        description="Start the Octave/MATLAB session in the background once the add-on is loaded, and keep it running for all subsequent operations",
+        default=False,
+        update=UpdatePrewarm,
+    )
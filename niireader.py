@@ -0,0 +1,273 @@
+"""NiiReader - memory-mapped reading, cropping and downsampling of 3-D volumes
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+NIfTI-1/2 files (.nii, .hdr/.img) are memory-mapped after parsing the
+header; .nii.gz files are decompressed once into a cache folder and mapped
+from there. JNIfTI files (.jnii/.bnii) are loaded with jdata. The label
+histogram and the bounding box of the foreground are computed a few slices
+at a time, then only the bounding box (plus a margin), optionally
+downsampled by an integer factor, is saved for the backend to mesh. The
+backend maps the mesh back to the voxel coordinates of the full volume by
+
+    node = (node - 0.5) * factor + 0.5 + offset
+"""
+
+import os
+import gzip
+import shutil
+import struct
+from .utils import GetBPWorkFolder, SaveExchangeFile, LazyModule
+from .resultcache import HashData
+
+np = LazyModule("numpy")
+jd = LazyModule("jdata")
+
+g_niftitype = {
+    2: "uint8",
+    4: "int16",
+    8: "int32",
+    16: "float32",
+    64: "float64",
+    256: "int8",
+    512: "uint16",
+    768: "uint32",
+    1024: "int64",
+    1280: "uint64",
+}
+g_chunkslices = 16
+g_maxlabels = 256
+
+
+def ReadNiftiHeader(filename):
+    """Parse the fields of a NIfTI-1 or NIfTI-2 header needed to map the voxel data"""
+    with open(filename, "rb") as fp:
+        raw = fp.read(540)
+    for endian in ("<", ">"):
+        sizeof_hdr = struct.unpack(endian + "i", raw[0:4])[0]
+        if sizeof_hdr == 348:
+            dim = struct.unpack(endian + "8h", raw[40:56])
+            datatype, bitpix = struct.unpack(endian + "2h", raw[70:74])
+            pixdim = struct.unpack(endian + "8f", raw[76:108])
+            voxoffset, slope, inter = struct.unpack(endian + "3f", raw[108:120])
+            break
+        if sizeof_hdr == 540:
+            datatype, bitpix = struct.unpack(endian + "2h", raw[12:16])
+            dim = struct.unpack(endian + "8q", raw[16:80])
+            pixdim = struct.unpack(endian + "8d", raw[104:168])
+            voxoffset = struct.unpack(endian + "q", raw[168:176])[0]
+            slope, inter = struct.unpack(endian + "2d", raw[176:192])
+            break
+    else:
+        raise ValueError("BlenderPhotonics: " + filename + " is not a NIfTI file")
+    if datatype not in g_niftitype:
+        raise ValueError("BlenderPhotonics: unsupported NIfTI data type %d" % datatype)
+    ndim = max(min(dim[0], 7), 1)
+    return {
+        "dim": [int(d) for d in dim[1 : ndim + 1]],
+        "dtype": np.dtype(g_niftitype[datatype]).newbyteorder(endian),
+        "pixdim": [float(p) for p in pixdim[1 : ndim + 1]],
+        "voxoffset": int(voxoffset),
+        "slope": float(slope),
+        "inter": float(inter),
+    }
+
+
+def GetDecompressedFile(filename):
+    # decompress a .nii.gz once, keyed by its path, size and modification time
+    stat = os.stat(filename)
+    cachedir = os.path.join(GetBPWorkFolder(), "cache", "nifti")
+    os.makedirs(cachedir, exist_ok=True)
+    key = HashData(os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    niifile = os.path.join(cachedir, key + ".nii")
+    if not os.path.exists(niifile):
+        with gzip.open(filename, "rb") as src, open(niifile + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 24)
+        os.replace(niifile + ".tmp", niifile)
+    return niifile
+
+
+def OpenVolume(filename):
+    """Return (data, header) of a volume; data is a read-only memory map for NIfTI files
+
+    Returns (None, None) for formats that are only read by the backend (.mat, URLs).
+    """
+    lower = filename.lower()
+    if lower.startswith("http") or lower.endswith(".mat"):
+        return None, None
+    if lower.endswith((".jnii", ".bnii", ".json")):
+        vol = jd.load(filename)
+        data = np.asarray(vol["NIFTIData"])
+        header = vol.get("NIFTIHeader", {})
+        pixdim = header.get("VoxelSize", [1.0] * data.ndim)
+        return data, {
+            "dim": list(data.shape),
+            "pixdim": list(np.ravel(pixdim)),
+            "slope": 0.0,
+            "inter": 0.0,
+        }
+
+    if lower.endswith(".nii.gz"):
+        filename = GetDecompressedFile(filename)
+    datafile = filename
+    if lower.endswith((".hdr", ".img")):
+        filename = os.path.splitext(filename)[0] + ".hdr"
+        datafile = os.path.splitext(filename)[0] + ".img"
+    header = ReadNiftiHeader(filename)
+    data = np.memmap(
+        datafile,
+        dtype=header["dtype"],
+        mode="r",
+        offset=header["voxoffset"],
+        shape=tuple(header["dim"]),
+        order="F",
+    )
+    return data, header
+
+
+def FirstFrame(data):
+    # the first 3-D frame of a 4-D or higher volume, without reading the others
+    return data[(slice(None),) * 3 + (0,) * (data.ndim - 3)]
+
+
+def ScanVolume(data, threshold=None):
+    """Compute the value histogram and the foreground bounding box slab by slab
+
+    threshold: voxels above it are foreground, or nonzero voxels if None
+    returns (histogram, bbox): histogram maps each value to its voxel count
+    and is None once there are more than g_maxlabels distinct values; bbox is
+    a (lo, hi) pair of inclusive voxel index arrays, or None if all voxels
+    are background
+    """
+    data = FirstFrame(data)
+    hist = {}
+    anyaxis = [np.zeros(n, dtype=bool) for n in data.shape]
+    for z0 in range(0, data.shape[2], g_chunkslices):
+        slab = np.asarray(data[:, :, z0 : z0 + g_chunkslices])
+        if hist is not None:
+            values, counts = np.unique(slab, return_counts=True)
+            for v, c in zip(values.tolist(), counts.tolist()):
+                hist[v] = hist.get(v, 0) + c
+            if len(hist) > g_maxlabels:
+                hist = None
+        mask = slab != 0 if threshold is None else slab > threshold
+        anyaxis[0] |= mask.any(axis=(1, 2))
+        anyaxis[1] |= mask.any(axis=(0, 2))
+        anyaxis[2][z0 : z0 + slab.shape[2]] = mask.any(axis=(0, 1))
+    if not anyaxis[0].any():
+        return hist, None
+    lo = np.array([np.argmax(a) for a in anyaxis])
+    hi = np.array([len(a) - 1 - np.argmax(a[::-1]) for a in anyaxis])
+    return hist, (lo, hi)
+
+
+def CropVolume(data, bbox, factor=1, margin=1, isgray=False):
+    """Cut the bounding box plus a margin, padded to a multiple of factor, and downsample
+
+    label volumes keep the center voxel of each factor^3 block, grayscale
+    volumes take the block mean; returns (compact, offset) where offset is
+    the index of the first input voxel of the first block. For even factors,
+    a label block has no center voxel and the one below the center is kept,
+    offset is then moved by -0.5 so that the block center maps to that voxel.
+    """
+    data = FirstFrame(data)
+    shape = np.array(data.shape[0:3])
+    lo = np.maximum(bbox[0] - margin * factor, 0)
+    hi = np.minimum(bbox[1] + margin * factor, shape - 1)
+    size = -(-(hi - lo + 1) // factor) * factor
+
+    crop = np.asarray(data[lo[0] : hi[0] + 1, lo[1] : hi[1] + 1, lo[2] : hi[2] + 1])
+    if factor == 1:
+        return np.ascontiguousarray(crop), lo
+
+    # pad with background so that each axis is a multiple of factor
+    padded = np.zeros(tuple(size), dtype=crop.dtype)
+    padded[: crop.shape[0], : crop.shape[1], : crop.shape[2]] = crop
+    if isgray:
+        blocks = padded.reshape(
+            size[0] // factor,
+            factor,
+            size[1] // factor,
+            factor,
+            size[2] // factor,
+            factor,
+        )
+        return blocks.mean(axis=(1, 3, 5)).astype(np.float32), lo
+    center = (factor - 1) // 2
+    return (
+        np.ascontiguousarray(padded[center::factor, center::factor, center::factor]),
+        lo + (center - (factor - 1) / 2),
+    )
+
+
+def PrepareVolume(niipath, volparam, outputdir=None):
+    """Crop and downsample a volume for meshing, return the extra nii2mesh parameters
+
+    The returned dict replaces niipath by the compact volume and adds the
+    "offset" and "factor" of the voxel mapping and, when known, the number of
+    distinct values ("labelnum") so that the backend skips its own pass over
+    the volume. Volumes that can not be read here are passed on unchanged.
+    """
+    data, header = OpenVolume(niipath)
+    if data is None or data.ndim < 3:
+        return {"niipath": niipath}
+
+    isgray = volparam.get("imagetype") == "grayscale"
+    threshold = (
+        volparam.get("isovalue")
+        if volparam.get("imagetype") in ("binary", "grayscale")
+        else None
+    )
+    hist, bbox = ScanVolume(data, threshold)
+    info = {"niipath": niipath}
+    if hist is not None:
+        info["labelnum"] = len(hist)
+    factor = max(int(volparam.get("downsample", 1)), 1)
+    if bbox is None or (not volparam.get("crop", True) and factor == 1):
+        return info
+    if not volparam.get("crop", True):
+        bbox = (np.zeros(3, dtype=np.int64), np.array(data.shape[0:3]) - 1)
+
+    compact, offset = CropVolume(data, bbox, factor, 1, isgray)
+    if header.get("slope", 0.0) not in (0.0, 1.0) or header.get("inter", 0.0) != 0.0:
+        compact = compact * header["slope"] + header["inter"]
+    pixdim = header.get("pixdim", [1.0, 1.0, 1.0])[0:3]
+    info["niipath"] = SaveExchangeFile(
+        {
+            "NIFTIHeader": {
+                "Dim": list(compact.shape),
+                "VoxelSize": [float(p) * factor for p in pixdim],
+            },
+            "NIFTIData": compact,
+        },
+        "volumecrop",
+        "vol",
+        outputdir,
+    )
+    if factor > 1 or threshold is not None:
+        # downsampling and cropping at the threshold may drop values, count those meshed
+        info["labelnum"] = int(len(np.unique(compact)))
+    info["offset"] = [float(v) for v in offset]
+    info["factor"] = factor
+    print(
+        "BlenderPhotonics: cropped %s from %s to %s voxels (factor %d)"
+        % (niipath, list(data.shape[0:3]), list(compact.shape), factor)
+    )
+    return info
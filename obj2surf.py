@@ -22,11 +22,11 @@ To cite this work, please use the below information
 
 import bpy
 from bpy_extras.io_utils import ImportHelper
-import numpy as np
-import jdata as jd
 import os
-from bpy.utils import register_class, unregister_class
-from .utils import *
+import threading
+from .utils import *  # also the lazily imported np and jd
+from .jobqueue import SubmitBackendJob
+from .profiler import ProfileOperator, RunProfile
 
 g_action = "repair"
 g_actionparam = 1.0
@@ -59,18 +59,18 @@ enum_action = [
     ),
     (
         "boolean-diff",
-        "Boolean-diff: 1st mesh subtract 2nd",
-        "Return the 1st object subtracted by the 2nd",
+        "Boolean-diff: active mesh subtract others",
+        "Return the active object subtracted by all other selected objects (the 1st subtracted by the 2nd if none is active)",
     ),
     (
         "boolean-and",
         "Boolean-and: Space in both objects",
-        "Return the surface of the overlapping region",
+        "Return the surface of the region shared by all selected objects",
     ),
     (
         "boolean-or",
         "Boolean-or: Space for joint/union space",
-        "Return the outer surface of the merged object",
+        "Return the outer surface of all selected objects merged",
     ),
     (
         "boolean-decouple",
@@ -99,6 +99,202 @@ enum_action = [
         "Fix self-intersection and fill holes of a closed object",
     ),
 ]
+g_background = True
+g_surfworkers = 2
+# actions applied to each object independently, these can run in parallel sessions
+g_perobjectactions = ("repair", "smooth", "reorient", "simplify", "remesh")
+g_surfstages = [
+    ("begin to save surface mesh", "saving surface mesh", 0.9),
+]
+g_surfshardstages = [
+    ("begin to save surface mesh", "processing objects", None),
+]
+# Boolean actions that also apply to more than two objects, and their surfboolean operation
+g_nwayactions = {"boolean-or": "or", "boolean-and": "and", "boolean-diff": "diff"}
+g_booleanstages = [
+    ("boolean", "Boolean operations", None),
+]
+
+
+def AddSurfaceObject(ob, objname):
+    if ("_DataInfo_" in ob) and ("BlenderObjectName" in ob["_DataInfo_"]):
+        objname = ob["_DataInfo_"]["BlenderObjectName"]
+    obj = AddMeshFromNodeFace(
+        ob["MeshVertex3"],
+        np.asarray(ob["MeshTri3"], dtype=np.int32) - 1,
+        objname,
+    )
+    bpy.context.view_layer.objects.active = obj
+    return obj
+
+
+def LoadSurfaceResult(objnames):
+    # import volum mesh to blender(just for user to check the result)
+    for name in objnames:
+        if name in bpy.data.objects:
+            bpy.data.objects.remove(bpy.data.objects[name], do_unlink=True)
+
+    surfdata = LoadExchangeFile("surfacemesh")
+    if len(surfdata["MeshGroup"]) > 0:
+        ob = surfdata["MeshGroup"]
+        if "MeshVertex3" in ob:
+            AddSurfaceObject(ob, "surf_1")
+        else:
+            for idx, ob in enumerate(surfdata["MeshGroup"]):
+                AddSurfaceObject(ob, "surf_" + str(idx + 1))
+
+    SetViewportShading("WIREFRAME")
+
+    ShowMessageBox(
+        "Mesh generation is complete. The combined surface mesh is imported for inspection.",
+        "BlenderPhotonics",
+    )
+
+
+def LoadSurfaceShard(surfdata, idx, objname):
+    # replace one processed object as soon as its backend call returns
+    if objname in bpy.data.objects:
+        bpy.data.objects.remove(bpy.data.objects[objname], do_unlink=True)
+    ob = surfdata["MeshGroup"]
+    if isinstance(ob, list):
+        ob = ob[0]
+    AddSurfaceObject(ob, "surf_" + str(idx + 1))
+
+
+def SubmitSurfaceShards(surfdata, objnames, nworkers, background):
+    """Process each object of MeshGroup in its own backend call, over nworkers sessions
+
+    Objects are handed out one at a time, largest first, to the parallel
+    sessions, and each result replaces its object once it is done.
+    """
+    outputdir = GetBPWorkFolder()
+    objs = surfdata["MeshGroup"]
+    nworkers = min(max(nworkers, 1), len(objs))
+    shardroot = os.path.join(outputdir, "surfshard")
+
+    # separate folders, as each session writes its own surfacemesh file
+    workdirs = [os.path.join(shardroot, "worker%d" % k) for k in range(nworkers)]
+    order = sorted(
+        range(len(objs)), key=lambda i: len(objs[i]["MeshVertex3"]), reverse=True
+    )
+    orderlock = threading.Lock()
+
+    def run(job):
+        job.nsteps = len(objs)
+        # the shared shard folder is written only once the jobs queued before are done
+        for workdir in workdirs:
+            os.makedirs(workdir, exist_ok=True)
+        surffiles = [
+            SaveExchangeFile(
+                {**surfdata, "MeshGroup": [ob]},
+                "blendersurf%d" % idx,
+                outputdir=shardroot,
+            )
+            for idx, ob in enumerate(objs)
+        ]
+
+        def worker(slot):
+            oc = GetBackendEngine(job.backend, slot)
+            SetBackendWorkFolder(oc, workdirs[slot])
+            try:
+                while not job.cancelled:
+                    with orderlock:
+                        if len(order) == 0:
+                            return
+                        idx = order.pop(0)
+                    RemoveExchangeFile("surfacemesh", "mesh", workdirs[slot])
+                    job.feval("blender2surf", surffiles[idx], nargout=0, slot=slot)
+                    result = LoadExchangeFile("surfacemesh", "mesh", workdirs[slot])
+                    job.post(
+                        lambda job, idx=idx, result=result: LoadSurfaceShard(
+                            result, idx, objnames[idx]
+                        )
+                    )
+            finally:
+                RestoreBackendWorkFolder(oc, job.backend, slot, outputdir)
+
+        job.parallel(worker, nworkers)
+
+    def apply(job):
+        SetViewportShading("WIREFRAME")
+        ShowMessageBox(
+            "Processed %d objects with %d workers in %.1f s"
+            % (len(objs), nworkers, job.elapsed()),
+            "BlenderPhotonics",
+        )
+
+    SubmitBackendJob("Blender2Surf", run, apply, background, g_surfshardstages)
+
+
+def BooleanTree(job, surfs, op, nworkers):
+    """Combine surfaces with a balanced binary tree of Boolean operations
+
+    surfs is a list of (node, 1-based face) arrays. Each level of the tree
+    combines disjoint pairs concurrently in up to nworkers sessions, and the
+    intermediate surfaces are passed to and from the backend in memory.
+    """
+    while len(surfs) > 1:
+        pairs = [(surfs[i], surfs[i + 1]) for i in range(0, len(surfs) - 1, 2)]
+        results = [None] * len(pairs)
+        todo = list(range(len(pairs)))
+        todolock = threading.Lock()
+
+        def worker(slot):
+            while not job.cancelled:
+                with todolock:
+                    if len(todo) == 0:
+                        return
+                    k = todo.pop(0)
+                (node1, face1), (node2, face2) = pairs[k]
+                node, face = job.feval(
+                    "bpboolean", node1, face1, op, node2, face2, nargout=2, slot=slot
+                )
+                results[k] = (
+                    np.asarray(node, dtype=np.float64).reshape(-1, 3),
+                    np.asarray(face, dtype=np.float64).reshape(-1, 3),
+                )
+
+        job.parallel(worker, min(max(nworkers, 1), len(pairs)))
+        # an unpaired surface moves up to the next level
+        surfs = results + surfs[2 * len(pairs) :]
+    return surfs[0]
+
+
+def SubmitBooleanTree(surfdata, objnames, action, nworkers, background):
+    """Apply an N-way Boolean union, intersection or difference to all objects of MeshGroup
+
+    the difference is the first object of MeshGroup minus all others
+    """
+    op = g_nwayactions[action]
+    surfs = [
+        (
+            np.asarray(ob["MeshVertex3"], dtype=np.float64),
+            np.asarray(ob["MeshTri3"], dtype=np.float64),
+        )
+        for ob in surfdata["MeshGroup"]
+    ]
+
+    def run(job):
+        job.nsteps = len(surfs) - 1
+        if op == "diff":
+            # the first object minus the union of all others
+            rest = BooleanTree(job, surfs[1:], "or", nworkers)
+            return BooleanTree(job, [surfs[0], rest], "diff", 1)
+        return BooleanTree(job, surfs, op, nworkers)
+
+    def apply(job):
+        for name in objnames:
+            if name in bpy.data.objects:
+                bpy.data.objects.remove(bpy.data.objects[name], do_unlink=True)
+        node, face = job.result
+        AddSurfaceObject({"MeshVertex3": node, "MeshTri3": face}, "surf_1")
+        SetViewportShading("WIREFRAME")
+        ShowMessageBox(
+            "Combined %d objects (%s) in %.1f s" % (len(surfs), action, job.elapsed()),
+            "BlenderPhotonics",
+        )
+
+    SubmitBackendJob("Blender2Surf", run, apply, background, g_booleanstages)
 
 
 class object2surf(bpy.types.Operator):
@@ -118,6 +314,16 @@ class object2surf(bpy.types.Operator):
     convtri: bpy.props.BoolProperty(
         default=g_convtri, name="Convert to triangular mesh first"
     )
+    background: bpy.props.BoolProperty(
+        default=g_background, name="Run in background (keep Blender responsive)"
+    )
+    nworkers: bpy.props.IntProperty(
+        default=g_surfworkers,
+        min=1,
+        max=64,
+        name="Parallel backend sessions",
+        description="Number of backend sessions that process the selected objects in parallel (repair, smooth, reorient, simplify, remesh and Boolean operations of more than two objects)",
+    )
 
     @classmethod
     def description(cls, context, properties):
@@ -131,12 +337,14 @@ class object2surf(bpy.types.Operator):
         if not os.path.isdir(outputdir):
             os.makedirs(outputdir)
 
-        if os.path.exists(os.path.join(outputdir, "surfacemesh.jmsh")):
-            os.remove(os.path.join(outputdir, "surfacemesh.jmsh"))
+        ResetGeometryStats()
+        # the conversions below change the active object
+        active = bpy.context.view_layer.objects.active
+        activename = active.name if active is not None else None
 
         if len(bpy.context.selected_objects) < 1:
             ShowMessageBox(
-                "Must select at least one object (for Boolean operations, select two)",
+                "Must select at least one object (for Boolean operations, select two or more)",
                 "BlenderPhotonics",
             )
             return
@@ -153,13 +361,36 @@ class object2surf(bpy.types.Operator):
             ):
                 ob.select_set(False)
 
-        bpy.ops.object.convert(target="MESH")
+        # convert and triangulate only the objects that need it, so that the
+        # others are not marked as changed and keep their cached geometry;
+        # converting a mesh applies its modifiers, which GetMeshArrays does not see
+        selected = list(bpy.context.selected_objects)
+        convert = [ob for ob in selected if ob.type != "MESH" or len(ob.modifiers) > 0]
+        if len(convert) > 0:
+            for ob in selected:
+                ob.select_set(ob in convert)
+            bpy.context.view_layer.objects.active = convert[0]
+            bpy.ops.object.convert(target="MESH")
+            for ob in selected:
+                ob.select_set(True)
 
-        bpy.ops.object.mode_set(mode="EDIT")
         if self.convtri:
-            bpy.ops.mesh.quads_convert_to_tris(
-                quad_method="BEAUTY", ngon_method="BEAUTY"
-            )
+            selected = list(bpy.context.selected_objects)
+            quads = [
+                ob for ob in selected if ob.type == "MESH" and not IsTriangleMesh(ob)
+            ]
+            if len(quads) > 0:
+                for ob in selected:
+                    ob.select_set(ob in quads)
+                bpy.context.view_layer.objects.active = quads[0]
+                bpy.ops.object.mode_set(mode="EDIT")
+                bpy.ops.mesh.select_all(action="SELECT")
+                bpy.ops.mesh.quads_convert_to_tris(
+                    quad_method="BEAUTY", ngon_method="BEAUTY"
+                )
+                bpy.ops.object.mode_set(mode="OBJECT")
+                for ob in selected:
+                    ob.select_set(True)
 
         if len(bpy.context.selected_objects) < 1:
             ShowMessageBox("No mesh-like object was selected, skip", "BlenderPhotonics")
@@ -178,84 +409,72 @@ class object2surf(bpy.types.Operator):
             objsurf = GetNodeFacefromObject(ob, self.convtri)
             surfdata["MeshGroup"].append(objsurf)
 
-        surfdata["param"] = {"action": self.action, "level": self.actionparam}
-
-        jd.save(surfdata, os.path.join(outputdir, "blendersurf.jmsh"))
+        surfdata["param"] = {
+            "action": self.action,
+            "level": self.actionparam,
+            **GetExchangeParam(),
+        }
 
-        # at this point, objects are converted to mesh if possible
-        if self.action == "export":
-            bpy.ops.object2surf.invoke_export("INVOKE_DEFAULT")
+        # the processed objects are replaced once the backend returns
+        objnames = [ob.name for ob in bpy.context.selected_objects]
+        if self.action == "boolean-diff" and activename in objnames:
+            # subtract all other objects from the active one, the backend subtracts from the 1st
+            k = objnames.index(activename)
+            objnames.insert(0, objnames.pop(k))
+            surfdata["MeshGroup"].insert(0, surfdata["MeshGroup"].pop(k))
+        if (
+            self.action in g_perobjectactions
+            and len(objnames) > 1
+            and self.nworkers > 1
+        ):
+            SubmitSurfaceShards(surfdata, objnames, self.nworkers, self.background)
             return
-
-        try:
-            if bpy.context.scene.blender_photonics.backend == "octave":
-                import oct2py as op
-
-                oc = op.Oct2Py()
-            else:
-                import matlab.engine as op
-
-                oc = op.start_matlab()
-        except ImportError:
-            raise ImportError(
-                "To run this feature, you must install the oct2py or matlab.engine Python modulem first, based on your choice of the backend"
+        if self.action in g_nwayactions and len(objnames) > 2:
+            # GetNodeFacefromObject returns all-quad meshes as a 4-column MeshTri3
+            if any(
+                "MeshTri3" not in ob or np.shape(ob["MeshTri3"])[1] != 3
+                for ob in surfdata["MeshGroup"]
+            ):
+                ShowMessageBox(
+                    "Boolean operations of more than two objects require triangular meshes, please enable 'Convert to triangular mesh first'",
+                    "BlenderPhotonics",
+                )
+                return
+            SubmitBooleanTree(
+                surfdata, objnames, self.action, self.nworkers, self.background
             )
+            return
 
-        oc.addpath(
-            oc.genpath(
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
-            )
-        )
+        def prepare():
+            # the parallel paths above write their own per-object files; files are
+            # replaced when the job starts, not while earlier jobs still use them
+            RemoveExchangeFile("surfacemesh")
+            return SaveExchangeFile(surfdata, "blendersurf")
 
-        oc.feval(
-            "blender2surf",
-            os.path.join(outputdir, "blendersurf.jmsh"),
-            nargout=0,
-        )
+        # at this point, objects are converted to mesh if possible
+        if self.action == "export":
 
-        # import volum mesh to blender(just for user to check the result)
-        if len(bpy.context.selected_objects) >= 1:
-            bpy.ops.object.delete()
-
-        surfdata = jd.load(os.path.join(outputdir, "surfacemesh.jmsh"))
-        idx = 1
-        if len(surfdata["MeshGroup"]) > 0:
-            ob = surfdata["MeshGroup"]
-            objname = "surf_" + str(idx)
-            if "MeshVertex3" in ob:
-                if ("_DataInfo_" in ob) and ("BlenderObjectName" in ob["_DataInfo_"]):
-                    objname = ob["_DataInfo_"]["BlenderObjectName"]
-                AddMeshFromNodeFace(
-                    ob["MeshVertex3"],
-                    (np.array(ob["MeshTri3"]) - 1).tolist(),
-                    objname,
-                )
-                bpy.context.view_layer.objects.active = bpy.data.objects[objname]
-            else:
-                for ob in surfdata["MeshGroup"]:
-                    objname = "surf_" + str(idx)
-                    if ("_DataInfo_" in ob) and (
-                        "BlenderObjectName" in ob["_DataInfo_"]
-                    ):
-                        objname = ob["_DataInfo_"]["BlenderObjectName"]
-                    AddMeshFromNodeFace(
-                        ob["MeshVertex3"],
-                        (np.array(ob["MeshTri3"]) - 1).tolist(),
-                        objname,
-                    )
-                    bpy.context.view_layer.objects.active = bpy.data.objects[objname]
-                    idx += 1
+            def saveas(job):
+                if not bpy.app.background:
+                    bpy.ops.object2surf.invoke_export("INVOKE_DEFAULT")
 
-        bpy.context.space_data.shading.type = "WIREFRAME"
+            SubmitBackendJob(
+                "ExportSurface", lambda job: prepare(), saveas, self.background
+            )
+            return
 
-        ShowMessageBox(
-            "Mesh generation is complete. The combined surface mesh is imported for inspection.",
-            "BlenderPhotonics",
+        SubmitBackendJob(
+            "Blender2Surf",
+            lambda job: job.feval("blender2surf", prepare(), nargout=0),
+            lambda job: LoadSurfaceResult(objnames),
+            self.background,
+            g_surfstages,
         )
 
     def execute(self, context):
         print("begin to process object surface mesh")
-        self.func()
+        with ProfileOperator(self).run():
+            self.func()
         return {"FINISHED"}
 
     def invoke(self, context, event):
@@ -294,7 +513,7 @@ class OBJECT2SURF_OT_invoke_export(bpy.types.Operator):
             if os.name == "nt":
                 os.popen(
                     "copy '"
-                    + os.path.join(GetBPWorkFolder(), "blendersurf.jmsh")
+                    + FindExchangeFile("blendersurf")
                     + "' '"
                     + self.filepath
                     + "'"
@@ -302,7 +521,7 @@ class OBJECT2SURF_OT_invoke_export(bpy.types.Operator):
             else:
                 os.popen(
                     "cp '"
-                    + os.path.join(GetBPWorkFolder(), "blendersurf.jmsh")
+                    + FindExchangeFile("blendersurf")
                     + "' '"
                     + self.filepath
                     + "'"
@@ -314,9 +533,6 @@ class OBJECT2SURF_OT_invoke_export(bpy.types.Operator):
         return {"RUNNING_MODAL"}
 
 
-register_class(OBJECT2SURF_OT_invoke_export)
-
-
 # This operator will open Blender's file chooser when invoked
 # and store the selected filepath in self.filepath and print it
 # to the console using window_manager.fileselect_add()
@@ -336,34 +552,23 @@ class OBJECT2SURF_OT_invoke_import(bpy.types.Operator, ImportHelper):
     )
 
     def execute(self, context):
-        # run MMC
-        try:
-            if bpy.context.scene.blender_photonics.backend == "octave":
-                import oct2py as op
-
-                oc = op.Oct2Py()
-            else:
-                import matlab.engine as op
-
-                oc = op.start_matlab()
-        except ImportError:
-            raise ImportError(
-                "To run this feature, you must install the `oct2py` or `matlab.engine` Python module first, based on your choice of the backend"
+        # read the file in the backend session shared with the other jobs
+        filepath = self.filepath
+        with RunProfile(
+            "object2surf", {"action": "import", "filepath": filepath}
+        ).run():
+            SubmitBackendJob(
+                "ImportSurface",
+                lambda job: job.feval("surf2jmesh", filepath, nargout=1),
+                lambda job: AddMeshFromNodeFace(
+                    job.result["MeshVertex3"],
+                    np.asarray(job.result["MeshTri3"], dtype=np.int32) - 1,
+                    "importedsurf",
+                ),
             )
 
-        oc.addpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "script"))
-        surfdata = oc.feval("surf2jmesh", self.filepath)
-        AddMeshFromNodeFace(
-            surfdata["MeshVertex3"],
-            (np.array(surfdata["MeshTri3"]) - 1).tolist(),
-            "importedsurf",
-        )
-
         return {"FINISHED"}
 
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {"RUNNING_MODAL"}
-
-
-register_class(OBJECT2SURF_OT_invoke_import)
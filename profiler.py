@@ -0,0 +1,320 @@
+"""Profiler - per-stage timing and memory records of a BlenderPhotonics run
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+An operator creates a RunProfile and activates it while it runs; the helpers
+in utils.py (mesh export/import, exchange file I/O) and every backend call
+of a job then add a stage to the active profile. Each stage records the wall
+time, the CPU time of the calling thread, the resident memory of the Blender
+process at its end and the change during the stage (memory allocated by
+other threads in the meantime is included), and the shape/size of the
+arrays it handled. The peak resident memory of the process is only
+recorded once per run, as it never decreases. Time spent in
+the backend process shows up as wall time of the backend call stages only.
+When the run (including the apply step of its jobs) ends, the profile is
+kept in g_lastrun for the panel and appended as one JSON line to
+bpreport.jsonl in the work folder, or to the report file set in the panel.
+"""
+
+import os
+import sys
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+g_reportname = "bpreport.jsonl"
+g_lastrun = {}
+g_active = threading.local()
+g_reportlock = threading.Lock()
+
+
+def GetPeakRSS():
+    # peak resident set size of this process in MB, None if it can not be queried
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes on Linux
+        return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+
+        meminfo = psutil.Process().memory_info()
+        return getattr(meminfo, "peak_wset", meminfo.rss) / 1048576
+    except (ImportError, AttributeError):
+        return None
+
+
+def GetRSS():
+    # current resident set size of this process in MB, None if it can not be queried
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1048576
+    except ImportError:
+        return None
+
+
+def ArrayInfo(data):
+    # shape, type and size of an array-like value, or None for other values
+    if hasattr(data, "nbytes") and hasattr(data, "shape"):
+        return {
+            "shape": [int(n) for n in data.shape],
+            "dtype": str(getattr(data, "dtype", "")),
+            "MB": data.nbytes / 1048576,
+        }
+    if isinstance(data, (list, tuple)):
+        return {"shape": [len(data)], "dtype": "list", "MB": None}
+    return None
+
+
+class RunProfile:
+    def __init__(self, name, params=None):
+        self.name = name
+        self.params = params if params else {}
+        self.stages = []
+        self.jobs = 0
+        self.status = "finished"
+        self.finished = False
+        self.lock = threading.Lock()
+        self.starttime = time.perf_counter()
+        self.startcpu = time.process_time()
+        self.timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    @contextmanager
+    def stage(self, name, **arrays):
+        """Record the body of a with-block as a stage; arrays may also be added by addarrays()"""
+        entry = {"name": name, "thread": threading.current_thread().name}
+        entry["arrays"] = {}
+        self.addarrays(entry, **arrays)
+        stack = self.getstack()
+        stack.append(entry)
+        t0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        rss0 = GetRSS()
+        try:
+            yield entry
+        except BaseException:
+            entry["error"] = True
+            raise
+        finally:
+            entry["wall"] = time.perf_counter() - t0
+            entry["cpu"] = time.thread_time() - cpu0
+            entry["rss"] = GetRSS()
+            entry["rssdelta"] = (
+                entry["rss"] - rss0 if None not in (rss0, entry["rss"]) else None
+            )
+            entry["start"] = t0 - self.starttime
+            entry["depth"] = len(stack) - 1
+            stack.pop()
+            with self.lock:
+                self.stages.append(entry)
+
+    def getstack(self):
+        # nesting of the open stages, kept per thread
+        stacks = getattr(g_active, "stacks", None)
+        if stacks is None:
+            stacks = g_active.stacks = {}
+        return stacks.setdefault(id(self), [])
+
+    def addarrays(self, entry=None, **arrays):
+        if entry is None:
+            stack = self.getstack()
+            if len(stack) == 0:
+                return
+            entry = stack[-1]
+        for key, data in arrays.items():
+            info = ArrayInfo(data)
+            if info is not None:
+                entry["arrays"][key] = info
+
+    @contextmanager
+    def activate(self):
+        """Make this the profile that ProfileStage() records into, in the calling thread"""
+        previous = getattr(g_active, "profile", None)
+        g_active.profile = self
+        try:
+            yield self
+        finally:
+            g_active.profile = previous
+
+    @contextmanager
+    def run(self):
+        """Activate the profile for an operator; finish it unless a job took it over"""
+        status = "finished"
+        try:
+            with self.activate():
+                yield self
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            if self.jobs == 0:
+                self.finish(status)
+
+    def adoptjob(self):
+        # a job that will finish the profile after its apply() step
+        self.jobs += 1
+
+    def finishjob(self, status="finished"):
+        self.jobs = max(self.jobs - 1, 0)
+        if status != "finished":
+            self.status = status
+        if self.jobs == 0:
+            self.finish(self.status)
+
+    def report(self):
+        stages = sorted(self.stages, key=lambda s: s["start"])
+        return {
+            "name": self.name,
+            "time": self.timestamp,
+            "version": GetAddonVersion(),
+            "blender": bpy.app.version_string if bpy is not None else None,
+            "status": self.status,
+            "wall": time.perf_counter() - self.starttime,
+            "cpu": time.process_time() - self.startcpu,
+            "peakrss": GetPeakRSS(),
+            "params": self.params,
+            "stages": stages,
+        }
+
+    def finish(self, status="finished"):
+        if self.finished:
+            return
+        self.finished = True
+        self.status = status
+        report = self.report()
+        g_lastrun.clear()
+        g_lastrun.update(report)
+        SaveRunReport(report)
+
+
+def GetAddonVersion():
+    addon = sys.modules.get(__package__) if __package__ else None
+    version = getattr(addon, "bl_info", {}).get("version")
+    return ".".join(str(v) for v in version) if version else None
+
+
+def GetReportFile():
+    reportfile = ""
+    if bpy is not None and hasattr(bpy.context, "scene"):
+        try:
+            reportfile = bpy.path.abspath(
+                bpy.context.scene.blender_photonics.reportfile
+            )
+        except AttributeError:
+            reportfile = ""
+    if reportfile == "":
+        from .utils import GetBPWorkFolder
+
+        reportfile = os.path.join(GetBPWorkFolder(), g_reportname)
+    return reportfile
+
+
+def SaveRunReport(report, reportfile=None):
+    """Append a run report as one JSON line"""
+    if reportfile is None:
+        reportfile = GetReportFile()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(reportfile)), exist_ok=True)
+        with g_reportlock, open(reportfile, "a") as fp:
+            fp.write(json.dumps(report, default=str) + "\n")
+    except OSError as e:
+        print("BlenderPhotonics: can not write run report to %s: %s" % (reportfile, e))
+
+
+def GetActiveProfile():
+    return getattr(g_active, "profile", None)
+
+
+@contextmanager
+def ProfileStage(name, **arrays):
+    """Record a stage in the active profile of this thread, do nothing if there is none"""
+    profile = GetActiveProfile()
+    if profile is None:
+        yield None
+        return
+    with profile.stage(name, **arrays) as entry:
+        yield entry
+
+
+def ProfileArrays(**arrays):
+    # attach array sizes to the innermost open stage of the active profile
+    profile = GetActiveProfile()
+    if profile is not None:
+        profile.addarrays(**arrays)
+
+
+def SummarizeRun(run, nstages=3):
+    """Return the one-line summary and the slowest stages of a run report, for the panel"""
+    peak = run.get("peakrss")
+    summary = "%s %s in %.2f s (cpu %.2f s%s)" % (
+        run["name"],
+        run["status"],
+        run["wall"],
+        run["cpu"],
+        ", peak %.0f MB" % peak if peak is not None else "",
+    )
+    toplevel = [s for s in run["stages"] if s["depth"] == 0]
+    slowest = sorted(toplevel, key=lambda s: s["wall"], reverse=True)[0:nstages]
+    lines = []
+    for s in slowest:
+        size = sum(a["MB"] for a in s["arrays"].values() if a["MB"] is not None)
+        delta = s.get("rssdelta")
+        lines.append(
+            "%s: %.2f s%s%s"
+            % (
+                s["name"],
+                s["wall"],
+                ", %.1f MB" % size if size > 0 else "",
+                ", rss %+.0f MB" % delta if delta is not None else "",
+            )
+        )
+    return summary, lines
+
+
+def OperatorParams(op):
+    # the property values of an operator, as recorded in the run report
+    params = {}
+    for key in getattr(type(op), "__annotations__", {}):
+        value = getattr(op, key, None)
+        if hasattr(value, "__len__") and not isinstance(value, str):
+            value = list(value)
+        params[key] = value
+    return params
+
+
+def ProfileOperator(op):
+    """Return a RunProfile named after an operator class, with its settings as parameters"""
+    return RunProfile(type(op).__name__, OperatorParams(op))
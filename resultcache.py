@@ -0,0 +1,168 @@
+"""ResultCache - content-addressed on-disk cache of backend outputs
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+Each entry is a folder named by the SHA-256 hash of the inputs that produced
+it (geometry arrays, volume file content and parameters), holding copies of
+the output files. Entries are evicted in least-recently-used order once the
+total size exceeds the configured limit.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from .utils import GetBPWorkFolder, LazyModule
+
+np = LazyModule("numpy")
+
+g_caches = {}
+
+# a .mat file starts with a 128-byte text header holding the creation time
+MAT_HEADER_SIZE = 128
+
+
+def HashFile(filename, hasher=None, offset=0):
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def HashData(*items):
+    # hash arrays, strings and JSON-serializable parameter blocks into a hex key
+    hasher = hashlib.sha256()
+    for item in items:
+        if item is None:
+            hasher.update(b"\0")
+        elif isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            hasher.update((item.dtype.str + str(item.shape)).encode())
+            hasher.update(item.data)
+        elif isinstance(item, bytes):
+            hasher.update(item)
+        elif isinstance(item, str):
+            hasher.update(item.encode())
+        else:
+            hasher.update(json.dumps(item, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, name, maxsize=2048):
+        self.name = name
+        self.root = os.path.join(GetBPWorkFolder(), "cache", name)
+        self.maxsize = maxsize * 1048576  # maxsize in MB
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.indexfile = os.path.join(self.root, "index.json")
+        self.index = {}
+        if os.path.exists(self.indexfile):
+            try:
+                with open(self.indexfile, "r") as fp:
+                    self.index = json.load(fp)
+            except (OSError, ValueError):
+                self.index = {}
+
+    def saveindex(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.indexfile + ".tmp", "w") as fp:
+            json.dump(self.index, fp)
+        os.replace(self.indexfile + ".tmp", self.indexfile)
+
+    def enabled(self):
+        return self.maxsize > 0
+
+    def restore(self, key, outputdir):
+        """Copy the cached files of key to outputdir, return the entry or None"""
+        if not self.enabled():
+            return None
+        with self.lock:
+            entry = self.index.get(key)
+            entrydir = os.path.join(self.root, key)
+            if entry is None or not all(
+                os.path.exists(os.path.join(entrydir, f)) for f in entry["files"]
+            ):
+                self.misses += 1
+                return None
+            for f in entry["files"]:
+                shutil.copy2(os.path.join(entrydir, f), os.path.join(outputdir, f))
+                # make the restored copy the newest file of its kind
+                os.utime(os.path.join(outputdir, f))
+            entry["atime"] = time.time()
+            self.hits += 1
+            self.saveindex()
+        print("BlenderPhotonics: %s cache hit %s" % (self.name, key[:12]))
+        return entry
+
+    def store(self, key, files, info=None):
+        """Copy existing files into the cache entry of key and evict old entries"""
+        if not self.enabled():
+            return
+        files = [f for f in files if os.path.exists(f)]
+        with self.lock:
+            entrydir = os.path.join(self.root, key)
+            os.makedirs(entrydir, exist_ok=True)
+            for f in files:
+                shutil.copy2(f, os.path.join(entrydir, os.path.basename(f)))
+            self.index[key] = {
+                "files": [os.path.basename(f) for f in files],
+                "size": sum(os.path.getsize(f) for f in files),
+                "ctime": time.time(),
+                "atime": time.time(),
+                "info": info if info is not None else {},
+            }
+            self.evict()
+            self.saveindex()
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["atime"]):
+            if total <= self.maxsize:
+                break
+            total -= self.index[key]["size"]
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            del self.index[key]
+
+    def entries(self):
+        # list of (key, entry) pairs, most recently used first
+        return sorted(self.index.items(), key=lambda kv: -kv[1]["atime"])
+
+    def totalsize(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.index = {}
+
+
+def GetResultCache(name, maxsize=None):
+    if name not in g_caches:
+        g_caches[name] = ResultCache(name)
+    if maxsize is not None:
+        g_caches[name].maxsize = maxsize * 1048576
+    return g_caches[name]
@@ -22,10 +22,16 @@ To cite this work, please use the below information
 """
 
 import bpy
-import numpy as np
-import jdata as jd
 import os
-from .utils import *
+import time
+import shutil
+from .utils import *  # also the lazily imported np and jd
+from .jobqueue import SubmitBackendJob
+from .resultcache import GetResultCache, HashData, HashFile, MAT_HEADER_SIZE
+from .meshface import GetVolumeMesh
+from .tetindex import FindSourceElem
+from .meshlod import AddLODMesh
+from .profiler import ProfileOperator, ProfileStage
 
 g_nphoton = 10000
 g_tend = 5e-9
@@ -37,6 +43,495 @@ g_isnormalized = True
 g_basisorder = 1
 g_debuglevel = "TP"
 g_gpuid = "1"
+g_colormode = "color"
+g_colorbits = 0
+g_background = True
+g_scanmode = "single"
+g_scanpath = ""
+g_scansteps = 10
+g_scanworkers = 2
+g_nsplit = 1
+g_seed = 1648335518
+g_mmcresults = []
+# stored simulations are reloaded into this subfolder of the work folder
+g_restorefolder = "mmcrestore"
+g_fluxframes = {}
+g_mmcstages = [
+    ("initializing", "initializing MMC", 0.1),
+    ("launching", "simulating photons", 0.2),
+    ("simulated", "post-processing", 0.8),
+    ("saved", "saving output", 0.9),
+]
+g_pointsources = ("pencil", "isotropic", "cone")
+g_mmcscanstages = [
+    ("scanned source position", "scanning source positions", None),
+]
+
+
+def LoadMMCMesh(outputdir=None):
+    # remove all object and import all region as one object
+    bpy.ops.object.select_all(action="SELECT")
+    bpy.ops.object.delete()
+
+    outputmesh = GetVolumeMesh(outputdir, faceset=GetFaceSet())
+    face = np.asarray(outputmesh["MeshTri3"], dtype=np.uint32) - 1
+    return AddLODMesh(
+        outputmesh["MeshVertex3"], face, "Iso2Mesh", nodeid=outputmesh.get("NodeId")
+    )
+
+
+def LoadMMCResult(colormode, colorbits, outputdir=None):
+    obj = LoadMMCMesh(outputdir)
+
+    # add color to blender model
+    mmcoutput = LoadExchangeFile("mmcoutput", "data", outputdir)
+    mmcoutput["logflux"] = np.asarray(mmcoutput["logflux"], dtype="float32")
+
+    ShowFluence(obj, mmcoutput["logflux"], colormode, colorbits)
+
+    # time-resolved results are played back one gate per animation frame
+    if int(mmcoutput.get("ngates", 1)) > 1:
+        OpenFluxFrames(obj, mmcoutput, colormode, colorbits, outputdir)
+
+
+def OpenFluxFrames(obj, mmcoutput, colormode, colorbits, outputdir=None):
+    """Map all time gates of mmcflux.bin and show the gate of the current frame
+
+    The file is opened with np.memmap, only the gate requested by the frame
+    change handler is read from disk, so results larger than the memory can
+    be played back. All gates share the color scale given by "logrange".
+    """
+    CloseFluxFrames()
+    ngates = int(mmcoutput["ngates"])
+    if outputdir is None:
+        outputdir = GetBPWorkFolder()
+    fluxfile = os.path.join(outputdir, "mmcflux.bin")
+    nnode = os.path.getsize(fluxfile) // (4 * ngates)
+    scene = bpy.context.scene
+    g_fluxframes.update(
+        {
+            "object": obj.name,
+            "frames": np.memmap(
+                fluxfile, dtype=np.float32, mode="r", shape=(ngates, nnode)
+            ),
+            "logrange": [float(v) for v in np.ravel(mmcoutput["logrange"])],
+            "colormode": colormode,
+            "colorbits": colorbits,
+            "gate": None,
+        }
+    )
+    scene.frame_end = scene.frame_start + ngates - 1
+    if UpdateFluxFrame not in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.append(UpdateFluxFrame)
+    UpdateFluxFrame(scene)
+
+
+def CloseFluxFrames():
+    # release the memory map, e.g. before mmcflux.bin is overwritten
+    g_fluxframes.clear()
+
+
+def RemoveMMCOutput(outputdir):
+    # call CloseFluxFrames() on the main thread first
+    RemoveExchangeFile("mmcoutput", "data", outputdir)
+    for fname in ("mmcflux.bin", "mmcfluxvar.bin"):
+        if os.path.exists(os.path.join(outputdir, fname)):
+            os.remove(os.path.join(outputdir, fname))
+
+
+def UpdateFluxFrame(scene, depsgraph=None):
+    if "frames" not in g_fluxframes:
+        return
+    obj = bpy.data.objects.get(g_fluxframes["object"])
+    if obj is None:
+        return
+    frames = g_fluxframes["frames"]
+    gate = min(max(scene.frame_current - scene.frame_start, 0), len(frames) - 1)
+    if gate == g_fluxframes["gate"]:
+        return
+    g_fluxframes["gate"] = gate
+    logflux = FluxToLog(np.array(frames[gate]))
+    if g_fluxframes["colormode"] == "weight":
+        name, mode = "weight", "weight"
+    else:
+        name, mode = "fluence", g_fluxframes["colormode"]
+    SetVertexScalars(
+        obj, logflux, name, mode, g_fluxframes["colorbits"], g_fluxframes["logrange"]
+    )
+
+
+def GetSourcePoses(source, scanmode, scanpath="", scansteps=g_scansteps):
+    """Return the source positions (N,3), quaternions (N,4) and frames to scan
+
+    In "keyframes" mode, the poses are read from the source object at each of
+    its animation keyframes; in "curve" mode, scansteps points are sampled at
+    equal arc length along the curve object named scanpath, keeping the source
+    rotation.
+    """
+    scene = bpy.context.scene
+    if scanmode == "keyframes":
+        anim = source.animation_data
+        if anim is None or anim.action is None:
+            raise ValueError("The source object has no animation keyframes to scan")
+        frames = sorted(
+            {
+                int(round(key.co[0]))
+                for fcurve in anim.action.fcurves
+                for key in fcurve.keyframe_points
+            }
+        )
+        srcpos, srcdir = [], []
+        current = scene.frame_current
+        for frame in frames:
+            scene.frame_set(frame)
+            srcpos.append(list(source.matrix_world.translation))
+            srcdir.append(list(source.matrix_world.to_quaternion()))
+        scene.frame_set(current)
+        return np.array(srcpos), np.array(srcdir), frames
+
+    curve = bpy.data.objects.get(scanpath)
+    if curve is None or curve.type != "CURVE":
+        raise ValueError("Please set the scan path to the name of a curve object")
+    evaluated = curve.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    pathmesh = evaluated.to_mesh()
+    points = np.empty(len(pathmesh.vertices) * 3, dtype=np.float64)
+    pathmesh.vertices.foreach_get("co", points)
+    evaluated.to_mesh_clear()
+    if len(points) == 0:
+        raise ValueError("The scan path curve has no points")
+    mat = np.array(curve.matrix_world)
+    points = points.reshape(-1, 3) @ mat[:3, :3].T + mat[:3, 3]
+    # equal steps along the path, curve points are denser where the curve bends
+    arclen = np.concatenate(
+        ([0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1)))
+    )
+    if arclen[-1] > 0:
+        target = np.linspace(0.0, arclen[-1], scansteps)
+        points = np.stack(
+            [np.interp(target, arclen, points[:, i]) for i in range(3)], axis=1
+        )
+    else:
+        points = np.repeat(points[:1], scansteps, axis=0)
+    quat = list(source.matrix_world.to_quaternion())
+    return points, np.tile(quat, (len(points), 1)), list(range(len(points)))
+
+
+def LoadMMCScanResult(workdirs, srcpos, srcdir, frames, colormode, colorbits):
+    # stack the per-worker results in scan order and show the first position
+    logflux = None
+    for workdir in workdirs:
+        data = LoadExchangeFile("mmcscan", "data", workdir)
+        rows = np.atleast_2d(np.asarray(data["logflux"], dtype=np.float32))
+        index = np.atleast_1d(np.asarray(data["index"], dtype=np.int64))
+        if logflux is None:
+            logflux = np.empty((len(srcpos), rows.shape[1]), dtype=np.float32)
+        logflux[index] = rows
+
+    SaveExchangeFile(
+        {
+            "logflux": logflux,
+            "index": np.arange(len(srcpos), dtype=np.int32),
+            "frame": np.asarray(frames, dtype=np.int32),
+            "srcpos": np.asarray(srcpos, dtype=np.float32),
+            "srcdir": np.asarray(srcdir, dtype=np.float32),
+        },
+        "mmcscan",
+        "data",
+    )
+
+    obj = LoadMMCMesh()
+    ShowFluence(obj, logflux[0], colormode, colorbits)
+
+
+def LocateSourceElem(meshkey, srctype, srcpos, outputdir):
+    # precompute cfg.e0 from the cached spatial index so that blendermmc.m skips tsearchn
+    if srctype not in g_pointsources:
+        return None
+    try:
+        with ProfileStage("locate source elements"):
+            return FindSourceElem(meshkey, srcpos, outputdir).tolist()
+    except FileNotFoundError:
+        return None
+
+
+def SaveMMCInfo(paramfile, parameters, cfg):
+    jd.save({"prop": parameters, "cfg": cfg, **GetExchangeParam()}, paramfile)
+
+
+def GetMeshKey(meshfile):
+    # read when the job starts, as a meshing job queued before may replace the mesh
+    if not os.path.exists(meshfile):
+        raise FileNotFoundError(
+            "No tetrahedral mesh was found, please create a mesh first"
+        )
+    return HashFile(meshfile, offset=MAT_HEADER_SIZE).hexdigest()
+
+
+def SubmitMMCScan(
+    paramfile,
+    meshfile,
+    parameters,
+    cfg,
+    srcpos,
+    srcdir,
+    frames,
+    nworkers,
+    colormode,
+    colorbits,
+    background,
+):
+    """Split the source poses over nworkers backend sessions, each loading the mesh once"""
+    outputdir = GetBPWorkFolder()
+    npos = len(srcpos)
+    chunks = np.array_split(np.arange(npos), min(max(nworkers, 1), npos))
+    # separate folders, as each session writes its own mmccfg/mmcscan files
+    workdirs = [
+        os.path.join(outputdir, "mmcscan", "worker%d" % k) for k in range(len(chunks))
+    ]
+
+    def run(job):
+        job.nsteps = npos
+        meshkey = GetMeshKey(meshfile)
+        RemoveMMCOutput(outputdir)
+        SaveMMCInfo(paramfile, parameters, cfg)
+        RemoveExchangeFile("mmcscan", "data")
+        for workdir in workdirs:
+            os.makedirs(workdir, exist_ok=True)
+            RemoveExchangeFile("mmcscan", "data", workdir)
+
+        # locate all source positions in one batched query
+        e0 = LocateSourceElem(meshkey, cfg["srctype"], srcpos, outputdir)
+        for workdir, index in zip(workdirs, chunks):
+            pose = {
+                "srcpos": srcpos[index].tolist(),
+                "srcdir": srcdir[index].tolist(),
+                "index": index.tolist(),
+                "output": "mmcscan",
+            }
+            if e0 is not None:
+                pose["e0"] = [e0[i] for i in index]
+            jd.save(pose, os.path.join(workdir, "mmcpose.json"))
+
+        def worker(slot):
+            oc = GetBackendEngine(job.backend, slot)
+            SetBackendWorkFolder(oc, workdirs[slot])
+            try:
+                job.feval(
+                    "blendermmc",
+                    paramfile,
+                    meshfile,
+                    os.path.join(workdirs[slot], "mmcpose.json"),
+                    nargout=0,
+                    slot=slot,
+                )
+            finally:
+                RestoreBackendWorkFolder(oc, job.backend, slot, outputdir)
+
+        job.parallel(worker, len(workdirs))
+
+    def apply(job):
+        LoadMMCScanResult(workdirs, srcpos, srcdir, frames, colormode, colorbits)
+        elapsed = job.elapsed()
+        ShowMessageBox(
+            "Scanned %d source positions with %d workers in %.1f s (%.1f positions/min)"
+            % (npos, len(workdirs), elapsed, npos * 60.0 / max(elapsed, 1e-6)),
+            "BlenderPhotonics",
+        )
+
+    SubmitBackendJob("MMCScan", run, apply, background, g_mmcscanstages)
+
+
+def GetMMCOutputFiles(outputdir):
+    # a simulation entry holds the mesh, its display surface, the settings and the fluence
+    files = GetMeshOutputFiles(outputdir) + [os.path.join(outputdir, "mmcinfo.json")]
+    for fmt in ("jmsh", "bmsh"):
+        files.append(GetExchangeFile("mmcoutput", "data", fmt, outputdir))
+    files.append(os.path.join(outputdir, "mmcflux.bin"))
+    files.append(os.path.join(outputdir, "mmcfluxvar.bin"))
+    return [f for f in files if os.path.exists(f)]
+
+
+def FluxToLog(flux):
+    # same as mmclogflux() in blendermmc.m, zero fluence takes the smallest nonzero value
+    with np.errstate(divide="ignore"):
+        logflux = np.log10(np.abs(flux))
+    finite = np.isfinite(logflux)
+    if finite.any():
+        logflux[~finite] = logflux[finite].min()
+    return logflux.astype(np.float32)
+
+
+def MergeMMCSplit(workdirs, nphotons, isnormalized, outputdir):
+    """Merge independent sub-runs into the fluence of the whole photon budget
+
+    A normalized sub-run estimates the full-run fluence directly, an
+    unnormalized one is scaled by N/n_k first. The merged fluence is the mean
+    of these estimates weighted by n_k/N, and the variance of the merged value
+    is estimated at each node and time gate from the spread between the
+    sub-runs.
+    """
+    ngates = int(LoadExchangeFile("mmcoutput", "data", workdirs[0]).get("ngates", 1))
+    weight = np.asarray(nphotons, dtype=np.float64) / np.sum(nphotons)
+    runs = np.stack(
+        [
+            np.fromfile(os.path.join(workdir, "mmcflux.bin"), dtype=np.float32)
+            for workdir in workdirs
+        ]
+    ).astype(np.float64)
+    if not isnormalized:
+        runs /= weight[:, None]
+    flux = weight @ runs
+    sumw2 = np.sum(weight**2)
+    variance = sumw2 * (weight @ (runs - flux) ** 2) / (1.0 - sumw2)
+
+    flux.astype(np.float32).tofile(os.path.join(outputdir, "mmcflux.bin"))
+    variance.astype(np.float32).tofile(os.path.join(outputdir, "mmcfluxvar.bin"))
+    nnode = len(flux) // ngates
+    nonzero = flux[flux != 0]
+    logall = np.log10(np.abs(nonzero)) if len(nonzero) > 0 else np.zeros(1)
+    SaveExchangeFile(
+        {
+            "logflux": FluxToLog(flux[:nnode]),
+            "fluxvar": variance[:nnode].astype(np.float32),
+            "ngates": ngates,
+            "logrange": [float(logall.min()), float(logall.max())],
+        },
+        "mmcoutput",
+        "data",
+        outputdir,
+    )
+    return flux, variance
+
+
+def SubmitMMCSplit(
+    parameters, cfg, meshfile, nsplit, colormode, colorbits, background, restore, store
+):
+    """Run nphoton as nsplit sub-runs with distinct seeds in parallel sessions and merge them
+
+    restore(meshkey) loads a stored result and returns True if there is one,
+    store(meshkey) keeps the merged result.
+    """
+    outputdir = GetBPWorkFolder()
+    total = int(round(cfg["nphoton"]))
+    nsplit = min(nsplit, total)
+    nphotons = [total // nsplit + (k < total % nsplit) for k in range(nsplit)]
+    seed = int(cfg.get("seed", g_seed))
+    nthread = max((os.cpu_count() or 1) // nsplit, 1)
+
+    workdirs = [
+        os.path.join(outputdir, "mmcsplit", "worker%d" % k) for k in range(nsplit)
+    ]
+    runtime = [0.0] * nsplit
+
+    def run(job):
+        meshkey = GetMeshKey(meshfile)
+        RemoveMMCOutput(outputdir)
+        if restore(meshkey):
+            return True
+        for workdir in workdirs:
+            os.makedirs(workdir, exist_ok=True)
+            RemoveExchangeFile("mmcoutput", "data", workdir)
+
+        subcfg = dict(cfg)
+        e0 = LocateSourceElem(meshkey, cfg["srctype"], [cfg["srcpos"]], outputdir)
+        if e0 is not None:
+            subcfg["e0"] = e0[0]
+        if cfg["gpuid"] == "-1":
+            # share the cores between the sessions
+            subcfg["nthread"] = nthread
+        for k in range(nsplit):
+            SaveMMCInfo(
+                os.path.join(workdirs[k], "mmcinfo.json"),
+                parameters,
+                {**subcfg, "nphoton": nphotons[k], "seed": seed + k},
+            )
+
+        def worker(slot):
+            oc = GetBackendEngine(job.backend, slot)
+            SetBackendWorkFolder(oc, workdirs[slot])
+            t0 = time.perf_counter()
+            try:
+                job.feval(
+                    "blendermmc",
+                    os.path.join(workdirs[slot], "mmcinfo.json"),
+                    meshfile,
+                    nargout=0,
+                    slot=slot,
+                )
+            finally:
+                RestoreBackendWorkFolder(oc, job.backend, slot, outputdir)
+            runtime[slot] = time.perf_counter() - t0
+
+        job.parallel(worker, nsplit)
+        MergeMMCSplit(workdirs, nphotons, cfg["isnormalized"], outputdir)
+        store(meshkey)
+
+    def apply(job):
+        LoadMMCResult(colormode, colorbits)
+        if job.result:
+            # served from the cache
+            return
+        for k in range(nsplit):
+            print(
+                "BlenderPhotonics: MMC worker %d: %d photons in %.2f s (%.0f photons/s)"
+                % (k, nphotons[k], runtime[k], nphotons[k] / max(runtime[k], 1e-6))
+            )
+        elapsed = job.elapsed()
+        ShowMessageBox(
+            "Merged %d sub-runs in %.1f s: %.0f photons/s in total, %.0f photons/s per worker"
+            % (
+                nsplit,
+                elapsed,
+                total / max(elapsed, 1e-6),
+                np.mean([n / max(t, 1e-6) for n, t in zip(nphotons, runtime)]),
+            ),
+            "BlenderPhotonics",
+        )
+
+    SubmitBackendJob("RunMMC", run, apply, background, g_mmcstages)
+
+
+def ListMMCResults(self, context):
+    # EnumProperty items must stay referenced from Python, keep them in g_mmcresults
+    mmccache = GetResultCache("mmc")
+    g_mmcresults.clear()
+    for key, entry in mmccache.entries():
+        info = entry["info"]
+        label = "%s: %s, %g photons" % (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["ctime"])),
+            info.get("srctype", "?"),
+            info.get("nphoton", 0),
+        )
+        g_mmcresults.append((key, label, "source at " + str(info.get("srcpos", "?"))))
+    if len(g_mmcresults) == 0:
+        g_mmcresults.append(("none", "No stored simulation", "No stored simulation"))
+    return g_mmcresults
+
+
+class loadmmcresult(bpy.types.Operator):
+    bl_label = "Load previous simulation"
+    bl_description = "Reload a stored MMC simulation result without running the backend"
+    bl_idname = "blenderphotonics.loadmmcresult"
+
+    result: bpy.props.EnumProperty(name="Stored simulation", items=ListMMCResults)
+    colormode: bpy.props.StringProperty(default=g_colormode)
+    colorbits: bpy.props.IntProperty(default=g_colorbits)
+
+    def execute(self, context):
+        if self.result == "none":
+            return {"CANCELLED"}
+        # a separate folder, the mesh and settings of the work folder are kept for the next run
+        outputdir = os.path.join(GetBPWorkFolder(), g_restorefolder)
+        CloseFluxFrames()
+        shutil.rmtree(outputdir, ignore_errors=True)
+        os.makedirs(outputdir)
+        if GetResultCache("mmc").restore(self.result, outputdir) is None:
+            ShowMessageBox(
+                "The stored simulation is no longer available", "BlenderPhotonics"
+            )
+            return {"CANCELLED"}
+        LoadMMCResult(self.colormode, self.colorbits, outputdir)
+        return {"FINISHED"}
 
 
 class runmmc(bpy.types.Operator):
@@ -86,6 +581,72 @@ class runmmc(bpy.types.Operator):
     debuglevel: bpy.props.StringProperty(
         default=g_debuglevel, name="Debug flag [MCBWDIOXATRPE]"
     )
+    colormode: bpy.props.EnumProperty(
+        default=g_colormode,
+        name="Display result as",
+        items=[
+            (
+                "color",
+                "color: per-vertex color attribute",
+                "Store log10 fluence as a float attribute and show it as vertex colors",
+            ),
+            (
+                "attribute",
+                "attribute: float attribute and material",
+                "Store log10 fluence as a float attribute rendered by an emission material",
+            ),
+            (
+                "weight",
+                "weight: vertex group weight paint",
+                "Store log10 fluence as vertex group weights (legacy, slower)",
+            ),
+        ],
+    )
+    colorbits: bpy.props.IntProperty(
+        default=g_colorbits,
+        min=0,
+        max=24,
+        name="Color levels in bits (0: no quantization)",
+    )
+    background: bpy.props.BoolProperty(
+        default=g_background, name="Run in background (keep Blender responsive)"
+    )
+    scanmode: bpy.props.EnumProperty(
+        default=g_scanmode,
+        name="Source scan",
+        items=[
+            (
+                "single",
+                "single: current source pose",
+                "Simulate the current source pose only",
+            ),
+            (
+                "keyframes",
+                "keyframes: source animation",
+                "Simulate the source pose at each keyframe of the source object",
+            ),
+            (
+                "curve",
+                "curve: along a path",
+                "Move the source along a curve object, keeping its current rotation",
+            ),
+        ],
+    )
+    scanpath: bpy.props.StringProperty(
+        default=g_scanpath, name="Scan path curve object"
+    )
+    scansteps: bpy.props.IntProperty(
+        default=g_scansteps, min=1, name="Positions along the scan path"
+    )
+    scanworkers: bpy.props.IntProperty(
+        default=g_scanworkers, min=1, max=64, name="Parallel backend sessions for scans"
+    )
+    nsplit: bpy.props.IntProperty(
+        default=g_nsplit,
+        min=0,
+        max=256,
+        name="Split photons over K sessions (0: one per CPU core)",
+    )
 
     def preparemmc(self):
         ## save optical parameters and source source information
@@ -127,93 +688,101 @@ class runmmc(bpy.types.Operator):
         if not os.path.isdir(outputdir):
             os.makedirs(outputdir)
 
-        # Save MMC information
-        jd.save(
-            {"prop": parameters, "cfg": cfg},
-            os.path.join(outputdir, "mmcinfo.json"),
-        )
+        # MMC information and outputs are written and removed by the job, in queue order
+        CloseFluxFrames()
+        paramfile = os.path.join(outputdir, "mmcinfo.json")
 
         # run MMC
-        try:
-            if bpy.context.scene.blender_photonics.backend == "octave":
-                import oct2py as op
-
-                oc = op.Oct2Py()
-            else:
-                import matlab.engine as op
-
-                oc = op.start_matlab()
-        except ImportError:
-            raise ImportError(
-                "To run this feature, you must install the oct2py or matlab.engine Python modulem first, based on your choice of the backend"
-            )
-
-        oc.addpath(
-            oc.genpath(
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
+        meshfile = os.path.join(outputdir, "meshdata.mat")
+        colormode, colorbits = self.colormode, self.colorbits
+        mmccache = GetResultCache("mmc", bpy.context.scene.blender_photonics.cachesize)
+
+        # scans run the same mesh and settings for many source poses in parallel sessions
+        if self.scanmode != "single":
+            try:
+                srcpos, srcdir, frames = GetSourcePoses(
+                    obj, self.scanmode, self.scanpath, self.scansteps
+                )
+            except ValueError as e:
+                ShowMessageBox(str(e), "BlenderPhotonics", "ERROR")
+                return
+            SubmitMMCScan(
+                paramfile,
+                meshfile,
+                parameters,
+                cfg,
+                srcpos,
+                srcdir,
+                frames,
+                self.scanworkers,
+                colormode,
+                colorbits,
+                self.background,
             )
-        )
-
-        oc.feval(
-            "blendermmc",
-            os.path.join(outputdir, "mmcinfo.json"),
-            os.path.join(outputdir, "meshdata.mat"),
-            nargout=0,
-        )
-
-        # remove all object and import all region as one object
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete()
-
-        outputmesh = jd.load(os.path.join(outputdir, "volumemesh.jmsh"))
-        outputmesh = JMeshFallback(outputmesh)
-        if not isinstance(outputmesh["MeshTri3"], np.ndarray):
-            outputmesh["MeshTri3"] = np.asarray(outputmesh["MeshTri3"], dtype=np.uint32)
-        outputmesh["MeshTri3"] -= 1
-        AddMeshFromNodeFace(
-            outputmesh["MeshVertex3"],
-            outputmesh["MeshTri3"].tolist(),
-            "Iso2Mesh",
-        )
-
-        # add color to blender model
-        obj = bpy.data.objects["Iso2Mesh"]
-        mmcoutput = jd.load(os.path.join(outputdir, "mmcoutput.json"))
-        mmcoutput["logflux"] = np.asarray(mmcoutput["logflux"], dtype="float32")
-
-        def normalize(x, max, min):
-            x = (x - min) / (max - min)
-            return x
-
-        colorbit = 10
-        colorkind = 2**colorbit - 1
-        weight_data = normalize(
-            mmcoutput["logflux"],
-            np.max(mmcoutput["logflux"]),
-            np.min(mmcoutput["logflux"]),
-        )
-        weight_data_test = np.rint(weight_data * (colorkind))
-
-        new_vertex_group = obj.vertex_groups.new(name="weight")
-        for i in range(colorkind + 1):
-            ind = np.array(np.where(weight_data_test == i)).tolist()
-            new_vertex_group.add(ind[0], i / colorkind, "ADD")
+            return
+
+        # a split run is statistically equivalent but not identical to a single run
+        nsplit = self.nsplit if self.nsplit > 0 else (os.cpu_count() or 1)
+        # a single sub-run has no spread to estimate the variance from, run it as usual
+        nsplit = min(nsplit, int(round(cfg["nphoton"])))
+        keyitems = [parameters, cfg]
+        if nsplit > 1:
+            keyitems.append({"nsplit": nsplit})
+        cacheinfo = {
+            "nphoton": cfg["nphoton"],
+            "srctype": cfg["srctype"],
+            "srcpos": cfg["srcpos"],
+            "nregion": len(parameters),
+            "nsplit": nsplit,
+        }
 
-        bpy.context.view_layer.objects.active = obj
-        bpy.ops.object.mode_set(mode="WEIGHT_PAINT")
+        def restore(meshkey):
+            # serve repeated simulations of the same mesh, properties and settings from the cache
+            return mmccache.restore(HashData(meshkey, *keyitems), outputdir) is not None
 
-        bpy.context.space_data.shading.type = "SOLID"
+        def store(meshkey):
+            mmccache.store(
+                HashData(meshkey, *keyitems), GetMMCOutputFiles(outputdir), cacheinfo
+            )
 
-        print(
-            "Finshed!, Please change intereaction mode to Weight Paint to see result!"
-        )
-        print(
-            """If you prefer a perspective effect，please go to edit mode and make sure shading 'Vertex Group Weight' is on."""
+        if nsplit > 1:
+            SubmitMMCSplit(
+                parameters,
+                cfg,
+                meshfile,
+                nsplit,
+                colormode,
+                colorbits,
+                self.background,
+                restore,
+                store,
+            )
+            return
+
+        def run(job):
+            meshkey = GetMeshKey(meshfile)
+            RemoveMMCOutput(outputdir)
+            SaveMMCInfo(paramfile, parameters, cfg)
+            if restore(meshkey):
+                return
+            e0 = LocateSourceElem(meshkey, cfg["srctype"], [cfg["srcpos"]], outputdir)
+            if e0 is not None:
+                SaveMMCInfo(paramfile, parameters, {**cfg, "e0": e0[0]})
+            job.feval("blendermmc", paramfile, meshfile, nargout=0)
+            store(meshkey)
+
+        SubmitBackendJob(
+            "RunMMC",
+            run,
+            lambda job: LoadMMCResult(colormode, colorbits),
+            self.background,
+            g_mmcstages,
         )
 
     def execute(self, context):
         print("Begin to run MMC source transport simulation ...")
-        self.preparemmc()
+        with ProfileOperator(self).run():
+            self.preparemmc()
         return {"FINISHED"}
 
     def invoke(self, context, event):
@@ -229,5 +798,5 @@ class setmmcprop(bpy.types.Panel):
     bl_region_type = "UI"
 
     def draw(self, context):
-        global g_nphoton, g_tend, g_tstep, g_method, g_outputtype, g_isreflect, g_isnormalized, g_basisorder, g_debuglevel, g_gpuid
+        global g_nphoton, g_tend, g_tstep, g_method, g_outputtype, g_isreflect, g_isnormalized, g_basisorder, g_debuglevel, g_gpuid, g_colormode, g_colorbits, g_scanmode, g_scanworkers, g_nsplit
         self.layout.operator("object.dialog_operator")
@@ -1,4 +1,4 @@
-function [node, elem] = blender2mesh(filename)
+function [node, elem] = blender2mesh(filename, paramfile)
 %
 % nodedata=surf2jmesh(filename)
 %
@@ -8,12 +8,17 @@ function [node, elem] = blender2mesh(filename)
 %         Yuxuan Zhang (zhang.yuxuan1 at northeastern.edu)
 %
 % input:
-%    filename: path to the surface mesh file exported from Blender, data in JMesh format
+%    filename: path to the surface mesh file exported from Blender, data in text (.jmsh)
+%              or binary (.bmsh) JMesh format
+%    paramfile: (optional) a JSON file whose param field replaces the meshing
+%              parameters stored in filename, used to mesh the same
+%              geometry again with other settings
 %
 % output:
-%    two JMesh files are saved under the temporary folder bpmwpath('')
-%          volumemesh.jmsh: contains the tetrahedral mesh
-%          regionmesh.jmsh: contains the surface of each individual regions/labels
+%    JMesh files are saved under the temporary folder bpmwpath(''), see blendersavemesh
+%          tetmesh.jmsh/.bmsh: contains the nodes and the labeled tetrahedra
+%          volumemesh.jmsh/.bmsh: contains the tetrahedral mesh
+%          regionmesh.jmsh/.bmsh: contains the surface of each individual regions/labels
 %
 % license: GPLv3 or later, see LICENSE.txt for details
 %
@@ -35,7 +40,11 @@ function [node, elem] = blender2mesh(filename)
 % -- this function is part of BlenderPhotonics (http://mcx.space/bp)
 %
 
-blender = loadjson(filename, 'FastArrayParser', 0);
+blender = bploadjd(filename);
+if (nargin > 1)
+    opt = bploadjd(paramfile);
+    blender.param = opt.param;
+end
 
 if (blender.param.mergetol > 0)
     [blender.MeshVertex3, blender.MeshPoly] = removedupnodes(blender.MeshVertex3, blender.MeshPoly, blender.param.mergetol);
@@ -50,4 +59,4 @@ end
 save('-v7', bpmwpath('meshdata.mat'), 'node', 'elem');
 disp(['begin to save region mesh']);
 
-blendersavemesh(node, elem);
+blendersavemesh(node, elem, blender.param);
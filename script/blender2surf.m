@@ -11,6 +11,8 @@ function blender = blender2surf(filename)
 %           param.action: a string can be 'repair','smooth','reorient','simplify','remesh',
 %                 'boolean-and','boolean-or','boolean-xor','boolean-diff','boolean-first',
 %                 'boolean-second','boolean-decouple'
+%           param.exchange: 'jmsh' (text, default) or 'bmsh' (binary) output format
+%           param.compression: '' (default), 'zlib' or 'lz4' to compress the output arrays
 %           param.level: a single number to be used for the respective action;
 %                 for 'smooth': this indicates number of iterations
 %                 for 'simplify': this indicates percentage of edges to be kept
@@ -21,7 +23,7 @@ function blender = blender2surf(filename)
 %
 % output:
 %    the processed surface mesh is saved as a JMesh file under the temporary folder bpmwpath('')
-%          surfacemesh.jmsh: contains the processed surface mesh
+%          surfacemesh.jmsh/.bmsh: contains the processed surface mesh
 %
 % license: GPLv3 or later, see LICENSE.txt for details
 %
@@ -43,7 +45,7 @@ function blender = blender2surf(filename)
 % -- this function is part of BlenderPhotonics (http://mcx.space/bp)
 %
 
-blender = loadjson(filename, 'FastArrayParser', 0);
+blender = bploadjd(filename);
 
 objs = blender.MeshGroup;
 if (isstruct(objs) && length(objs) == 1)
@@ -106,4 +108,4 @@ end
 blender.MeshGroup = objs;
 
 disp(['begin to save surface mesh']);
-savejson('', blender, 'FileName', bpmwpath('surfacemesh.jmsh'), 'ArrayIndent', 0);
+bpsavejd(blender, 'surfacemesh', 'mesh', blender.param);
@@ -1,6 +1,8 @@
-function flux = blendermmc(paramfile, meshfile)
+function flux = blendermmc(paramfile, meshfile, posefile)
 %
 % blendermmc(paramfile, meshfile)
+%   or
+% blendermmc(paramfile, meshfile, posefile)
 %
 % Launching an MMCLAB simulation and save results to a JMesh file
 %
@@ -10,10 +12,22 @@ function flux = blendermmc(paramfile, meshfile)
 % input:
 %    paramfile: the JSON file contains simulation parameters configured in Blender
 %    meshfile:  the tetrahedral mesh file generated by BlenderPhotonics in previous step
+%    posefile:  (optional) a JSON file listing source poses to scan with the same
+%               mesh, containing "srcpos" (N x 3), "srcdir" (N x 4 quaternions),
+%               "index" (N positions in the full scan), "output" (file name) and
+%               optionally "e0" (N initial elements)
+%    the initial element of pencil/isotropic/cone sources is searched by tsearchn
+%    unless given by param.cfg.e0 or pose.e0 (1-based, -1 if outside the mesh)
 %
 % output:
-%    a single JSON file mmcoutput.json contains a 1D/2D array subfield of "logflux"
-%        is saved in the BP's temporary folder
+%    a single JSON file mmcoutput.json (or binary mmcoutput.bjd if param.exchange
+%        is 'bmsh') contains a 1D/2D array subfield of "logflux"
+%        is saved in the BP's temporary folder, together with the unscaled
+%        fluence of all time gates as a float32 [Ngates x Nn] array (node
+%        index changing fastest) in mmcflux.bin; "ngates" and "logrange",
+%        the range of the log10 fluence over all gates, are also saved
+%    if posefile is given, "logflux" of the output file is an N x Nn array,
+%        one row per source pose, together with the "index" field
 %
 % license: GPLv3 or later, see LICENSE.txt for details
 %
@@ -41,24 +55,17 @@ meshdata = load(meshfile);
 %% Pre-processing data
 propbk = [0, 0, 1, 1];
 prop = [propbk; param.prop];
-Q = num2cell(param.cfg.srcdir);
-[w, x, y, z] = Q{:};
-R = [1 - 2 * y^2 - 2 * z^2, 2 * x * y - 2 * z * w, 2 * x * z + 2 * y * w
-     2 * x * y + 2 * z * w, 1 - 2 * x^2 - 2 * z^2, 2 * y * z - 2 * x * w
-     2 * x * z - 2 * y * w, 2 * y * z + 2 * x * w, 1 - 2 * x^2 - 2 * y^2];
-dir = R * [0; 0; -1];
 
 %% cfg build
 cfg.nphoton = double(param.cfg.nphoton);
 cfg.srctype = param.cfg.srctype;
-cfg.srcpos = param.cfg.srcpos;
-cfg.srcdir = dir';
 cfg.srcparam1 = param.cfg.srcparam1;
 cfg.srcparam2 = param.cfg.srcparam2;
 cfg.prop = prop;
 cfg.node = meshdata.node;
 cfg.elem = meshdata.elem(:, 1:4);
 cfg.elemprop = meshdata.elem(:, 5);
+
 cfg.tstart = 0;
 cfg.tend = param.cfg.tend;
 cfg.tstep = param.cfg.tstep;
@@ -69,9 +76,76 @@ cfg.unitinmm = param.cfg.unitinmm;
 cfg.outputtype = param.cfg.outputtype;
 cfg.debuglevel = param.cfg.debuglevel;
 cfg.method = param.cfg.method;
+if (isfield(param.cfg, 'seed'))
+    cfg.seed = param.cfg.seed;
+end
+if (isfield(param.cfg, 'nthread'))
+    cfg.nthread = param.cfg.nthread;
+end
+
+nn = size(meshdata.node, 1);
+
+if (nargin < 3)
+    flux = mmcrunpose(cfg, param.cfg.srcpos, param.cfg.srcdir, true, jsonopt('e0', [], param.cfg));
+    fluxlog = mmclogflux(flux, nn);
+    data = flux.data(1:nn, :);
+    fid = fopen(bpmwpath('mmcflux.bin'), 'wb');
+    fwrite(fid, data, 'float32');
+    fclose(fid);
+    logall = log10(abs(data(data ~= 0)));
+    if (isempty(logall))
+        logall = fluxlog;
+    end
+    bpsavejd(struct('logflux', fluxlog(:)', 'ngates', size(data, 2), ...
+                    'logrange', [min(logall(:)) max(logall(:))]), 'mmcoutput', 'data', param);
+    return
+end
+
+%% scan all source poses with the mesh loaded once
+
+pose = loadjson(posefile);
+srcpos = reshape(pose.srcpos, [], 3);
+srcdir = reshape(pose.srcdir, [], 4);
+npos = size(srcpos, 1);
+logflux = zeros(npos, nn, 'single');
+e0 = jsonopt('e0', [], pose);
+
+for i = 1:npos
+    if (isempty(e0))
+        flux = mmcrunpose(cfg, srcpos(i, :), srcdir(i, :), false, []);
+    else
+        flux = mmcrunpose(cfg, srcpos(i, :), srcdir(i, :), false, e0(i));
+    end
+    logflux(i, :) = mmclogflux(flux, nn);
+    fprintf('scanned source position %d of %d\n', i, npos);
+end
+
+bpsavejd(struct('logflux', logflux, 'index', pose.index(:)'), pose.output, 'data', param);
+
+%% -----------------------------------------------------------------------------
+
+function flux = mmcrunpose(cfg, srcpos, srcdir, savecfg, e0)
+% run a simulation with the source placed at srcpos and rotated by quaternion srcdir,
+% e0 is the precomputed initial element, or [] to search it here
+
+Q = num2cell(srcdir);
+[w, x, y, z] = Q{:};
+R = [1 - 2 * y^2 - 2 * z^2, 2 * x * y - 2 * z * w, 2 * x * z + 2 * y * w
+     2 * x * y + 2 * z * w, 1 - 2 * x^2 - 2 * z^2, 2 * y * z - 2 * x * w
+     2 * x * z - 2 * y * w, 2 * y * z + 2 * x * w, 1 - 2 * x^2 - 2 * y^2];
+dir = R * [0; 0; -1];
+
+cfg.srcpos = srcpos(:)';
+cfg.srcdir = dir';
 
 if (strcmp(cfg.srctype, 'pencil') || strcmp(cfg.srctype, 'isotropic') || strcmp(cfg.srctype, 'cone'))
-    cfg.e0 = tsearchn(cfg.node, cfg.elem, cfg.srcpos);
+    if (isempty(e0))
+        cfg.e0 = tsearchn(cfg.node, cfg.elem, cfg.srcpos);
+    elseif (e0 > 0)
+        cfg.e0 = double(e0);
+    else
+        cfg.e0 = nan;
+    end
     if (strcmp(cfg.srctype, 'pencil') && isnan(cfg.e0))
         cfg.e0 = '-';
     end
@@ -82,17 +156,20 @@ else
                                      mmcsrcdomain(srcdef, [min(cfg.node); max(cfg.node)]));
 end
 
-save('-v7', bpmwpath('mmccfg.mat'), 'cfg');
+if (savecfg)
+    save('-v7', bpmwpath('mmccfg.mat'), 'cfg');
+end
 
 %% run the simulation
 
 flux = mmclab(cfg);
 
-%% Post-processing simulation result
+%% -----------------------------------------------------------------------------
 
-fluxlog1 = log10(abs(flux.data(1:size(cfg.node, 1))));
+function fluxlog = mmclogflux(flux, nn)
+% log10 fluence at the first nn nodes, zero-fluence nodes use the smallest nonzero value
+
+fluxlog1 = log10(abs(flux.data(1:nn)));
 fluxmin = unique(fluxlog1);
 fluxlog = fluxlog1;
 fluxlog(isinf(fluxlog1)) = fluxmin(2);
-
-savejson('', struct('logflux', fluxlog(:)'), 'FileName', bpmwpath('mmcoutput.json'), 'ArrayIndent', 0);
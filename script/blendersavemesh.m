@@ -1,6 +1,6 @@
-function meshdata = blendersavemesh(node, elem)
+function meshdata = blendersavemesh(node, elem, param)
 %
-% blendersavemesh(node,elem)
+% blendersavemesh(node,elem,param)
 %
 % Saving a tetrahedral mesh to JMesh file in BP's temporary folder
 %
@@ -9,11 +9,21 @@ function meshdata = blendersavemesh(node, elem)
 % input:
 %    node: the node coordinate list of a tetrahedral mesh (nn x 3)
 %    elem: the tetrahedral element list of the mesh (ne x 4)
+%    param: (optional) a struct defining the output format, see bpsavejd
+%           param.exchange: 'jmsh' (text, default) or 'bmsh' (binary)
+%           param.compression: '' (default), 'zlib' or 'lz4'
+%           param.savesurf: 1 (default) to also save the two surface files
+%                  below; BlenderPhotonics sets it to 0 and extracts the
+%                  surfaces from tetmesh in Python
+%           param.faceset: faces saved in volumemesh: 'exterior' (exterior
+%                  surface), 'interfaces' (exterior surface and the
+%                  interfaces between labels) or 'all' (default)
 %
 % output:
-%    two JMesh files are saved under the temporary folder bpmwpath('')
-%          volumemesh.jmsh: contains the tetrahedral mesh
-%          regionmesh.jmsh: contains the surface of each individual regions/labels
+%    JMesh files are saved under the temporary folder bpmwpath('')
+%          tetmesh.jmsh/.bmsh: contains the nodes and the labeled tetrahedra (MeshElem)
+%          volumemesh.jmsh/.bmsh: contains the faces of the tetrahedral mesh selected by param.faceset
+%          regionmesh.jmsh/.bmsh: contains the surface of each individual regions/labels
 %
 % license: GPLv3 or later, see LICENSE.txt for details
 %
@@ -35,6 +45,10 @@ function meshdata = blendersavemesh(node, elem)
 % -- this function is part of BlenderPhotonics (http://mcx.space/bp)
 %
 
+if (nargin < 3)
+    param = struct;
+end
+
 if (size(elem, 2) < 5)
     elem(:, 5) = 1;
 end
@@ -46,11 +60,22 @@ else
     meshdata.MeshNode = node;
 end
 
+tetmesh = meshdata;
+tetmesh.MeshElem = uint32(elem(:, 1:5));
+bpsavejd(tetmesh, 'tetmesh', 'mesh', param);
+
+if (~jsonopt('savesurf', 1, param))
+    disp(['saving complete.']);
+    return
+end
+
 outputmesh = meshdata;
 
 maxtag = max(elem(:, 5));
+regionfaces = cell(1, maxtag);
 for n = 1:maxtag
-    fc1 = volface(elem(elem(:, 5) == n, 1:4));
+    fc1 = uint32(volface(elem(elem(:, 5) == n, 1:4)));
+    regionfaces{n} = fc1;
     outputmesh.(encodevarname(sprintf('MeshTri3(%d)', n))) = fc1;
 end
 
@@ -59,9 +84,19 @@ if (maxtag == 1)
     outputmesh = rmfield(outputmesh, encodevarname('MeshTri3(1)'));
 end
 disp(['begin to save whole volumic mesh.']);
-savejson('', outputmesh, 'FileName', bpmwpath('regionmesh.jmsh'), 'ArrayIndent', 0);
-faces = meshface(elem(:, 1:4));
+bpsavejd(outputmesh, 'regionmesh', 'mesh', param);
+switch (jsonopt('faceset', 'all', param))
+    case 'exterior'
+        faces = uint32(volface(elem(:, 1:4)));
+    case 'interfaces'
+        % a face shared by two regions is on the surface of both, keep it once
+        faces = vertcat(regionfaces{:});
+        [~, idx] = unique(sort(faces, 2), 'rows', 'stable');
+        faces = faces(idx, :);
+    otherwise
+        faces = uint32(meshface(elem(:, 1:4)));
+end
 
 meshdata.MeshTri3 = faces;
-savejson('', meshdata, 'FileName', bpmwpath('volumemesh.jmsh'), 'ArrayIndent', 0);
+bpsavejd(meshdata, 'volumemesh', 'mesh', param);
 disp(['saving complete.']);
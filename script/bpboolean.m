@@ -0,0 +1,40 @@
+function [node, face] = bpboolean(node1, face1, op, node2, face2)
+%
+% [node,face]=bpboolean(node1,face1,op,node2,face2)
+%
+% Boolean operation of two closed surfaces, with the inputs and the result
+% passed in memory instead of through BP's temporary files
+%
+% author: Qianqian Fang (q.fang at neu.edu)
+%
+% input:
+%    node1,face1: the nodes (nn x 3) and 1-based triangles (nf x 3) of the first surface
+%    op: a surfboolean operation, such as 'or', 'and' or 'diff'
+%    node2,face2: the nodes and 1-based triangles of the second surface
+%
+% output:
+%    node,face: the nodes and 1-based triangles of the resulting surface
+%
+% license: GPLv3 or later, see LICENSE.txt for details
+%
+% reference:
+%
+% @article{BlenderPhotonics2022,
+%   author = {Yuxuan Zhang and Qianqian Fang},
+%   title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+%   volume = {27},
+%   journal = {Journal of Biomedical Optics},
+%   number = {8},
+%   publisher = {SPIE},
+%   pages = {1 -- 23},
+%   year = {2022},
+%   doi = {10.1117/1.JBO.27.8.083014},
+%   URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+% }
+%
+% -- this function is part of BlenderPhotonics (http://mcx.space/bp)
+%
+
+[node, face] = surfboolean(double(node1), double(face1(:, 1:3)), op, double(node2), double(face2(:, 1:3)));
+face = face(:, 1:3);
+disp(['boolean ' op ' done']);
@@ -0,0 +1,44 @@
+function data = bploadjd(filename)
+%
+% data=bploadjd(filename)
+%
+% load an intermediate data file written by BlenderPhotonics in either the
+% text (.jmsh/.json/.jnii) or the binary (.bmsh/.bjd/.bnii) JData format
+%
+% author: Qianqian Fang (q.fang at neu.edu)
+%
+% input:
+%    filename: path to a text or binary JData file, the format is determined
+%              by the file suffix
+%
+% output:
+%    data: the decoded data structure
+%
+% license: GPLv3 or later, see LICENSE.txt for details
+%
+% reference:
+%
+% @article{BlenderPhotonics2022,
+%   author = {Yuxuan Zhang and Qianqian Fang},
+%   title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+%   volume = {27},
+%   journal = {Journal of Biomedical Optics},
+%   number = {8},
+%   publisher = {SPIE},
+%   pages = {1 -- 23},
+%   year = {2022},
+%   doi = {10.1117/1.JBO.27.8.083014},
+%   URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+% }
+%
+% -- this function is part of BlenderPhotonics (http://mcx.space/bp)
+%
+
+t0 = tic;
+if (~isempty(regexp(filename, '\.(bmsh|bjd|bnii)$', 'once', 'ignorecase')))
+    data = loadbj(filename);
+else
+    data = loadjson(filename, 'FastArrayParser', 0);
+end
+finfo = dir(filename);
+fprintf('loaded %s (%.2f MB) in %.3f s\n', filename, finfo.bytes / 1048576, toc(t0));
@@ -10,7 +10,9 @@ function tempname = bpmwpath(fname)
 %    fname: a temporary file used internally by BP
 %
 % output:
-%    tempname: the full path of the temporary file in the BP workfolder
+%    tempname: the full path of the temporary file in the BP workfolder; the
+%              folder can be overwritten by the BLENDERPHOTONICS_WORKDIR
+%              environment variable
 %
 % license: GPLv3 or later, see LICENSE.txt for details
 %
@@ -36,7 +38,11 @@ if (nargin < 1) || isempty(fname)
     fname = '';
 end
 
-tdir = mwpath('blenderphotonics');
+% BLENDERPHOTONICS_WORKDIR allows parallel sessions to work in separate folders
+tdir = getenv('BLENDERPHOTONICS_WORKDIR');
+if (isempty(tdir))
+    tdir = mwpath('blenderphotonics');
+end
 if (exist(tdir) == 0)
     mkdir(tdir);
 end
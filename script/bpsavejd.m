@@ -0,0 +1,67 @@
+function fname = bpsavejd(data, basename, kind, param)
+%
+% fname=bpsavejd(data, basename, kind, param)
+%
+% save an intermediate data file to BP's temporary folder in the exchange
+% format requested by Blender
+%
+% author: Qianqian Fang (q.fang at neu.edu)
+%
+% input:
+%    data: the data structure to be saved
+%    basename: file name without suffix, such as 'volumemesh'
+%    kind: 'mesh' (.jmsh/.bmsh), 'data' (.json/.bjd) or 'vol' (.jnii/.bnii)
+%    param: (optional) a struct with the below subfields
+%           param.exchange: 'jmsh' for text JSON (default), 'bmsh' for binary JData
+%           param.compression: '' (default), 'zlib' or 'lz4'
+%
+% output:
+%    fname: the full path of the saved file
+%
+% license: GPLv3 or later, see LICENSE.txt for details
+%
+% reference:
+%
+% @article{BlenderPhotonics2022,
+%   author = {Yuxuan Zhang and Qianqian Fang},
+%   title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+%   volume = {27},
+%   journal = {Journal of Biomedical Optics},
+%   number = {8},
+%   publisher = {SPIE},
+%   pages = {1 -- 23},
+%   year = {2022},
+%   doi = {10.1117/1.JBO.27.8.083014},
+%   URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+% }
+%
+% -- this function is part of BlenderPhotonics (http://mcx.space/bp)
+%
+
+if (nargin < 4)
+    param = struct;
+end
+
+exchange = jsonopt('exchange', 'jmsh', param);
+compression = jsonopt('compression', '', param);
+
+suffix = struct('mesh', {{'.jmsh', '.bmsh'}}, 'data', {{'.json', '.bjd'}}, 'vol', {{'.jnii', '.bnii'}});
+isbinary = strcmp(exchange, 'bmsh');
+
+% remove files written in the other format so that Blender does not load stale data
+for i = 1:2
+    if (exist(bpmwpath([basename suffix.(kind){i}]), 'file'))
+        delete(bpmwpath([basename suffix.(kind){i}]));
+    end
+end
+
+fname = bpmwpath([basename suffix.(kind){isbinary + 1}]);
+
+t0 = tic;
+if (isbinary)
+    savebj('', data, 'FileName', fname, 'Compression', compression);
+else
+    savejson('', data, 'FileName', fname, 'ArrayIndent', 0, 'Compression', compression);
+end
+finfo = dir(fname);
+fprintf('saved %s (%.2f MB) in %.3f s\n', fname, finfo.bytes / 1048576, toc(t0));
@@ -64,13 +64,19 @@ elseif (~isempty(regexp(niipath, '\.mat$', 'match', 'ignorecase')))
     end
 end
 
-opt = struct('radbound', jsonopt('radbound', 10, input), 'distbound', jsonopt('distbound', 1, input));
-maxvol = jsonopt('maxvol', 100, input);
+% sizes are given in input voxels, a downsampled voxel is factor times larger
+factor = jsonopt('factor', 1, input);
+opt = struct('radbound', jsonopt('radbound', 10, input) / factor, 'distbound', jsonopt('distbound', 1, input) / factor);
+maxvol = jsonopt('maxvol', 100, input) / factor^3;
 method = jsonopt('method', 'cgalmesh', input);
 isovalue = jsonopt('isovalue', 0.5, input);
 
 if (strcmp(method, 'auto'))
-    labelnum = length(unique(vol.NIFTIData));
+    % the number of distinct values may be counted by BlenderPhotonics already
+    labelnum = jsonopt('labelnum', [], input);
+    if (isempty(labelnum))
+        labelnum = length(unique(vol.NIFTIData));
+    end
     if (labelnum == 2 || labelnum > 64)
         method = 'cgalsurf';
     else
@@ -90,7 +96,11 @@ end
 
 %% post processing, scale mesh with the voxel size 0.1 mm
 node = node(:, 1:3);
+
+% map a cropped/downsampled volume back to the voxel coordinates of the input
+offset = jsonopt('offset', [0, 0, 0], input);
+node = (node - 0.5) * factor + 0.5 + repmat(offset(:)', size(node, 1), 1);
 elem(:, 1:4) = meshreorient(node(:, 1:3), elem(:, 1:4));
 save('-v7', bpmwpath('meshdata.mat'), 'node', 'elem', 'face');
 
-blendersavemesh(node, elem);
+blendersavemesh(node, elem, input);
@@ -0,0 +1,216 @@
+"""TetIndex - uniform-grid spatial index for locating points in a tetrahedral mesh
+
+* Authors: (c) 2021-2022 Qianqian Fang <q.fang at neu.edu>
+* License: GNU General Public License V3 or later (GPLv3)
+* Website: http://mcx.space/bp
+
+To cite this work, please use the below information
+
+@article{BlenderPhotonics2022,
+  author = {Yuxuan Zhang and Qianqian Fang},
+  title = {{BlenderPhotonics: an integrated open-source software environment for three-dimensional meshing and photon simulations in complex tissues}},
+  volume = {27},
+  journal = {Journal of Biomedical Optics},
+  number = {8},
+  publisher = {SPIE},
+  pages = {1 -- 23},
+  year = {2022},
+  doi = {10.1117/1.JBO.27.8.083014},
+  URL = {https://doi.org/10.1117/1.JBO.27.8.083014}
+}
+
+The bounding box of every element is rasterized into a uniform grid whose
+cell size is close to the average element size, and the element lists of
+all cells are stored in compressed sparse row form. A point query only tests
+the elements listed in the cell containing the point, using barycentric
+coordinates, after discarding the candidates whose bounding box does not
+contain the point. The index is saved as tetindex.npz next to meshdata.mat,
+kept in memory for the last few meshes and reused until the mesh changes;
+it replaces the tsearchn call in blendermmc.m when locating the initial
+element (cfg.e0) of a source.
+"""
+
+import os
+from .utils import GetBPWorkFolder, LazyModule
+from .meshface import LoadTetMeshData
+
+np = LazyModule("numpy")
+
+g_querychunk = 65536
+g_tolerance = 1e-9
+
+# loaded indices keyed by (outputdir, meshkey), the oldest are dropped beyond g_indexcachesize
+g_indexcache = {}
+g_indexcachesize = 4
+
+
+class TetIndex:
+    def __init__(self, node, elem, key=""):
+        self.key = key
+        self.node = np.asarray(node, dtype=np.float64)
+        self.elem = np.asarray(elem)[:, 0:4].astype(np.int64)
+        self.build()
+
+    def bounds(self):
+        # bounding box (Ne,3) of every element; stored per axis to prefilter queries
+        elemmin = self.node[self.elem[:, 0]]
+        elemmax = elemmin.copy()
+        for i in range(1, 4):
+            vert = self.node[self.elem[:, i]]
+            np.minimum(elemmin, vert, out=elemmin)
+            np.maximum(elemmax, vert, out=elemmax)
+        self.boxmin = np.ascontiguousarray(elemmin.T)
+        self.boxmax = np.ascontiguousarray(elemmax.T)
+        return elemmin, elemmax
+
+    def build(self):
+        ne = self.elem.shape[0]
+        elemmin, elemmax = self.bounds()
+        self.origin = elemmin.min(axis=0) if ne > 0 else np.zeros(3)
+        extent = (elemmax.max(axis=0) if ne > 0 else np.ones(3)) - self.origin
+
+        # cells about the size of an average element, so that each element spans few cells
+        cellsize = max(float(np.mean(elemmax - elemmin)) if ne > 0 else 1.0, 1e-12)
+        self.dims = np.maximum(np.ceil(extent / cellsize), 1).astype(np.int64)
+        while np.prod(self.dims) > max(8 * ne, 1):
+            cellsize *= 1.25
+            self.dims = np.maximum(np.ceil(extent / cellsize), 1).astype(np.int64)
+        self.cellsize = cellsize
+
+        lo = self.tocell(elemmin)
+        span = self.tocell(elemmax) - lo + 1
+        count = np.prod(span, axis=1)
+
+        # enumerate every (element, cell) pair without a Python loop
+        elemid = np.repeat(np.arange(ne), count)
+        local = np.arange(elemid.size) - np.repeat(np.cumsum(count) - count, count)
+        sx, sy = span[elemid, 0], span[elemid, 1]
+        ijk = lo[elemid] + np.stack(
+            (local % sx, (local // sx) % sy, local // (sx * sy)), axis=1
+        )
+        cell = self.linear(ijk)
+
+        order = np.argsort(cell, kind="stable")
+        self.cellelem = elemid[order]
+        self.cellstart = np.concatenate(
+            ([0], np.cumsum(np.bincount(cell, minlength=int(np.prod(self.dims)))))
+        )
+
+    def tocell(self, points):
+        ijk = np.floor((points - self.origin) / self.cellsize).astype(np.int64)
+        return np.clip(ijk, 0, self.dims - 1)
+
+    def linear(self, ijk):
+        return (ijk[:, 2] * self.dims[1] + ijk[:, 1]) * self.dims[0] + ijk[:, 0]
+
+    def locate(self, points, tol=g_tolerance):
+        """Return the 0-based index of the element enclosing each point, -1 if outside"""
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        result = np.full(points.shape[0], -1, dtype=np.int64)
+        for start in range(0, points.shape[0], g_querychunk):
+            chunk = points[start : start + g_querychunk]
+            result[start : start + len(chunk)] = self.locatechunk(chunk, tol)
+        return result
+
+    def locatechunk(self, points, tol):
+        result = np.full(points.shape[0], -1, dtype=np.int64)
+        inside = np.all(
+            (points >= self.origin)
+            & (points <= self.origin + self.dims * self.cellsize),
+            axis=1,
+        )
+        pointid = np.nonzero(inside)[0]
+        cell = self.linear(self.tocell(points[pointid]))
+        count = self.cellstart[cell + 1] - self.cellstart[cell]
+
+        # test all candidate elements of all points at once
+        pairpoint = np.repeat(pointid, count)
+        local = np.arange(pairpoint.size) - np.repeat(np.cumsum(count) - count, count)
+        pairelem = self.cellelem[np.repeat(self.cellstart[cell], count) + local]
+
+        # most candidates of a cell do not contain the point, skip their solve;
+        # one axis at a time, each test only gathers the pairs left by the previous
+        margin = tol * self.cellsize
+        for axis in range(3):
+            coord = points[pairpoint, axis]
+            near = (coord >= self.boxmin[axis][pairelem] - margin) & (
+                coord <= self.boxmax[axis][pairelem] + margin
+            )
+            pairpoint, pairelem = pairpoint[near], pairelem[near]
+        if pairelem.size == 0:
+            return result
+
+        tet = self.node[self.elem[pairelem]]
+        mat = np.transpose(tet[:, 1:4, :] - tet[:, 0:1, :], (0, 2, 1))
+        rhs = points[pairpoint] - tet[:, 0, :]
+        valid = np.abs(np.linalg.det(mat)) > 0
+        bary = np.full((pairelem.size, 3), -1.0)
+        bary[valid] = np.linalg.solve(mat[valid], rhs[valid][:, :, None])[:, :, 0]
+        hit = valid & np.all(bary >= -tol, axis=1) & (bary.sum(axis=1) <= 1 + tol)
+
+        # the first enclosing element of each point
+        hitpoint, first = np.unique(pairpoint[hit], return_index=True)
+        result[hitpoint] = pairelem[hit][first]
+        return result
+
+    def save(self, filename):
+        np.savez(
+            filename,
+            key=self.key,
+            origin=self.origin,
+            dims=self.dims,
+            cellsize=self.cellsize,
+            cellstart=self.cellstart,
+            cellelem=self.cellelem,
+        )
+
+    @classmethod
+    def load(cls, filename, node, elem):
+        data = np.load(filename)
+        index = cls.__new__(cls)
+        index.key = str(data["key"])
+        index.node = np.asarray(node, dtype=np.float64)
+        index.elem = np.asarray(elem)[:, 0:4].astype(np.int64)
+        index.origin = data["origin"]
+        index.dims = data["dims"]
+        index.cellsize = float(data["cellsize"])
+        index.cellstart = data["cellstart"]
+        index.cellelem = data["cellelem"]
+        index.bounds()
+        return index
+
+
+def GetTetIndex(meshkey, outputdir=None):
+    """Load the index of the current mesh, building and saving it if it is missing or stale
+
+    meshkey identifies the mesh content, e.g. the hash of meshdata.mat
+    """
+    if outputdir is None:
+        outputdir = GetBPWorkFolder()
+    key = (os.path.abspath(outputdir), meshkey)
+    index = g_indexcache.get(key)
+    if index is not None:
+        return index
+
+    node, elem = LoadTetMeshData(outputdir)
+    indexfile = os.path.join(outputdir, "tetindex.npz")
+    index = None
+    if os.path.exists(indexfile):
+        try:
+            index = TetIndex.load(indexfile, node, elem)
+        except (OSError, ValueError, KeyError):
+            pass
+    if index is None or index.key != meshkey:
+        index = TetIndex(node, elem, meshkey)
+        index.save(indexfile)
+
+    g_indexcache[key] = index
+    while len(g_indexcache) > g_indexcachesize:
+        g_indexcache.pop(next(iter(g_indexcache)))
+    return index
+
+
+def FindSourceElem(meshkey, srcpos, outputdir=None):
+    """Return the 1-based enclosing element (cfg.e0) of each source position, -1 if outside"""
+    located = GetTetIndex(meshkey, outputdir).locate(srcpos)
+    return np.where(located >= 0, located + 1, -1)
@@ -24,10 +24,15 @@ To cite this work, please use the below information
 import bpy
 from .blender2mesh import scene2mesh
 from .mesh2blender import mesh2scene
-from .runmmc import runmmc
+from .runmmc import runmmc, loadmmcresult
 from .niifile import niifile
 from .nii2mesh import nii2mesh
 from .obj2surf import object2surf
+from .utils import g_enginestats, g_geomstats
+from .jobqueue import g_jobs, g_lastjob, canceljob
+from .resultcache import g_caches
+from .profiler import g_lastrun, SummarizeRun
+from .meshlod import lodfulldetail, IsLODPreview
 
 
 class BlenderPhotonics_UI(bpy.types.Panel):
@@ -48,6 +53,67 @@ class BlenderPhotonics_UI(bpy.types.Panel):
         rowengine = layout.row()
         rowengine.label(text="Backend:")
         rowengine.prop(bp, "backend", expand=True)
+        rowwarm = layout.row()
+        rowwarm.prop(bp, "prewarm")
+        stats = g_enginestats.get(bp.backend)
+        if stats and stats["starts"] > 0:
+            rowwarm.label(
+                text="saved %.1f s (%d reuses)" % (stats["saved"], stats["reused"])
+            )
+
+        if len(g_jobs) > 0:
+            boxjob = layout.box()
+            job = g_jobs[0]
+            rowjob = boxjob.row()
+            rowjob.label(
+                text="%s: %s (%.0f%%, %.0f s)"
+                % (job.name, job.stage, job.progress * 100, job.elapsed()),
+                icon="SORTTIME",
+            )
+            rowjob.operator(canceljob.bl_idname, text="", icon="CANCEL")
+            if len(g_jobs) > 1:
+                boxjob.label(text="%d job(s) queued" % (len(g_jobs) - 1))
+        elif len(g_lastjob) > 0:
+            layout.label(
+                text="Last job: %s %s in %.1f s"
+                % (g_lastjob["name"], g_lastjob["status"], g_lastjob["elapsed"])
+            )
+
+        if len(g_lastrun) > 0:
+            boxrun = layout.box()
+            summary, slowest = SummarizeRun(g_lastrun)
+            boxrun.label(text="Last run: " + summary, icon="TIME")
+            for line in slowest:
+                boxrun.label(text="  " + line)
+        layout.prop(bp, "reportfile")
+        if g_geomstats["reused"] + g_geomstats["extracted"] > 0:
+            layout.label(
+                text="Exported geometry: %d reused, %d re-extracted"
+                % (g_geomstats["reused"], g_geomstats["extracted"]),
+                icon="MESH_DATA",
+            )
+
+        layout.prop(bp, "faceset")
+        rowlod = layout.row()
+        rowlod.prop(bp, "lodfaces")
+        obj = context.active_object
+        if IsLODPreview(obj):
+            boxlod = layout.box()
+            boxlod.label(
+                text="%s: preview of %d faces (%d shown)"
+                % (obj.name, obj["bp_lodfaces"], len(obj.data.polygons)),
+                icon="MOD_DECIM",
+            )
+            boxlod.operator(lodfulldetail.bl_idname, icon="FULLSCREEN_ENTER")
+
+        rowcache = layout.row()
+        rowcache.prop(bp, "cachesize")
+        for name, cache in g_caches.items():
+            if cache.hits + cache.misses > 0:
+                layout.label(
+                    text="%s cache: %d hits, %d misses, %.0f MB"
+                    % (name, cache.hits, cache.misses, cache.totalsize() / 1048576)
+                )
 
         layout.label(text="Blender2Mesh", icon="SHADING_SOLID")
         colb2m = layout.column()
@@ -115,6 +181,12 @@ class BlenderPhotonics_UI(bpy.types.Panel):
         colmmc = layout.column()
         colmmc.operator(mesh2scene.bl_idname, icon="EDITMODE_HLT")
         colmmc.operator(runmmc.bl_idname, icon="LIGHT_AREA")
+        colmmc.operator_menu_enum(
+            loadmmcresult.bl_idname,
+            "result",
+            text="Load previous simulation",
+            icon="RECOVER_LAST",
+        )
 
         layout.separator()
         layout.label(text="Tutorials and Websites", icon="SHADING_SOLID")
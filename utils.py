@@ -20,40 +20,327 @@ To cite this work, please use the below information
 }
 """
 
-import bpy
 import os
 import tempfile
-import numpy as np
+import threading
+import time
+import importlib
+from .profiler import ProfileStage, ProfileArrays
+
+
+class LazyModule:
+    """Stand-in for a module that is imported when one of its attributes is first used
+
+    Importing NumPy and jdata takes a noticeable part of Blender's startup, so
+    the add-on modules refer to them through LazyModule objects and nothing
+    heavy is loaded until an operator runs.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__["_module"]
+        if module is None:
+            # import_module is thread-safe, a job thread may be the first user
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return getattr(module, attr)
+
+
+np = LazyModule("numpy")
+jd = LazyModule("jdata")
+
+try:
+    import bpy
+    from bpy.app.handlers import persistent
+except ImportError:
+    # allow the backend/file helpers to be used outside of Blender, see batch.py
+    bpy = None
+    persistent = lambda func: func
+
+g_exchangeext = {
+    "jmsh": {"mesh": ".jmsh", "data": ".json", "vol": ".jnii"},
+    "bmsh": {"mesh": ".bmsh", "data": ".bjd", "vol": ".bnii"},
+}
+g_enginepool = {}
+g_enginefailed = set()
+g_enginestats = {}
+g_enginelock = threading.Lock()
+g_warmthreads = {}
+g_slotlocks = {}
+# sessions of these backend names are created by the given functions, e.g. benchmark/fakebackend.py
+g_enginefactory = {}
+# mesh arrays of exported objects, dropped by WatchGeometryChanges when an object changes
+g_geomcache = {}
+g_geomcachesize = 1024
+# vertices whose coordinates are compared before a cached mesh is reused
+g_geomsamples = 64
+g_geomstats = {"reused": 0, "extracted": 0}
+g_geomwatch = False
 
 
 def ShowMessageBox(message="", title="Message Box", icon="INFO"):
     def draw(self, context):
         self.layout.label(text=message)
 
+    if bpy.app.background:
+        print(title + ": " + message)
+        return
     bpy.context.window_manager.popup_menu(draw, title=title, icon=icon)
 
 
+def SetViewportShading(shadingtype, colortype=None):
+    # apply to all 3D views, also works from timers where context.space_data is unset
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type != "VIEW_3D":
+                continue
+            for space in area.spaces:
+                if space.type == "VIEW_3D":
+                    space.shading.type = shadingtype
+                    if colortype is not None:
+                        space.shading.color_type = colortype
+
+
+def GetMeshArrays(obj, dtype="float64", worldspace=True):
+    """Bulk-read the vertices and polygons of a mesh object into NumPy arrays
+
+    Returns (node, face, polyoffset) with 0-based vertex indices. For an
+    all-triangle mesh, face is an (Nf,3) uint32 array and polyoffset is None;
+    otherwise face is the flat uint32 vertex index list of all polygons in a
+    compressed-sparse-row (CSR) layout, with polygon i spanning
+    face[polyoffset[i]:polyoffset[i+1]].
+    """
+    entry = g_geomcache.get(obj.name)
+    if entry is not None:
+        # run the depsgraph handlers of pending edits, e.g. in a script that has not redrawn yet
+        bpy.context.view_layer.update()
+        entry = g_geomcache.get(obj.name)
+    key = GeometryKey(obj, dtype, worldspace)
+    if entry is not None and entry[0] == key:
+        g_geomstats["reused"] += 1
+        with ProfileStage("reuse mesh " + obj.name):
+            ProfileArrays(node=entry[1], face=entry[2])
+        return entry[1:]
+
+    with ProfileStage("export mesh " + obj.name):
+        if obj.get("bp_lodlevel", 0) > 0:
+            # a decimated preview, export its full mesh (meshlod imports this module)
+            from .meshlod import GetFullMeshArrays
+
+            node, face, polyoffset = GetFullMeshArrays(obj, dtype, worldspace)
+        else:
+            node, face, polyoffset = ReadMeshArrays(obj, dtype, worldspace)
+        ProfileArrays(node=node, face=face)
+    g_geomstats["extracted"] += 1
+    if g_geomwatch:
+        StoreGeometry(obj.name, key, node, face, polyoffset)
+    return node, face, polyoffset
+
+
+def GeometryKey(obj, dtype, worldspace):
+    # a cheap fingerprint of the exported geometry, checked on top of the depsgraph invalidation
+    mesh = obj.data
+    # coordinates written without tagging the mesh (foreach_set) do not reach the depsgraph
+    nvert = len(mesh.vertices)
+    step = max(nvert // g_geomsamples, 1)
+    samples = tuple(v for i in range(0, nvert, step) for v in mesh.vertices[i].co)
+    return (
+        mesh.name,
+        mesh.as_pointer(),
+        obj.as_pointer(),
+        len(mesh.vertices),
+        len(mesh.polygons),
+        len(mesh.loops),
+        tuple(v for row in obj.matrix_world for v in row) if worldspace else None,
+        str(dtype),
+        obj.get("bp_lodlevel", 0),
+        samples,
+    )
+
+
+def StoreGeometry(name, key, node, face, polyoffset):
+    # callers share the cached arrays, so they are made read-only
+    for data in (node, face, polyoffset):
+        if data is not None:
+            data.setflags(write=False)
+    g_geomcache.pop(name, None)
+    g_geomcache[name] = (key, node, face, polyoffset)
+    # drop the least recently stored objects beyond g_geomcachesize MB
+    total = sum(
+        sum(d.nbytes for d in e[1:] if d is not None) for e in g_geomcache.values()
+    )
+    while total > g_geomcachesize * 1048576 and len(g_geomcache) > 1:
+        oldest = next(iter(g_geomcache))
+        total -= sum(d.nbytes for d in g_geomcache.pop(oldest)[1:] if d is not None)
+
+
+def ResetGeometryStats():
+    g_geomstats["reused"] = 0
+    g_geomstats["extracted"] = 0
+
+
+@persistent
+def WatchGeometryChanges(scene, depsgraph=None):
+    """depsgraph_update_post handler, drop the cached arrays of objects whose mesh or transform changed"""
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    for update in depsgraph.updates:
+        idblock = update.id.original
+        if isinstance(idblock, bpy.types.Object):
+            if update.is_updated_geometry or update.is_updated_transform:
+                g_geomcache.pop(idblock.name, None)
+        elif isinstance(idblock, bpy.types.Mesh) and update.is_updated_geometry:
+            for name in [n for n, e in g_geomcache.items() if e[0][0] == idblock.name]:
+                g_geomcache.pop(name)
+
+
+@persistent
+def ClearGeometryCache(*args):
+    g_geomcache.clear()
+
+
+def RegisterGeometryWatch():
+    global g_geomwatch
+    bpy.app.handlers.depsgraph_update_post.append(WatchGeometryChanges)
+    bpy.app.handlers.load_post.append(ClearGeometryCache)
+    g_geomwatch = True
+
+
+def UnregisterGeometryWatch():
+    global g_geomwatch
+    g_geomwatch = False
+    g_geomcache.clear()
+    if WatchGeometryChanges in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(WatchGeometryChanges)
+    if ClearGeometryCache in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(ClearGeometryCache)
+
+
+def IsTriangleMesh(obj):
+    # True if all polygons of a mesh object are triangles
+    looptotal = np.empty(len(obj.data.polygons), dtype=np.int32)
+    obj.data.polygons.foreach_get("loop_total", looptotal)
+    return bool(np.all(looptotal == 3))
+
+
+def ReadMeshArrays(obj, dtype, worldspace):
+    mesh = obj.data
+
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    node = co.reshape(-1, 3).astype(dtype)
+    if worldspace:
+        mat = np.array(obj.matrix_world, dtype=dtype)
+        node = node @ mat[:3, :3].T + mat[:3, 3]
+
+    npoly = len(mesh.polygons)
+    loopstart = np.empty(npoly, dtype=np.int32)
+    looptotal = np.empty(npoly, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loopstart)
+    mesh.polygons.foreach_get("loop_total", looptotal)
+    vertexindex = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", vertexindex)
+
+    if npoly > 0 and np.all(looptotal == 3):
+        face = vertexindex[loopstart[:, None] + np.arange(3, dtype=np.int32)]
+        return node, face.astype(np.uint32), None
+
+    polyoffset = np.zeros(npoly + 1, dtype=np.int64)
+    np.cumsum(looptotal, out=polyoffset[1:])
+    loopid = np.arange(polyoffset[-1], dtype=np.int64) + np.repeat(
+        loopstart - polyoffset[:-1], looptotal
+    )
+    return node, vertexindex[loopid].astype(np.uint32), polyoffset
+
+
+def PolyToList(face, polyoffset, base=0):
+    # convert a CSR polygon list to a list of per-polygon index lists (JMesh MeshPoly)
+    return [
+        poly.tolist()
+        for poly in np.split(face.astype(np.int64) + base, polyoffset[1:-1])
+    ]
+
+
 def GetNodeFacefromObject(obj, istrimesh=True):
-    verts = []
-    for n in range(len(obj.data.vertices)):
-        vert = obj.data.vertices[n].co
-        v_global = obj.matrix_world @ vert
-        verts.append(v_global)
-    # edges = [edge.vertices[:] for edge in obj.data.edges]
-    faces = [(np.array(face.vertices[:]) + 1).tolist() for face in obj.data.polygons]
-    v = np.array(verts)
-    try:
-        f = np.array(faces)
-        return {"MeshVertex3": v, "MeshTri3": f}
-    except:
-        f = faces
+    v, f, polyoffset = GetMeshArrays(obj)
+    if (
+        polyoffset is not None
+        and len(polyoffset) > 1
+        and np.all(np.diff(polyoffset) == polyoffset[1])
+    ):
+        # polygons of uniform size are stored as a 2-D array as before
+        f = f.reshape(-1, int(polyoffset[1]))
+        polyoffset = None
+    if polyoffset is None:
+        return {"MeshVertex3": v, "MeshTri3": f + 1}
     return {
-        "_DataInfo_": {"BlenderObjectName", obj.name},
+        "_DataInfo_": {"BlenderObjectName": obj.name},
         "MeshVertex3": v,
-        "MeshPoly": f,
+        "MeshPoly": PolyToList(f, polyoffset, 1),
     }
 
 
+def FaceToCSR(face):
+    # normalize a triangle array, a ragged polygon list, or a (face, polyoffset) pair
+    if isinstance(face, tuple):
+        return np.asarray(face[0], dtype=np.int32).ravel(), face[1]
+    if isinstance(face, np.ndarray) and face.dtype != object:
+        return np.ascontiguousarray(face, dtype=np.int32), None
+    try:
+        return np.asarray(face, dtype=np.int32), None
+    except ValueError:
+        looptotal = np.fromiter((len(poly) for poly in face), dtype=np.int64)
+        polyoffset = np.zeros(len(looptotal) + 1, dtype=np.int64)
+        np.cumsum(looptotal, out=polyoffset[1:])
+        return (
+            np.fromiter(
+                (idx for poly in face for idx in poly),
+                dtype=np.int32,
+                count=polyoffset[-1],
+            ),
+            polyoffset,
+        )
+
+
+def FillMeshFromNodeFace(my_mesh, node, face):
+    """Fill an empty Blender mesh from NumPy node/face arrays with foreach_set
+
+    node is an (Nn,3) array; face is either an (Nf,k) 0-based index array,
+    a ragged list of polygons, or a (face, polyoffset) CSR pair as returned
+    by GetMeshArrays
+    """
+    node = np.ascontiguousarray(node, dtype=np.float32).reshape(-1, 3)
+    face, polyoffset = FaceToCSR(face)
+
+    if polyoffset is None:
+        # fast path: all polygons have the same number of corners (triangles)
+        if face.ndim < 2:
+            face = face.reshape(1, -1) if face.size else face.reshape(0, 3)
+        nface, ncorner = face.shape
+        loopstart = np.arange(0, nface * ncorner, ncorner, dtype=np.int32)
+        looptotal = np.full(nface, ncorner, dtype=np.int32)
+        face = face.ravel()
+    else:
+        nface = len(polyoffset) - 1
+        loopstart = polyoffset[:-1].astype(np.int32)
+        looptotal = np.diff(polyoffset).astype(np.int32)
+
+    my_mesh.vertices.add(node.shape[0])
+    my_mesh.vertices.foreach_set("co", node.ravel())
+    my_mesh.loops.add(face.size)
+    my_mesh.loops.foreach_set("vertex_index", face)
+    my_mesh.polygons.add(nface)
+    my_mesh.polygons.foreach_set("loop_start", loopstart)
+    if bpy.app.version < (4, 0, 0):
+        # loop_total is derived from loop_start since Blender 4.0
+        my_mesh.polygons.foreach_set("loop_total", looptotal)
+
+    my_mesh.update(calc_edges=True)
+
+
 def AddMeshFromNodeFace(node, face, name):
 
     # Create mesh and related object
@@ -69,12 +356,144 @@ def AddMeshFromNodeFace(node, face, name):
     # Link object to the scene collection
     rootcoll.objects.link(my_obj)
 
-    # Create object using blender function
-    my_mesh.from_pydata(node, [], face)
-    my_mesh.update(calc_edges=True)
+    # Create object from contiguous arrays, avoiding per-face Python objects
+    with ProfileStage("create mesh " + name, node=node, face=face):
+        FillMeshFromNodeFace(my_mesh, node, face)
+    return my_obj
+
+
+def NormalizeScalars(values, colorbits=0, vrange=None):
+    # map values (or a fixed [min,max] vrange) to [0,1], optionally quantized to 2^colorbits levels
+    values = np.asarray(values, dtype=np.float32).ravel()
+    if vrange is None:
+        vmin, vmax = np.min(values), np.max(values)
+    else:
+        vmin, vmax = vrange
+    if vmax > vmin:
+        weight = np.clip((values - vmin) / (vmax - vmin), 0.0, 1.0)
+    else:
+        weight = np.zeros_like(values)
+    if colorbits > 0:
+        levels = 2**colorbits - 1
+        weight = np.rint(weight * levels) / levels
+    return weight
+
+
+def ScalarToColor(weight):
+    # jet colormap, returns an (N,4) RGBA float32 array
+    weight = np.asarray(weight, dtype=np.float32)
+    rgba = np.ones((weight.size, 4), dtype=np.float32)
+    rgba[:, 0] = np.clip(1.5 - np.abs(4.0 * weight - 3.0), 0.0, 1.0)
+    rgba[:, 1] = np.clip(1.5 - np.abs(4.0 * weight - 2.0), 0.0, 1.0)
+    rgba[:, 2] = np.clip(1.5 - np.abs(4.0 * weight - 1.0), 0.0, 1.0)
+    return rgba
+
+
+def AddScalarMaterial(obj, name):
+    # emission material that displays a float point attribute through a color ramp
+    mat = bpy.data.materials.get("BP_" + name)
+    if mat is None:
+        mat = bpy.data.materials.new("BP_" + name)
+        mat.use_nodes = True
+        nodes = mat.node_tree.nodes
+        nodes.clear()
+        attrnode = nodes.new("ShaderNodeAttribute")
+        attrnode.attribute_name = name
+        ramp = nodes.new("ShaderNodeValToRGB")
+        emission = nodes.new("ShaderNodeEmission")
+        output = nodes.new("ShaderNodeOutputMaterial")
+        links = mat.node_tree.links
+        links.new(attrnode.outputs["Fac"], ramp.inputs["Fac"])
+        links.new(ramp.outputs["Color"], emission.inputs["Color"])
+        links.new(emission.outputs["Emission"], output.inputs["Surface"])
+    if mat.name not in obj.data.materials:
+        obj.data.materials.append(mat)
+    return mat
+
+
+def SetVertexScalars(
+    obj, values, name="fluence", mode="color", colorbits=0, vrange=None
+):
+    """Write one scalar per vertex to a mesh object
+
+    mode can be
+        'attribute': a float point attribute (rendered via a material)
+        'color': a float attribute plus a per-vertex color attribute
+        'weight': a vertex group for the weight-paint view (legacy)
+    colorbits: number of bits to quantize the normalized values, 0 to disable
+    vrange: [min,max] mapped to [0,1], e.g. to keep the scale fixed across frames
+    """
+    mesh = obj.data
+    if obj.get("bp_lodlevel", 0) > 0:
+        from .meshlod import ReducePreviewValues
+
+        values = ReducePreviewValues(obj, values, (name, mode, colorbits, vrange))
+    elif len(values) != len(mesh.vertices) and "nodeid" in mesh.attributes:
+        # values of all nodes shown on a mesh holding a subset of them
+        values = np.asarray(values).ravel()[GetNodeIdAttribute(obj)]
+    weight = NormalizeScalars(values, colorbits, vrange)
+
+    if mode == "weight":
+        if colorbits <= 0:
+            weight = NormalizeScalars(values, 10, vrange)
+        group = obj.vertex_groups.get(name)
+        if group is None:
+            group = obj.vertex_groups.new(name=name)
+        # sort once, then add all vertices sharing the same level in one call
+        levels, inverse = np.unique(weight, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        splits = np.cumsum(np.bincount(inverse, minlength=len(levels)))[:-1]
+        for level, idx in zip(levels, np.split(order, splits)):
+            group.add(idx.tolist(), float(level), "REPLACE")
+        return
+
+    attr = mesh.attributes.get(name)
+    if attr is None:
+        attr = mesh.attributes.new(name, "FLOAT", "POINT")
+    attr.data.foreach_set("value", weight)
+
+    if mode == "color":
+        colorname = name + "_color"
+        if hasattr(mesh, "color_attributes"):
+            colorattr = mesh.color_attributes.get(colorname)
+            if colorattr is None:
+                colorattr = mesh.color_attributes.new(colorname, "FLOAT_COLOR", "POINT")
+            mesh.color_attributes.active_color = colorattr
+        else:
+            colorattr = mesh.attributes.get(colorname)
+            if colorattr is None:
+                colorattr = mesh.attributes.new(colorname, "FLOAT_COLOR", "POINT")
+        colorattr.data.foreach_set("color", ScalarToColor(weight).ravel())
+    else:
+        AddScalarMaterial(obj, name)
+
+    mesh.update()
+
+
+def ShowFluence(obj, logflux, colormode="color", colorbits=0):
+    # attach the simulated fluence to the mesh and switch the viewport to display it
+    bpy.context.view_layer.objects.active = obj
+    if colormode == "weight":
+        SetVertexScalars(obj, logflux, "weight", "weight", colorbits)
+        bpy.ops.object.mode_set(mode="WEIGHT_PAINT")
+        SetViewportShading("SOLID")
+        print(
+            "Finshed!, Please change intereaction mode to Weight Paint to see result!"
+        )
+        print(
+            """If you prefer a perspective effect，please go to edit mode and make sure shading 'Vertex Group Weight' is on."""
+        )
+    elif colormode == "color":
+        SetVertexScalars(obj, logflux, "fluence", "color", colorbits)
+        SetViewportShading("SOLID", "VERTEX")
+    else:
+        SetVertexScalars(obj, logflux, "fluence", "attribute", colorbits)
+        SetViewportShading("MATERIAL")
 
 
 def GetBPWorkFolder():
+    if os.environ.get("BLENDERPHOTONICS_WORKDIR"):
+        return os.environ["BLENDERPHOTONICS_WORKDIR"]
     if os.name == "nt":
         return os.path.join(
             tempfile.gettempdir(),
@@ -89,8 +508,349 @@ def GetBPWorkFolder():
         )
 
 
-def LoadReginalMesh(meshdata, name):
+def GetBPScriptFolder():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "script")
+
+
+def GetBackendName():
+    try:
+        return bpy.context.scene.blender_photonics.backend
+    except AttributeError:
+        return "octave"
+
+
+def StartBackendEngine(backend="octave"):
+    if backend in g_enginefactory:
+        return g_enginefactory[backend]()
+    try:
+        if backend == "octave":
+            import oct2py as op
+
+            oc = op.Oct2Py()
+        else:
+            import matlab.engine as op
+
+            oc = op.start_matlab()
+    except ImportError:
+        raise ImportError(
+            "To run this feature, you must install the `oct2py` or `matlab.engine` Python module first, based on your choice of the backend"
+        )
+
+    oc.addpath(oc.genpath(GetBPScriptFolder()))
+    return oc
+
+
+def StopBackendEngine(oc):
+    try:
+        if hasattr(oc, "exit"):
+            oc.exit()
+        else:
+            oc.quit()
+    except Exception:
+        pass
+
+
+def IsBackendAlive(oc):
+    # a round-trip that also verifies the script path is still set
+    try:
+        oc.feval("bpmwpath", "")
+        return True
+    except Exception:
+        return False
+
+
+def GetEngineStats(backend):
+    return g_enginestats.setdefault(
+        backend, {"startup": 0.0, "starts": 0, "reused": 0, "saved": 0.0}
+    )
+
+
+def GetBackendEngine(backend=None, slot=0):
+    """Return a shared Octave/MATLAB session, starting or restarting it if needed
+
+    The session is created once per backend and reused by all operators; the
+    time spent on starting the engine and setting up the search path is
+    recorded so that each reuse can report how much time it saved. Parallel
+    workers use separate sessions by passing different slot numbers. Only a
+    session whose last call raised (see MarkBackendFailed) is checked for
+    being alive before it is handed out again.
+    """
+    if backend is None:
+        backend = GetBackendName()
+    key = (backend, slot)
+
+    # wait for a pending background warm-up instead of starting a second engine
+    waited = 0.0
+    warmthread = g_warmthreads.get(key)
+    if warmthread is not None and warmthread.is_alive():
+        t0 = time.perf_counter()
+        warmthread.join()
+        waited = time.perf_counter() - t0
+
+    with g_enginelock:
+        slotlock = g_slotlocks.setdefault(key, threading.Lock())
+
+    with slotlock:
+        stats = GetEngineStats(backend)
+        oc = g_enginepool.get(key)
+        failed = key in g_enginefailed
+        g_enginefailed.discard(key)
+        if oc is not None and failed and not IsBackendAlive(oc):
+            print(
+                "BlenderPhotonics: "
+                + backend
+                + " session is not responding, restarting"
+            )
+            StopBackendEngine(oc)
+            del g_enginepool[key]
+            oc = None
+
+        if oc is None:
+            t0 = time.perf_counter()
+            oc = StartBackendEngine(backend)
+            stats["startup"] = time.perf_counter() - t0
+            stats["starts"] += 1
+            g_enginepool[key] = oc
+            print(
+                "BlenderPhotonics: started %s session #%d in %.2f s"
+                % (backend, slot, stats["startup"])
+            )
+        else:
+            saved = max(stats["startup"] - waited, 0.0)
+            stats["reused"] += 1
+            stats["saved"] += saved
+            print(
+                "BlenderPhotonics: reused %s session #%d, saved %.2f s (%.2f s in total)"
+                % (backend, slot, saved, stats["saved"])
+            )
+    return oc
+
+
+def WarmBackendEngine(backend=None, slot=0):
+    """Start the backend session in a background thread if not already running"""
+    if backend is None:
+        backend = GetBackendName()
+    key = (backend, slot)
+    if key in g_enginepool:
+        return
+    warmthread = g_warmthreads.get(key)
+    if warmthread is not None and warmthread.is_alive():
+        return
+
+    def warm():
+        with g_enginelock:
+            slotlock = g_slotlocks.setdefault(key, threading.Lock())
+        with slotlock:
+            if key in g_enginepool:
+                return
+            stats = GetEngineStats(backend)
+            t0 = time.perf_counter()
+            try:
+                g_enginepool[key] = StartBackendEngine(backend)
+            except Exception as e:
+                print(
+                    "BlenderPhotonics: failed to pre-start " + backend + ": " + str(e)
+                )
+                return
+            stats["startup"] = time.perf_counter() - t0
+            stats["starts"] += 1
+            print(
+                "BlenderPhotonics: pre-started %s session #%d in %.2f s"
+                % (backend, slot, stats["startup"])
+            )
+
+    warmthread = threading.Thread(target=warm, daemon=True)
+    g_warmthreads[key] = warmthread
+    warmthread.start()
+
+
+def PrewarmBackendTimer():
+    # run as a one-shot bpy.app.timers callback, scene data is not accessible during register()
+    try:
+        bp = bpy.context.scene.blender_photonics
+    except AttributeError:
+        return None
+    if bp.prewarm:
+        WarmBackendEngine(bp.backend)
+    return None
+
+
+def MarkBackendFailed(backend, slot=0):
+    # a call on this session raised, check that it is still alive before reusing it
+    g_enginefailed.add((backend, slot))
+
+
+def DiscardBackendEngine(backend, slot=0):
+    # stop a session, e.g. to abort a running call; it is restarted on next use
+    oc = g_enginepool.pop((backend, slot), None)
+    if oc is not None:
+        StopBackendEngine(oc)
+
+
+def SetBackendWorkFolder(oc, outputdir):
+    # redirect bpmwpath() of this session, so parallel sessions do not share files
+    if not os.path.isdir(outputdir):
+        os.makedirs(outputdir)
+    oc.feval("setenv", "BLENDERPHOTONICS_WORKDIR", outputdir, nargout=0)
+
+
+def RestoreBackendWorkFolder(oc, backend, slot, outputdir):
+    # undo SetBackendWorkFolder() unless the session was discarded, e.g. by a cancelled job
+    if g_enginepool.get((backend, slot)) is not oc:
+        return
+    try:
+        SetBackendWorkFolder(oc, outputdir)
+    except Exception:
+        # a session that can not be redirected back must not be reused
+        DiscardBackendEngine(backend, slot)
+
+
+def CloseBackendEngines():
+    with g_enginelock:
+        for oc in g_enginepool.values():
+            StopBackendEngine(oc)
+        g_enginepool.clear()
+
+
+def GetExchangeFormat():
+    # return the (format, compression) pair for intermediate files
+    try:
+        bp = bpy.context.scene.blender_photonics
+        fmt, compression = bp.exchange, bp.compression
+    except AttributeError:
+        fmt, compression = "jmsh", "none"
+    if fmt == "bmsh":
+        try:
+            import bjdata
+        except ImportError:
+            print("BlenderPhotonics: bjdata is not installed, using text JMesh instead")
+            fmt = "jmsh"
+    return fmt, compression
+
+
+def GetFaceSet():
+    # faces of a tetrahedral mesh imported for display, see meshface.SelectFaces
+    try:
+        return bpy.context.scene.blender_photonics.faceset
+    except AttributeError:
+        return "all"
+
+
+def GetExchangeParam():
+    # exchange settings passed to the backend scripts
+    fmt, compression = GetExchangeFormat()
+    return {
+        "exchange": fmt,
+        "compression": "" if compression == "none" else compression,
+        # region surfaces are extracted from tetmesh in Python, see meshface.py
+        "savesurf": 0,
+        "faceset": GetFaceSet(),
+    }
+
+
+def GetExchangeFile(basename, kind="mesh", fmt=None, outputdir=None):
+    if fmt is None:
+        fmt = GetExchangeFormat()[0]
+    if outputdir is None:
+        outputdir = GetBPWorkFolder()
+    return os.path.join(outputdir, basename + g_exchangeext[fmt][kind])
+
+
+def FindExchangeFile(basename, kind="mesh", outputdir=None):
+    # locate an intermediate file written in any exchange format, newest first
+    found = [
+        GetExchangeFile(basename, kind, fmt, outputdir)
+        for fmt in g_exchangeext
+        if os.path.exists(GetExchangeFile(basename, kind, fmt, outputdir))
+    ]
+    if len(found) == 0:
+        raise FileNotFoundError(
+            "BlenderPhotonics: can not find "
+            + GetExchangeFile(basename, kind, outputdir=outputdir)
+        )
+    return max(found, key=os.path.getmtime)
+
+
+def RemoveExchangeFile(basename, kind="mesh", outputdir=None):
+    for fmt in g_exchangeext:
+        fname = GetExchangeFile(basename, kind, fmt, outputdir)
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def SaveExchangeFile(data, basename, kind="mesh", outputdir=None):
+    fmt, compression = GetExchangeFormat()
+    fname = GetExchangeFile(basename, kind, fmt, outputdir)
+    RemoveExchangeFile(basename, kind, outputdir)
+    opt = {} if compression == "none" else {"compression": compression}
+    t0 = time.perf_counter()
+    with ProfileStage("save " + os.path.basename(fname)) as entry:
+        jd.save(data, fname, opt)
+        if entry is not None:
+            entry["filesize"] = os.path.getsize(fname) / 1048576
+    print(
+        "BlenderPhotonics: saved %s (%.2f MB) in %.3f s"
+        % (fname, os.path.getsize(fname) / 1048576, time.perf_counter() - t0)
+    )
+    return fname
+
+
+def GetMeshOutputFiles(outputdir=None):
+    # files written by blendersavemesh, used to cache and restore a mesh
+    if outputdir is None:
+        outputdir = GetBPWorkFolder()
+    files = [os.path.join(outputdir, "meshdata.mat")]
+    for basename in ("tetmesh", "volumemesh", "regionmesh"):
+        for fmt in g_exchangeext:
+            files.append(GetExchangeFile(basename, "mesh", fmt, outputdir))
+    return [f for f in files if os.path.exists(f)]
+
+
+def LoadExchangeFile(basename, kind="mesh", outputdir=None):
+    fname = FindExchangeFile(basename, kind, outputdir)
+    t0 = time.perf_counter()
+    with ProfileStage("load " + os.path.basename(fname)) as entry:
+        data = jd.load(fname)
+        if entry is not None:
+            entry["filesize"] = os.path.getsize(fname) / 1048576
+    print(
+        "BlenderPhotonics: loaded %s (%.2f MB) in %.3f s"
+        % (fname, os.path.getsize(fname) / 1048576, time.perf_counter() - t0)
+    )
+    return data
+
+
+def CompactMesh(node, face):
+    # keep only the nodes referenced by face; nodeid maps new indices to the input nodes
+    face = np.asarray(face)
+    nodeid, newface = np.unique(face, return_inverse=True)
+    return (
+        np.asarray(node)[nodeid],
+        newface.reshape(face.shape).astype(np.uint32),
+        nodeid,
+    )
+
+
+def SetNodeIdAttribute(obj, nodeid, name="nodeid"):
+    # store the global (0-based) node index of each vertex as an integer attribute
+    attr = obj.data.attributes.get(name)
+    if attr is None:
+        attr = obj.data.attributes.new(name, "INT", "POINT")
+    attr.data.foreach_set("value", np.asarray(nodeid, dtype=np.int32))
+
+
+def GetNodeIdAttribute(obj, name="nodeid"):
+    attr = obj.data.attributes.get(name)
+    if attr is None:
+        return None
+    nodeid = np.empty(len(obj.data.vertices), dtype=np.int32)
+    attr.data.foreach_get("value", nodeid)
+    return nodeid
+
+
+def LoadReginalMesh(meshdata, name, keepnodeid=True):
     n = len(meshdata.keys()) - 1
+    node = np.asarray(meshdata["MeshVertex3"])
 
     # To import mesh.ply in batches
     bbx = {
@@ -104,19 +864,15 @@ def LoadReginalMesh(meshdata, name):
         if not isinstance(meshdata[surfkey], np.ndarray):
             meshdata[surfkey] = np.asarray(meshdata[surfkey], dtype=np.uint32)
         meshdata[surfkey] -= 1
-        bbx["min"] = np.amin(
-            np.vstack((bbx["min"], np.amin(meshdata["MeshVertex3"], axis=0))),
-            axis=0,
-        )
-        bbx["max"] = np.amax(
-            np.vstack((bbx["max"], np.amax(meshdata["MeshVertex3"], axis=0))),
-            axis=0,
-        )
-        AddMeshFromNodeFace(
-            meshdata["MeshVertex3"],
-            meshdata[surfkey].tolist(),
-            name + str(i + 1),
-        )
+
+        # each region only stores the nodes its own surface references
+        regionnode, regionface, nodeid = CompactMesh(node, meshdata[surfkey])
+        if regionnode.shape[0] > 0:
+            bbx["min"] = np.minimum(bbx["min"], np.amin(regionnode, axis=0))
+            bbx["max"] = np.maximum(bbx["max"], np.amax(regionnode, axis=0))
+        obj = AddMeshFromNodeFace(regionnode, regionface, name + str(i + 1))
+        if keepnodeid:
+            SetNodeIdAttribute(obj, nodeid)
     print(bbx)
     return bbx
 
@@ -125,7 +881,7 @@ def LoadTetMesh(meshdata, name):
     if not isinstance(meshdata["MeshTri3"], np.ndarray):
         meshdata["MeshTri3"] = np.asarray(meshdata["MeshTri3"], dtype=np.uint32)
     meshdata["MeshTri3"] -= 1
-    AddMeshFromNodeFace(meshdata["MeshVertex3"], meshdata["MeshTri3"].tolist(), name)
+    AddMeshFromNodeFace(meshdata["MeshVertex3"], meshdata["MeshTri3"], name)
 
 
 def JMeshFallback(meshobj):